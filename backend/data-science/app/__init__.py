@@ -2,9 +2,14 @@
 Module responsible for creating the Flask application and setting up routes.
 """
 
-from flask import Flask
+from flask import Flask, Response
 from flask_restx import Api
-from app.middlewares import ErrorHandlerMiddleware
+from app.middlewares import (
+    CompressionMiddleware,
+    ErrorHandlerMiddleware,
+    MetricsMiddleware,
+    UploadStreamMiddleware,
+)
 
 def add_health_check_endpoint(app):
     """
@@ -21,6 +26,26 @@ def add_health_check_endpoint(app):
         """
         return {"status": "healthy"}
 
+def add_metrics_endpoint(app):
+    """
+    Adds the metrics endpoint to the Flask application, if metrics are enabled.
+
+    :param app: The Flask application.
+    """
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    @app.route("/metrics")
+    def metrics():
+        """
+        Metrics endpoint exposing the metrics of this worker process.
+
+        :return: The metrics in the Prometheus text format.
+        """
+        from app.services import metrics_service
+
+        return Response(metrics_service.render(), mimetype="text/plain; version=0.0.4")
+
 def add_api_routes(app):
     """
     Adds API routes and namespaces to the Flask application.
@@ -42,6 +67,26 @@ def add_api_routes(app):
     # Add namespaces to the API
     api.add_namespace(data_processing_api)
 
+def configure_services(app):
+    """
+    Applies the application configuration to the services.
+
+    :param app: The Flask application.
+    """
+    from app.services import (
+        data_processing_service,
+        dataset_cache_service,
+        metrics_service,
+        stream_buffer_service,
+        worker_pool_service,
+    )
+
+    data_processing_service.configure(app.config)
+    dataset_cache_service.configure(app.config)
+    metrics_service.configure(app.config)
+    stream_buffer_service.configure(app.config)
+    worker_pool_service.configure(app.config)
+
 def create_app(mode, config):
     """
     Creates and configures a Flask application.
@@ -53,13 +98,29 @@ def create_app(mode, config):
     app = Flask(__name__)
     app.config.from_object(config)
 
+    # Apply the configuration to the services
+    configure_services(app)
+
     # Add health check endpoint
     add_health_check_endpoint(app)
 
+    # Add metrics endpoint
+    add_metrics_endpoint(app)
+
     # Add API routes and namespaces
     add_api_routes(app)
 
     # Apply the error handling middleware
     ErrorHandlerMiddleware(app)
 
+    # Apply the upload buffering middleware
+    UploadStreamMiddleware(app)
+
+    # Apply the metrics middleware, which extends the request class of the upload middleware
+    MetricsMiddleware(app)
+
+    # Apply the compression middleware, after the metrics middleware, so the
+    # compressed bytes are counted as sent
+    CompressionMiddleware(app)
+
     return app
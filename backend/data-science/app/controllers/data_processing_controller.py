@@ -1,7 +1,38 @@
-from app.errors import FailedToParseError
-from app.services import data_processing_service
-from flask import Response, stream_with_context
-from flask_restx import Namespace, Resource
+import json
+from functools import partial
+from itertools import chain
+
+from app.errors import (
+    DatasetNotFoundError,
+    FailedToParseError,
+    InvalidSelectionError,
+    NoCoordinatesError,
+    ServiceBusyError,
+)
+from app.services import (
+    data_processing_service,
+    dataset_cache_service,
+    stream_buffer_service,
+    worker_pool_service,
+)
+from app.services.batch_upload import expand_batch_upload
+from app.services.columnar_format import MEDIA_TYPE as COLUMNAR_MEDIA_TYPE
+from app.services.data_processing_service import (
+    FULL_SCHEMA,
+    INDEXED_TIME_LAYOUT,
+    SCHEMAS,
+    TIME_LAYOUTS,
+)
+from app.services.downsampling import AGGREGATIONS, FIRST
+from app.services.statistics import DEFAULT_HISTOGRAM_BINS, DEFAULT_PERCENTILES
+from app.services.stream_framing import (
+    MEDIA_TYPES as FRAMING_MEDIA_TYPES,
+    NDJSON_FRAMING,
+    SENTINEL_FRAMING,
+)
+from app.services.tile_pyramid import DEFAULT_TILE_SIZE
+from flask import Response, current_app, request, stream_with_context
+from flask_restx import Namespace, Resource, inputs
 from werkzeug.datastructures import FileStorage
 
 # Create a Namespace for the API endpoints
@@ -11,53 +42,304 @@ api = Namespace("convert-netcdf-to-json", description="Data Processing operation
 upload_parser = api.parser()
 upload_parser.add_argument("file", type=FileStorage, location="files", required=True)
 
+# Define a parser for the metadata options
+metadata_options_parser = api.parser()
+metadata_options_parser.add_argument("header_only", type=inputs.boolean, location="args", required=False, default=False)
+metadata_options_parser.add_argument("details", type=inputs.boolean, location="args", required=False, default=False)
+
+# Define a parser for NetCDF metadata conversion
+metadata_parser = upload_parser.copy()
+metadata_parser.add_argument("header_only", type=inputs.boolean, location="args", required=False, default=False)
+metadata_parser.add_argument("details", type=inputs.boolean, location="args", required=False, default=False)
+
+# Supported output formats of the data endpoints and their media types
+OUTPUT_FORMATS = {"json": "application/json", "columnar": COLUMNAR_MEDIA_TYPE}
+
+# Define a parser for the output format, which overrides the Accept header
+output_format_parser = api.parser()
+output_format_parser.add_argument("output_format", type=str, choices=list(OUTPUT_FORMATS), location="args", required=False)
+
+# Define a parser for NetCDF data conversion
+data_parser = upload_parser.copy()
+data_parser.add_argument("output_format", type=str, choices=list(OUTPUT_FORMATS), location="form", required=False)
+
+def get_output_format(args):
+    """
+    Returns the requested output format, from the output_format field or the Accept header.
+    """
+    if args.get("output_format"):
+        return args["output_format"]
+    media_type = request.accept_mimetypes.best_match(OUTPUT_FORMATS.values(), default=OUTPUT_FORMATS["json"])
+    return next(name for name, value in OUTPUT_FORMATS.items() if value == media_type)
+
+def create_stream_response(stream, mimetype, prefetch=False, compressible=True):
+    """
+    Creates the streamed response of an admitted conversion stream.
+    With prefetch, the first chunk is produced before the response starts, so its errors are raised here.
+    Compressible responses (the bulk outputs) are compressed by the CompressionMiddleware.
+    The stream is also closed when the response is closed before its first chunk was requested,
+    which stream_with_context does not pass on, so the admission slot is always released.
+    """
+    body = stream
+    if prefetch:
+        first = next(stream, None)
+        if first is not None:
+            body = chain([first], stream)
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.call_on_close(stream.close)
+    response.compressible = compressible
+    return response
+
+def create_data_response(netCDF4_file, output_format):
+    """
+    Creates the streamed response with the data of a NetCDF file in the requested format.
+    """
+    if output_format == "columnar":
+        generator = data_processing_service.convert_netcdf_data_to_columnar(netCDF4_file)
+    else:
+        generator = data_processing_service.convert_netcdf_data_to_json(netCDF4_file)
+    generator = stream_buffer_service.buffer(worker_pool_service.admit(generator))
+    return create_stream_response(generator, OUTPUT_FORMATS[output_format])
+
+def create_cerv2_response(netCDF4_file, options, output_format, json_options=None):
+    """
+    Creates the streamed response with the CERV2 chunks of a NetCDF file in the requested format.
+    JSON records are delimited with the requested framing and use the requested time layout and schema,
+    and can be restricted to a range of sequence numbers to resume or split a stream.
+    """
+    json_options = json_options or {"framing": SENTINEL_FRAMING}
+    if output_format == "columnar":
+        if json_options.get("start") or json_options.get("max_records") is not None:
+            raise InvalidSelectionError("start and max_records are only supported by the JSON output.")
+        if json_options.get("schema", FULL_SCHEMA) != FULL_SCHEMA or json_options.get("precision") is not None:
+            raise InvalidSelectionError("schema and precision are only supported by the JSON output.")
+        generator = data_processing_service.convert_cerv2_data_to_columnar_chunks(netCDF4_file, **options)
+        mimetype = OUTPUT_FORMATS[output_format]
+    else:
+        generator = data_processing_service.convert_cerv2_data_to_json_chunks(netCDF4_file, **options, **json_options)
+        mimetype = FRAMING_MEDIA_TYPES[json_options["framing"]]
+    generator = stream_buffer_service.buffer(worker_pool_service.admit(generator))
+    return create_stream_response(generator, mimetype)
+
 # Endpoint to convert NetCDF metadata to JSON
 @api.route("/metadata")
-@api.expect(upload_parser)
+@api.expect(metadata_parser)
 class ConvertNetCDFMetadataToJSON(Resource):
     @api.response(200, "Success")
     @api.response(400, "Bad Request")
     def post(self):
         """
         Uploads a NetCDF file and converts its metadata to JSON.
+
+        With header_only, the metadata of classic NetCDF files is read from the
+        beginning of the upload, without receiving and storing the whole file first.
         """
+        options = metadata_options_parser.parse_args()
+        if options["header_only"] and "boundary" in request.mimetype_params:
+            try:
+                json_generator = data_processing_service.convert_netcdf_header_to_json(
+                    request.stream,
+                    request.mimetype_params["boundary"],
+                    request.content_length,
+                    options["details"],
+                )
+                # Parse the header before the response starts, to report invalid files
+                first = next(json_generator)
+            except Exception as e:
+                raise FailedToParseError("Failed to parse the provided NetCDF file.")
+            return Response(stream_with_context(chain([first], json_generator)), mimetype="application/json")
+
         args = upload_parser.parse_args()
         netCDF4_file = args["file"]
 
         try:
             # TODO: Validate the file before sending the response
-            json_generator = data_processing_service.convert_netcdf_metadata_to_json(netCDF4_file)
+            json_generator = data_processing_service.convert_netcdf_metadata_to_json(netCDF4_file, options["details"])
             return Response(stream_with_context(json_generator), mimetype="application/json")
         except Exception as e:
             raise FailedToParseError("Failed to parse the provided NetCDF file.")
 
 # Endpoint to convert NetCDF data to JSON
 @api.route("/data")
-@api.expect(upload_parser)
+@api.expect(data_parser)
 class ConvertNetCDFDataToJSON(Resource):
     @api.response(200, "Success")
     @api.response(400, "Bad Request")
     def post(self):
         """
-        Uploads a NetCDF file and converts its data to JSON.
+        Uploads a NetCDF file and converts its data to JSON or the binary columnar format.
         """
-        args = upload_parser.parse_args()
+        args = data_parser.parse_args()
         netCDF4_file = args["file"]
+        output_format = get_output_format(args)
 
         try:
             # TODO: Validate the file before sending the response
-            json_generator = data_processing_service.convert_netcdf_data_to_json(netCDF4_file)
-            return Response(stream_with_context(json_generator), mimetype="application/json")
+            return create_data_response(netCDF4_file, output_format)
+        except ServiceBusyError:
+            raise
         except Exception as e:
             raise FailedToParseError("Failed to parse the provided NetCDF file.")
 
+# Define a parser for the options of the statistics
+statistics_options_parser = api.parser()
+statistics_options_parser.add_argument("filter_variables", type=str, location="form", required=False)
+statistics_options_parser.add_argument("bins", type=inputs.positive, location="form", required=False, default=DEFAULT_HISTOGRAM_BINS)
+statistics_options_parser.add_argument("percentiles", type=str, location="form", required=False)
+statistics_options_parser.add_argument("per_time_step", type=inputs.boolean, location="form", required=False, default=False)
+
+# Define a parser for the statistics of an uploaded file
+statistics_parser = statistics_options_parser.copy()
+statistics_parser.add_argument("file", type=FileStorage, location="files", required=True)
+
+def parse_statistics_options(args):
+    """
+    Converts the parsed form fields of a statistics request to service arguments.
+    The percentiles are given as comma separated numbers between 0 and 100.
+    """
+    percentiles = DEFAULT_PERCENTILES
+    if args.get("percentiles"):
+        try:
+            percentiles = [float(q) for q in args["percentiles"].split(",")]
+        except ValueError:
+            percentiles = None
+        if not percentiles or not all(0 <= q <= 100 for q in percentiles):
+            raise InvalidSelectionError("The percentiles must be comma separated numbers between 0 and 100.")
+    return {
+        "filter": args.get("filter_variables").split(",") if args.get("filter_variables") else [],
+        "bins": args.get("bins") or DEFAULT_HISTOGRAM_BINS,
+        "percentiles": percentiles,
+        "per_time_step": bool(args.get("per_time_step")),
+    }
+
+def create_statistics_response(netCDF4_file, options):
+    """
+    Creates the streamed response with the statistics of the variables of a NetCDF file.
+    """
+    generator = data_processing_service.convert_netcdf_statistics_to_json(netCDF4_file, **options)
+    generator = stream_buffer_service.buffer(worker_pool_service.admit(generator))
+    # the statistics are small, compressing them costs more time than it saves
+    return create_stream_response(generator, "application/json", compressible=False)
+
+# Endpoint to compute the statistics of the variables of a NetCDF file
+@api.route("/statistics")
+@api.expect(statistics_parser)
+class ComputeNetCDFStatistics(Resource):
+    @api.response(200, "Success")
+    @api.response(400, "Bad Request")
+    def post(self):
+        """
+        Uploads a NetCDF file and computes the statistics and histograms of its numeric variables,
+        optionally per time step, in a single pass over every variable.
+        """
+        args = statistics_parser.parse_args()
+        netCDF4_file = args["file"]
+        options = parse_statistics_options(args)
+
+        try:
+            return create_statistics_response(netCDF4_file, options)
+        except ServiceBusyError:
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+
+# Define a parser for the options of the CERV2 data conversion
+cerv2_options_parser = api.parser()
+cerv2_options_parser.add_argument("filter_variables", type=str, location="form", required=True)
+cerv2_options_parser.add_argument("longitude_range", type=str, location="form", required=False)
+cerv2_options_parser.add_argument("latitude_range", type=str, location="form", required=False)
+cerv2_options_parser.add_argument("bbox", type=str, location="form", required=False)
+cerv2_options_parser.add_argument("polygon", type=str, location="form", required=False)
+cerv2_options_parser.add_argument("step_size", type=inputs.positive, location="form", required=True)
+cerv2_options_parser.add_argument("batch_rows", type=int, location="form", required=False)
+cerv2_options_parser.add_argument("aggregation", type=str, choices=list(AGGREGATIONS), location="form", required=False, default=FIRST)
+cerv2_options_parser.add_argument("time_step", type=inputs.positive, location="form", required=False, default=1)
+cerv2_options_parser.add_argument("output_format", type=str, choices=list(OUTPUT_FORMATS), location="form", required=False)
+cerv2_options_parser.add_argument("time_range", type=str, location="form", required=False)
+cerv2_options_parser.add_argument("framing", type=str, choices=list(FRAMING_MEDIA_TYPES), location="form", required=False, default=SENTINEL_FRAMING)
+cerv2_options_parser.add_argument("time_layout", type=str, choices=list(TIME_LAYOUTS), location="form", required=False, default=INDEXED_TIME_LAYOUT)
+cerv2_options_parser.add_argument("start", type=inputs.natural, location="form", required=False, default=0)
+cerv2_options_parser.add_argument("max_records", type=inputs.natural, location="form", required=False)
+cerv2_options_parser.add_argument("schema", type=str, choices=list(SCHEMAS), location="form", required=False, default=FULL_SCHEMA)
+cerv2_options_parser.add_argument("precision", type=inputs.natural, location="form", required=False)
+cerv2_options_parser.add_argument("partitions", type=inputs.positive, location="form", required=False, default=1)
+cerv2_options_parser.add_argument("partition", type=inputs.natural, location="form", required=False, default=0)
+
 # Define a parser for CERV2 data conversion
-cerv2_parser = api.parser()
+cerv2_parser = cerv2_options_parser.copy()
 cerv2_parser.add_argument("file", type=FileStorage, location="files", required=True)
-cerv2_parser.add_argument("filter_variables", type=str, location="form", required=True)
-cerv2_parser.add_argument("longitude_range", type=str, location="form", required=False)
-cerv2_parser.add_argument("latitude_range", type=str, location="form", required=False)
-cerv2_parser.add_argument("step_size", type=str, location="form", required=True)
+
+def parse_cerv2_options(args):
+    """
+    Converts the parsed form fields of a CERV2 request to service arguments.
+    With partitions, the grid rows are split into disjoint bands, which can be
+    converted by concurrent requests, one per partition.
+    """
+    partitions = args.get("partitions") or 1
+    partition = args.get("partition") or 0
+    if partition >= partitions:
+        raise InvalidSelectionError(f"The partition must be less than the number of partitions ({partitions}).")
+    return {
+        "filter": args.get("filter_variables").split(",") if args.get("filter_variables") else [],
+        "longitude_range": args.get("longitude_range").split(",") if args.get("longitude_range") else [],
+        "latitude_range": args.get("latitude_range").split(",") if args.get("latitude_range") else [],
+        "step_size": int(args["step_size"]),
+        "batch_rows": args.get("batch_rows") or current_app.config["CERV2_BATCH_ROWS"],
+        "aggregation": args.get("aggregation") or FIRST,
+        "time_step": args.get("time_step") or 1,
+        "time_range": args.get("time_range").split(",") if args.get("time_range") else [],
+        "partitions": partitions,
+        "partition": partition,
+    }
+
+def resolve_geo_selection(args, get_spatial_index):
+    """
+    Resolves the bbox ("min_lon,min_lat,max_lon,max_lat") or polygon ([[lon, lat], ...])
+    field of a CERV2 request to longitude and latitude index ranges.
+    The spatial index is only built if one of the fields is set.
+    Returns None without a geographic selection.
+    """
+    try:
+        if args.get("bbox"):
+            return get_spatial_index().resolve_bbox(args["bbox"].split(","))
+        if args.get("polygon"):
+            return get_spatial_index().resolve_polygon(json.loads(args["polygon"]))
+    except (TypeError, ValueError, NoCoordinatesError) as e:
+        raise InvalidSelectionError(f"Invalid geographic selection: {e}")
+    return None
+
+def create_cached_response(handle, create_response):
+    """
+    Creates the response of a cached dataset with create_response(file_path).
+    The dataset is pinned until the response is closed, so it is not evicted before the stream has read it.
+    """
+    file_path = dataset_cache_service.pin(handle)
+    try:
+        response = create_response(file_path)
+    except BaseException:
+        dataset_cache_service.unpin(handle)
+        raise
+    response.call_on_close(partial(dataset_cache_service.unpin, handle))
+    return response
+
+def get_cached_spatial_index(handle):
+    """
+    Returns the spatial index of a cached dataset, which is built once per dataset.
+    """
+    return dataset_cache_service.memoize(handle, "spatial-index", data_processing_service.build_spatial_index)
+
+def parse_cerv2_json_options(args):
+    """
+    Converts the parsed form fields of the JSON output of a CERV2 request to service arguments.
+    """
+    return {
+        "framing": args.get("framing") or SENTINEL_FRAMING,
+        "time_layout": args.get("time_layout") or INDEXED_TIME_LAYOUT,
+        "start": args.get("start") or 0,
+        "max_records": args.get("max_records"),
+        "schema": args.get("schema") or FULL_SCHEMA,
+        "precision": args.get("precision"),
+    }
 
 # Endpoint to convert CERV2 data to JSON chunks
 @api.route("/cerv2-data-chunks")
@@ -67,20 +349,293 @@ class ConvertCERV2DataToJSONChunks(Resource):
     @api.response(400, "Bad Request")
     def post(self):
         """
-        Uploads a NetCDF file and converts its CERV2 data to JSON chunks.
+        Uploads a NetCDF file and converts its CERV2 data to JSON or columnar chunks.
         """
         args = cerv2_parser.parse_args()
         netCDF4_file = args["file"]
-        filter_variables = args.get("filter_variables").split(",") if args.get("filter_variables") else []
+        options = parse_cerv2_options(args)
+        output_format = get_output_format(args)
+
+        try:
+            geo_ranges = resolve_geo_selection(args, lambda: data_processing_service.build_spatial_index(netCDF4_file))
+            if geo_ranges:
+                options["longitude_range"], options["latitude_range"] = geo_ranges
+            # TODO: Validate the file before sending the response
+            return create_cerv2_response(netCDF4_file, options, output_format, parse_cerv2_json_options(args))
+        except (ServiceBusyError, InvalidSelectionError):
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+
+# Define a parser for the conversion of a batch of CERV2 files, uploaded as files
+# and/or a zip or tar archive of files
+cerv2_batch_parser = cerv2_options_parser.copy()
+for name in ("bbox", "polygon", "output_format", "start", "max_records", "partitions", "partition"):
+    cerv2_batch_parser.remove_argument(name)
+cerv2_batch_parser.add_argument("files", type=FileStorage, location="files", required=False, action="append")
+cerv2_batch_parser.add_argument("archive", type=FileStorage, location="files", required=False)
+cerv2_batch_parser.add_argument("merge_time", type=inputs.boolean, location="form", required=False, default=False)
+
+def parse_cerv2_batch_options(args):
+    """
+    Converts the parsed form fields of a CERV2 batch request to service arguments.
+    Batches are always converted to JSON records of whole files.
+    """
+    options = dict(parse_cerv2_options(args), **parse_cerv2_json_options(args))
+    for name in ("partitions", "partition", "start", "max_records"):
+        del options[name]
+    return options
+
+def create_cerv2_batch_response(batch, options, merge_time=False):
+    """
+    Creates the streamed response with the CERV2 records of the files of a batch.
+    The files are converted by at most BATCH_CONCURRENCY threads at once, and their
+    tagged messages are interleaved, or they are merged along the time dimension.
+    Every thread takes one admission slot, which are reserved before the response starts.
+    """
+    concurrency = worker_pool_service.get_max_slots(min(current_app.config["BATCH_CONCURRENCY"], len(batch)))
+    if merge_time:
+        generator = data_processing_service.convert_merged_cerv2_data_to_json_chunks(batch, **options, concurrency=concurrency, max_bytes=current_app.config["BATCH_MERGE_MAX_BYTES"])
+        generator = stream_buffer_service.buffer(worker_pool_service.admit(generator, concurrency))
+    else:
+        streams = data_processing_service.iter_cerv2_batch_streams(batch, **options)
+        generator = worker_pool_service.admit(stream_buffer_service.interleave(streams, concurrency), concurrency)
+    return create_stream_response(generator, FRAMING_MEDIA_TYPES[options["framing"]])
+
+# Endpoint to convert a batch of NetCDF files to CERV2 JSON chunks
+@api.route("/cerv2-batch")
+@api.expect(cerv2_batch_parser)
+class ConvertCERV2Batch(Resource):
+    @api.response(200, "Success")
+    @api.response(400, "Bad Request")
+    def post(self):
+        """
+        Uploads several NetCDF files, or a zip or tar archive of them, and converts their CERV2 data
+        to one stream of JSON records, in which the messages of every file are tagged with its index.
+        A file which can not be converted is reported in the stream without aborting the batch.
+        With merge_time, the files are merged along the time dimension into one stream of records.
+        """
+        args = cerv2_batch_parser.parse_args()
+        options = parse_cerv2_batch_options(args)
+
+        try:
+            batch = expand_batch_upload(
+                args.get("files"),
+                args.get("archive"),
+                current_app.config["BATCH_MAX_FILES"],
+                current_app.config["BATCH_MAX_EXTRACTED_BYTES"],
+                current_app.config["UPLOAD_SPOOL_DIR"],
+            )
+            return create_cerv2_batch_response(batch, options, args.get("merge_time"))
+        except (ServiceBusyError, InvalidSelectionError, FailedToParseError):
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF files.")
+
+# Define a parser for the options of the CERV2 tile pyramid
+tiles_options_parser = api.parser()
+tiles_options_parser.add_argument("filter_variables", type=str, location="form", required=True)
+tiles_options_parser.add_argument("longitude_range", type=str, location="form", required=False)
+tiles_options_parser.add_argument("latitude_range", type=str, location="form", required=False)
+tiles_options_parser.add_argument("bbox", type=str, location="form", required=False)
+tiles_options_parser.add_argument("polygon", type=str, location="form", required=False)
+tiles_options_parser.add_argument("step_size", type=inputs.positive, location="form", required=False, default=1)
+tiles_options_parser.add_argument("aggregation", type=str, choices=list(AGGREGATIONS), location="form", required=False, default="nanmean")
+tiles_options_parser.add_argument("time_step", type=inputs.positive, location="form", required=False, default=1)
+tiles_options_parser.add_argument("time_range", type=str, location="form", required=False)
+tiles_options_parser.add_argument("tile_size", type=inputs.positive, location="form", required=False, default=DEFAULT_TILE_SIZE)
+tiles_options_parser.add_argument("max_levels", type=inputs.positive, location="form", required=False)
+tiles_options_parser.add_argument("framing", type=str, choices=list(FRAMING_MEDIA_TYPES), location="form", required=False, default=NDJSON_FRAMING)
+
+# Define a parser for the CERV2 tile pyramid
+tiles_parser = tiles_options_parser.copy()
+tiles_parser.add_argument("file", type=FileStorage, location="files", required=True)
+
+def create_tiles_response(netCDF4_file, args, geo_ranges=None):
+    """
+    Creates the streamed response with the tile pyramid of a NetCDF file.
+    Resolved geographic index ranges replace the longitude_range and latitude_range fields.
+    """
+    if geo_ranges:
+        longitude_range, latitude_range = geo_ranges
+    else:
         longitude_range = args.get("longitude_range").split(",") if args.get("longitude_range") else []
         latitude_range = args.get("latitude_range").split(",") if args.get("latitude_range") else []
-        step_size = int(args["step_size"])
+    generator = data_processing_service.convert_cerv2_data_to_tiles(
+        netCDF4_file,
+        args.get("filter_variables").split(",") if args.get("filter_variables") else [],
+        longitude_range,
+        latitude_range,
+        args.get("step_size") or 1,
+        tile_size=args.get("tile_size") or DEFAULT_TILE_SIZE,
+        max_levels=args.get("max_levels"),
+        aggregation=args.get("aggregation") or "nanmean",
+        time_step=args.get("time_step") or 1,
+        time_range=args.get("time_range").split(",") if args.get("time_range") else [],
+        framing=args.get("framing") or NDJSON_FRAMING,
+    )
+    generator = stream_buffer_service.buffer(worker_pool_service.admit(generator))
+    # Preprocess the selection before the response starts, to report invalid selections
+    return create_stream_response(generator, FRAMING_MEDIA_TYPES[args.get("framing") or NDJSON_FRAMING], prefetch=True)
+
+# Endpoint to convert CERV2 data to a tile pyramid
+@api.route("/cerv2-tiles")
+@api.expect(tiles_parser)
+class ConvertCERV2DataToTiles(Resource):
+    @api.response(200, "Success")
+    @api.response(400, "Bad Request")
+    def post(self):
+        """
+        Uploads a NetCDF file and converts its CERV2 data to a multi-resolution tile pyramid.
+        Every tile carries the aggregated values of its cells and its bounding box.
+        """
+        args = tiles_parser.parse_args()
+        netCDF4_file = args["file"]
 
         try:
-            # TODO: Validate the file before sending the response
-            json_generator = data_processing_service.convert_cerv2_data_to_json_chunks(
-                netCDF4_file, filter_variables, longitude_range, latitude_range, step_size
+            geo_ranges = resolve_geo_selection(args, lambda: data_processing_service.build_spatial_index(netCDF4_file))
+            return create_tiles_response(netCDF4_file, args, geo_ranges)
+        except (ServiceBusyError, InvalidSelectionError):
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+
+# Endpoint to upload a NetCDF file once and reference it by its handle afterwards
+@api.route("/datasets")
+@api.expect(upload_parser)
+class UploadDataset(Resource):
+    @api.response(201, "Created")
+    @api.response(400, "Bad Request")
+    def post(self):
+        """
+        Uploads a NetCDF file into the dataset cache and returns its handle.
+        """
+        args = upload_parser.parse_args()
+        return dataset_cache_service.add(args["file"]), 201
+
+# Endpoint to remove a dataset from the cache
+@api.route("/datasets/<string:handle>")
+class CachedDataset(Resource):
+    @api.response(204, "Deleted")
+    @api.response(404, "Not Found")
+    def delete(self, handle):
+        """
+        Removes a cached NetCDF file.
+        """
+        dataset_cache_service.remove(handle)
+        return "", 204
+
+# Endpoint to convert the metadata of a cached dataset to JSON
+@api.route("/datasets/<string:handle>/metadata")
+@api.expect(metadata_options_parser)
+class ConvertCachedMetadataToJSON(Resource):
+    @api.response(200, "Success")
+    @api.response(404, "Not Found")
+    def get(self, handle):
+        """
+        Converts the metadata of a cached NetCDF file to JSON.
+        """
+        details = metadata_options_parser.parse_args()["details"]
+        try:
+            metadata = dataset_cache_service.memoize(
+                handle,
+                "metadata-details" if details else "metadata",
+                lambda path: "".join(
+                    data_processing_service.convert_netcdf_metadata_to_json(path, details)
+                ),
             )
-            return Response(stream_with_context(json_generator), mimetype="application/json")
+        except DatasetNotFoundError:
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+        return Response(metadata, mimetype="application/json")
+
+# Endpoint to convert the data of a cached dataset to JSON
+@api.route("/datasets/<string:handle>/data")
+@api.expect(output_format_parser)
+class ConvertCachedDataToJSON(Resource):
+    @api.response(200, "Success")
+    @api.response(404, "Not Found")
+    def get(self, handle):
+        """
+        Converts the data of a cached NetCDF file to JSON or the binary columnar format.
+        """
+        args = output_format_parser.parse_args()
+        output_format = get_output_format(args)
+
+        try:
+            return create_cached_response(handle, lambda file_path: create_data_response(file_path, output_format))
+        except (ServiceBusyError, DatasetNotFoundError):
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+
+# Endpoint to compute the statistics of the variables of a cached dataset
+@api.route("/datasets/<string:handle>/statistics")
+@api.expect(statistics_options_parser)
+class ComputeCachedStatistics(Resource):
+    @api.response(200, "Success")
+    @api.response(400, "Bad Request")
+    @api.response(404, "Not Found")
+    def post(self, handle):
+        """
+        Computes the statistics and histograms of the numeric variables of a cached NetCDF file.
+        """
+        args = statistics_options_parser.parse_args()
+        options = parse_statistics_options(args)
+
+        try:
+            return create_cached_response(handle, lambda file_path: create_statistics_response(file_path, options))
+        except (ServiceBusyError, DatasetNotFoundError):
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+
+# Endpoint to convert the CERV2 data of a cached dataset to JSON chunks
+@api.route("/datasets/<string:handle>/cerv2-data-chunks")
+@api.expect(cerv2_options_parser)
+class ConvertCachedCERV2DataToJSONChunks(Resource):
+    @api.response(200, "Success")
+    @api.response(400, "Bad Request")
+    @api.response(404, "Not Found")
+    def post(self, handle):
+        """
+        Converts the CERV2 data of a cached NetCDF file to JSON or columnar chunks.
+        """
+        args = cerv2_options_parser.parse_args()
+        options = parse_cerv2_options(args)
+        output_format = get_output_format(args)
+
+        try:
+            geo_ranges = resolve_geo_selection(args, lambda: get_cached_spatial_index(handle))
+            if geo_ranges:
+                options["longitude_range"], options["latitude_range"] = geo_ranges
+            return create_cached_response(
+                handle,
+                lambda file_path: create_cerv2_response(file_path, options, output_format, parse_cerv2_json_options(args)),
+            )
+        except (ServiceBusyError, InvalidSelectionError, DatasetNotFoundError):
+            raise
+        except Exception as e:
+            raise FailedToParseError("Failed to parse the provided NetCDF file.")
+
+# Endpoint to convert the CERV2 data of a cached dataset to a tile pyramid
+@api.route("/datasets/<string:handle>/cerv2-tiles")
+@api.expect(tiles_options_parser)
+class ConvertCachedCERV2DataToTiles(Resource):
+    @api.response(200, "Success")
+    @api.response(400, "Bad Request")
+    @api.response(404, "Not Found")
+    def post(self, handle):
+        """
+        Converts the CERV2 data of a cached NetCDF file to a multi-resolution tile pyramid.
+        """
+        args = tiles_options_parser.parse_args()
+
+        try:
+            geo_ranges = resolve_geo_selection(args, lambda: get_cached_spatial_index(handle))
+            return create_cached_response(handle, lambda file_path: create_tiles_response(file_path, args, geo_ranges))
+        except (ServiceBusyError, InvalidSelectionError, DatasetNotFoundError):
+            raise
         except Exception as e:
             raise FailedToParseError("Failed to parse the provided NetCDF file.")
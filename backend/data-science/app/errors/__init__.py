@@ -1 +1,8 @@
-from .errors import FailedToParseError, NoCoordinatesError
+from .errors import (
+    DatasetNotFoundError,
+    FailedToParseError,
+    IncompleteHeaderError,
+    InvalidSelectionError,
+    NoCoordinatesError,
+    ServiceBusyError,
+)
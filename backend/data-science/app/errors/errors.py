@@ -4,3 +4,19 @@ class FailedToParseError(Exception):
 
 class NoCoordinatesError(Exception):
     pass
+
+
+class DatasetNotFoundError(Exception):
+    pass
+
+
+class ServiceBusyError(Exception):
+    pass
+
+
+class IncompleteHeaderError(Exception):
+    pass
+
+
+class InvalidSelectionError(Exception):
+    pass
@@ -1 +1,4 @@
 from .error_middleware import ErrorHandlerMiddleware
+from .upload_middleware import UploadStreamMiddleware
+from .metrics_middleware import MetricsMiddleware
+from .compression_middleware import CompressionMiddleware
@@ -0,0 +1,88 @@
+"""
+Module containing a middleware class to compress streamed responses.
+"""
+
+from app.services.stream_compression import (
+    DEFAULT_LEVELS,
+    GZIP,
+    ZSTD,
+    compress_stream,
+    negotiate_encoding,
+)
+from flask import request
+
+
+class CompressionMiddleware:
+    """
+    Middleware class which compresses the bulk streamed responses of the conversion
+    endpoints with the content coding negotiated via the Accept-Encoding header of the
+    request. The chunks are compressed one by one while the response is sent. Only
+    responses marked as compressible are compressed, small JSON responses like the
+    metadata are sent as they are.
+    """
+
+    def __init__(self, app):
+        """
+        Initialize the middleware with the Flask application.
+
+        :param app: The Flask application.
+        """
+        self.app = app
+        self.levels = {
+            GZIP: app.config.get("GZIP_LEVEL", DEFAULT_LEVELS[GZIP]),
+            ZSTD: app.config.get("ZSTD_LEVEL", DEFAULT_LEVELS[ZSTD]),
+        }
+        if app.config.get("COMPRESSION_ENABLED", True):
+            self.register_hooks()
+
+    def register_hooks(self):
+        """
+        Register the hook which compresses the responses.
+        """
+        @self.app.after_request
+        def compress_response(response):
+            """
+            Compress a compressible response if the client accepts a content coding.
+
+            :param response: The response.
+            :return: The response, with a compressed body if it is compressible.
+            """
+            if not getattr(response, "compressible", False) or "Content-Encoding" in response.headers:
+                return response
+            response.vary.add("Accept-Encoding")
+            encoding = negotiate_encoding(request.accept_encodings)
+            if encoding is None:
+                return response
+            response.response = CompressedBody(response.response, encoding, self.levels[encoding])
+            response.headers["Content-Encoding"] = encoding
+            response.headers.pop("Content-Length", None)
+            return response
+
+    def __call__(self, environ, start_response):
+        """
+        Implement the WSGI application interface.
+
+        :param environ: The WSGI environment dictionary.
+        :param start_response: The function to start the response.
+        :return: The response from the Flask application.
+        """
+        return self.app(environ, start_response)
+
+
+class CompressedBody:
+    """
+    A streamed response body which is compressed chunk by chunk and closes the
+    original body when it is closed by the server.
+    """
+
+    def __init__(self, body, encoding, level):
+        self.body = body
+        self.encoding = encoding
+        self.level = level
+
+    def __iter__(self):
+        return compress_stream(self.body, self.encoding, self.level)
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
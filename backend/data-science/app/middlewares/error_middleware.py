@@ -2,7 +2,12 @@
 Module containing a middleware class to handle custom error responses.
 """
 
-from app.errors import FailedToParseError
+from app.errors import (
+    DatasetNotFoundError,
+    FailedToParseError,
+    InvalidSelectionError,
+    ServiceBusyError,
+)
 from flask import jsonify
 
 class ErrorHandlerMiddleware:
@@ -17,6 +22,11 @@ class ErrorHandlerMiddleware:
         :param app: The Flask application.
         """
         self.app = app
+        # Let flask-restx pass exceptions on to the handlers below in every mode,
+        # otherwise it answers all of them with 500 when debugging is disabled.
+        # Every exception has a handler (see handle_generic_error), so none of
+        # them propagates out of the application.
+        self.app.config["PROPAGATE_EXCEPTIONS"] = True
         self.register_error_handler()
 
     def register_error_handler(self):
@@ -48,6 +58,40 @@ class ErrorHandlerMiddleware:
             }
             return jsonify(response), 500
 
+        @self.app.errorhandler(DatasetNotFoundError)
+        def handle_dataset_not_found_error(e):
+            """
+            Handle DatasetNotFoundError exceptions with a custom error response.
+
+            :param e: The DatasetNotFoundError exception that occurred.
+            :return: A JSON response containing an error message and status code.
+            """
+            response = {"error": "Not Found", "message": str(e)}
+            return jsonify(response), 404
+
+        @self.app.errorhandler(InvalidSelectionError)
+        def handle_invalid_selection_error(e):
+            """
+            Handle InvalidSelectionError exceptions with a custom error response.
+
+            :param e: The InvalidSelectionError exception that occurred.
+            :return: A JSON response containing an error message and status code.
+            """
+            response = {"error": "Bad Request", "message": str(e)}
+            return jsonify(response), 400
+
+        @self.app.errorhandler(ServiceBusyError)
+        def handle_service_busy_error(e):
+            """
+            Handle ServiceBusyError exceptions with a custom error response.
+
+            :param e: The ServiceBusyError exception that occurred.
+            :return: A JSON response containing an error message, status code and
+                the Retry-After header.
+            """
+            response = {"error": "Too Many Requests", "message": str(e)}
+            return jsonify(response), 429, {"Retry-After": "1"}
+
     def __call__(self, environ, start_response):
         """
         Implement the WSGI application interface.
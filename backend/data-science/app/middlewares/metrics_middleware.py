@@ -0,0 +1,142 @@
+"""
+Module containing a middleware class to measure requests for the metrics service.
+"""
+
+import time
+
+from app.services import metrics_service
+from app.services.metrics_service import (
+    ACTIVE_REQUESTS,
+    BYTES_RECEIVED,
+    BYTES_SENT,
+    REQUEST_SECONDS,
+    format_server_timing,
+)
+from flask import g, request
+
+
+class MetricsMiddleware:
+    """
+    Middleware class which records the duration, the bytes received and sent and the
+    number of active requests, and times the parsing of uploads as the upload phase.
+    Streamed responses are measured until they were sent completely.
+    """
+
+    def __init__(self, app):
+        """
+        Initialize the middleware with the Flask application.
+
+        :param app: The Flask application.
+        """
+        self.app = app
+        self.register_request_class()
+        self.register_hooks()
+
+    def register_request_class(self):
+        """
+        Register a request class which measures the parsing of the form data.
+        """
+        class MeasuredRequest(self.app.request_class):
+            def _load_form_data(self):
+                """
+                Parse the form data and the uploaded files as the upload phase.
+                """
+                with metrics_service.phase("upload"):
+                    super()._load_form_data()
+
+        self.app.request_class = MeasuredRequest
+
+    def register_hooks(self):
+        """
+        Register the hooks which start and finish the measurement of every request.
+        """
+        server_timing = self.app.config.get("SERVER_TIMING_HEADER", False)
+
+        @self.app.before_request
+        def start_measurement():
+            """
+            Start measuring the request.
+            """
+            g.metrics_start = time.perf_counter()
+            g.metrics_phases = metrics_service.start_request()
+            metrics_service.increment(ACTIVE_REQUESTS)
+            if request.content_length:
+                metrics_service.increment(
+                    BYTES_RECEIVED, request.content_length, endpoint=get_endpoint()
+                )
+
+        @self.app.after_request
+        def finish_measurement(response):
+            """
+            Add the Server-Timing header and finish the measurement once the response
+            was sent.
+
+            :param response: The response.
+            :return: The response, with a measured body if it is streamed.
+            """
+            if "metrics_start" not in g:
+                return response
+            start = g.metrics_start
+            if server_timing:
+                response.headers["Server-Timing"] = format_server_timing(
+                    g.metrics_phases, time.perf_counter() - start
+                )
+            labels = {"endpoint": get_endpoint(), "status": str(response.status_code)}
+            if response.is_streamed:
+                response.response = MeasuredBody(response.response, start, labels)
+            else:
+                finish_request(start, response.calculate_content_length() or 0, labels)
+            return response
+
+    def __call__(self, environ, start_response):
+        """
+        Implement the WSGI application interface.
+
+        :param environ: The WSGI environment dictionary.
+        :param start_response: The function to start the response.
+        :return: The response from the Flask application.
+        """
+        return self.app(environ, start_response)
+
+
+def get_endpoint():
+    """
+    Returns the URL rule of the current request, which is used as the endpoint label.
+    """
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def finish_request(start, size, labels):
+    """
+    Records a request whose response was sent completely.
+    """
+    metrics_service.observe(REQUEST_SECONDS, time.perf_counter() - start, **labels)
+    metrics_service.increment(BYTES_SENT, size, endpoint=labels["endpoint"])
+    metrics_service.increment(ACTIVE_REQUESTS, -1)
+
+
+class MeasuredBody:
+    """
+    A streamed response body which counts its bytes and finishes the measurement of
+    the request exactly once, when it is closed by the server.
+    """
+
+    def __init__(self, body, start, labels):
+        self.body = body
+        self.start = start
+        self.labels = labels
+        self.size = 0
+        self.finished = False
+
+    def __iter__(self):
+        for chunk in self.body:
+            # text chunks are sent UTF-8 encoded
+            self.size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
+        if not self.finished:
+            self.finished = True
+            finish_request(self.start, self.size, self.labels)
@@ -0,0 +1,57 @@
+"""
+Module containing a middleware class to control where uploaded files are buffered.
+"""
+
+import tempfile
+from io import BytesIO
+
+
+class UploadStreamMiddleware:
+    """
+    Middleware class which buffers small uploads in memory and streams large uploads
+    into a named temporary file, so they can be opened in place without another copy.
+    """
+
+    def __init__(self, app):
+        """
+        Initialize the middleware with the Flask application.
+
+        :param app: The Flask application.
+        """
+        self.app = app
+        self.register_request_class()
+
+    def register_request_class(self):
+        """
+        Register a request class which chooses the buffer for every uploaded file.
+        """
+        config = self.app.config
+
+        class UploadStreamRequest(self.app.request_class):
+            def _get_file_stream(
+                self, total_content_length, content_type, filename=None, content_length=None
+            ):
+                """
+                Return the buffer an uploaded file is written to while parsing the form.
+
+                :param total_content_length: The length of the whole request body.
+                :return: An in-memory buffer or a named temporary file.
+                """
+                threshold = config["NETCDF_IN_MEMORY_THRESHOLD"]
+                if total_content_length is not None and total_content_length <= threshold:
+                    return BytesIO()
+                return tempfile.NamedTemporaryFile(
+                    "rb+", suffix=".nc", dir=config["UPLOAD_SPOOL_DIR"]
+                )
+
+        self.app.request_class = UploadStreamRequest
+
+    def __call__(self, environ, start_response):
+        """
+        Implement the WSGI application interface.
+
+        :param environ: The WSGI environment dictionary.
+        :param start_response: The function to start the response.
+        :return: The response from the Flask application.
+        """
+        return self.app(environ, start_response)
@@ -1,4 +1,14 @@
 from .data_processing_service import DataProcessingService
+from .dataset_cache_service import DatasetCacheService
+from .metrics_service import MetricsService
+from .stream_buffer_service import StreamBufferService
+from .worker_pool_service import WorkerPoolService
 
 # Create instances of the services
-data_processing_service = DataProcessingService()
+metrics_service = MetricsService()
+worker_pool_service = WorkerPoolService()
+data_processing_service = DataProcessingService(
+    worker_pool=worker_pool_service, metrics=metrics_service
+)
+dataset_cache_service = DatasetCacheService()
+stream_buffer_service = StreamBufferService()
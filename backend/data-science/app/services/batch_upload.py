@@ -0,0 +1,172 @@
+"""
+Module containing the expansion of batch uploads into their NetCDF files.
+
+A batch is uploaded as any number of files, as a zip or tar archive of files
+(optionally gzip, bzip2 or xz compressed), or both. The members of an archive are
+listed when the batch is expanded, so an invalid archive is rejected before the
+response starts. They are extracted one at a time into a temporary file when they
+are converted, which is removed again afterwards.
+"""
+
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+
+from app.errors import FailedToParseError, InvalidSelectionError
+
+# Default maximum number of files of a batch
+DEFAULT_MAX_FILES = 400
+# Default maximum total size (in bytes) of the extracted members of an archive
+DEFAULT_MAX_EXTRACTED_BYTES = 16 * 1024 * 1024 * 1024
+# Size of the chunks used when extracting a member of an archive
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+
+class BatchFile:
+    """
+    A file of a batch, either an uploaded file or a member of an uploaded archive.
+    """
+    def __init__(self, name, netCDF4_file=None, archive=None, member=None, spool_dir=None):
+        self.name = name
+        self.netCDF4_file = netCDF4_file
+        self.archive = archive
+        self.member = member
+        self.spool_dir = spool_dir
+
+    @contextmanager
+    def open(self):
+        """
+        Provides the file for the conversion, extracting archive members first.
+
+        Yields:
+            FileStorage | str: The uploaded file or the path of the extracted member.
+        """
+        if self.archive is None:
+            yield self.netCDF4_file
+            return
+        with tempfile.NamedTemporaryFile(suffix=".nc", dir=self.spool_dir) as spool_file:
+            self.archive.extract(self.member, spool_file)
+            spool_file.flush()
+            yield spool_file.name
+
+
+class BatchArchive:
+    """
+    A zip or tar archive of NetCDF files.
+
+    The members are extracted one at a time, as neither archive format supports
+    reading several members of the same file object at once.
+    """
+    def __init__(self, stream):
+        self.lock = threading.Lock()
+        self.zip_file = None
+        self.tar_file = None
+        try:
+            stream.seek(0)
+            if zipfile.is_zipfile(stream):
+                stream.seek(0)
+                self.zip_file = zipfile.ZipFile(stream)
+            else:
+                stream.seek(0)
+                self.tar_file = tarfile.open(fileobj=stream, mode="r:*")
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError):
+            raise FailedToParseError("The archive is neither a valid zip nor tar archive.")
+
+    def list_members(self):
+        """
+        Lists the regular files of the archive, in the order of the archive.
+        Directories and hidden files (e.g. resource forks added by macOS) are skipped.
+
+        Returns:
+            list: (name, member, size) tuples of the files.
+        """
+        if self.zip_file is not None:
+            members = [
+                (info.filename, info, info.file_size)
+                for info in self.zip_file.infolist()
+                if not info.is_dir()
+            ]
+        else:
+            try:
+                members = [
+                    (info.name, info, info.size)
+                    for info in self.tar_file.getmembers()
+                    if info.isfile()
+                ]
+            except (tarfile.TarError, EOFError, OSError):
+                raise FailedToParseError("The archive is neither a valid zip nor tar archive.")
+        return [member for member in members if not is_hidden_member(member[0])]
+
+    def extract(self, member, target):
+        """
+        Copies the content of a member into a file object.
+        """
+        with self.lock:
+            if self.zip_file is not None:
+                source = self.zip_file.open(member)
+            else:
+                source = self.tar_file.extractfile(member)
+            with source:
+                shutil.copyfileobj(source, target, EXTRACT_CHUNK_SIZE)
+
+
+def is_hidden_member(name):
+    """
+    Returns whether a member of an archive is hidden or in a hidden directory.
+    """
+    return any(
+        part.startswith(".") or part == "__MACOSX"
+        for part in name.replace("\\", "/").split("/")
+        if part
+    )
+
+
+def expand_batch_upload(
+    files=None,
+    archive=None,
+    max_files=DEFAULT_MAX_FILES,
+    max_extracted_bytes=DEFAULT_MAX_EXTRACTED_BYTES,
+    spool_dir=None,
+):
+    """
+    Expands the uploaded files and archive of a batch into its files.
+
+    Args:
+        files (list): The uploaded NetCDF files.
+        archive (FileStorage): An uploaded zip or tar archive of NetCDF files.
+        max_files (int): The maximum number of files, 0 for no limit.
+        max_extracted_bytes (int): The maximum total size of the members of the
+            archive, 0 for no limit.
+        spool_dir (str): The directory members are extracted to, None uses the
+            system temporary directory.
+
+    Returns:
+        list: The BatchFile of every file, the uploaded files first.
+
+    Raises:
+        InvalidSelectionError: If the batch is empty or too large.
+        FailedToParseError: If the archive can not be read.
+    """
+    batch = [
+        BatchFile(netCDF4_file.filename or f"file-{index}", netCDF4_file=netCDF4_file)
+        for index, netCDF4_file in enumerate(files or [])
+    ]
+    if archive is not None:
+        opened = BatchArchive(archive.stream)
+        members = opened.list_members()
+        if max_extracted_bytes and sum(size for _, _, size in members) > max_extracted_bytes:
+            raise InvalidSelectionError(
+                f"The files of the archive exceed {max_extracted_bytes} bytes."
+            )
+        batch += [
+            BatchFile(name, archive=opened, member=member, spool_dir=spool_dir)
+            for name, member, _ in members
+        ]
+    if not batch:
+        raise InvalidSelectionError("The batch contains no files.")
+    if max_files and len(batch) > max_files:
+        raise InvalidSelectionError(f"A batch may contain at most {max_files} files.")
+    return batch
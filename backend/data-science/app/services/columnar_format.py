@@ -0,0 +1,79 @@
+"""
+Module containing the binary columnar output format.
+
+A columnar stream is a sequence of frames. Every frame starts with the length of its
+header as a 4 byte big-endian unsigned integer, followed by the UTF-8 encoded JSON
+header and ``header["nbytes"]`` bytes of array data. The header describes the array
+with its name, dimensions, NumPy dtype string (including the byte order) and shape,
+so clients can use the raw buffer directly, e.g. with ``np.frombuffer``.
+"""
+
+import struct
+
+import numpy as np
+import simplejson
+
+MEDIA_TYPE = "application/vnd.netcdf-columnar"
+
+# dtype of frames with JSON encoded data, used for arrays of Python objects
+JSON_DTYPE = "json"
+
+HEADER_LENGTH = struct.Struct(">I")
+
+
+def encode_frame(header, array=None):
+    """
+    Encodes an array and its description as a frame.
+
+    Args:
+        header (dict): The description of the array (name, dimensions, ...).
+        array (numpy.ndarray): The array, or None for frames without data.
+
+    Returns:
+        list: The encoded frame header followed by the raw data of the array.
+    """
+    header = dict(header)
+    payload = b""
+    if array is not None:
+        array = np.asarray(array)
+        if array.dtype.kind == "O":
+            payload = simplejson.dumps(array.tolist(), ignore_nan=True).encode()
+            header["dtype"] = JSON_DTYPE
+        else:
+            payload = np.ascontiguousarray(array).tobytes()
+            header["dtype"] = array.dtype.str
+        header["shape"] = list(array.shape)
+    header["nbytes"] = len(payload)
+
+    encoded_header = simplejson.dumps(header, ignore_nan=True).encode()
+    return [HEADER_LENGTH.pack(len(encoded_header)) + encoded_header, payload]
+
+
+def decode_frames(buffer):
+    """
+    Decodes a columnar stream.
+
+    Args:
+        buffer (bytes): The complete stream.
+
+    Yields:
+        tuple: The header of every frame and its array (None for frames without data).
+    """
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(view):
+        (header_length,) = HEADER_LENGTH.unpack_from(view, offset)
+        offset += HEADER_LENGTH.size
+        header = simplejson.loads(bytes(view[offset : offset + header_length]))
+        offset += header_length
+        payload = view[offset : offset + header["nbytes"]]
+        offset += header["nbytes"]
+
+        array = None
+        if header.get("dtype") == JSON_DTYPE:
+            array = np.array(simplejson.loads(bytes(payload)), dtype=object)
+        elif "dtype" in header:
+            array = np.frombuffer(payload, dtype=header["dtype"]).reshape(
+                header["shape"]
+            )
+        yield header, array
@@ -1,30 +1,74 @@
-import json
+import io
 import os
+import shutil
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from itertools import product, zip_longest
 
 import numpy as np
-import simplejson
-from app.errors import NoCoordinatesError
-from netCDF4 import Dataset
+from app.errors import IncompleteHeaderError, InvalidSelectionError, NoCoordinatesError
+from app.services.columnar_format import encode_frame
+from app.services.downsampling import AGGREGATIONS, FIRST, block_reduce
+from app.services.json_encoder import NumpyJSONEncoder
+from app.services.metrics_service import RECORDS_EMITTED, MetricsService
+from app.services.netcdf_header import (
+    CLASSIC_MAGIC,
+    drain,
+    is_classic_format,
+    iter_multipart_file,
+    parse_classic_header,
+)
+from app.services.spatial_index import SpatialIndex
+from app.services.statistics import (
+    DEFAULT_HISTOGRAM_BINS,
+    DEFAULT_PERCENTILES,
+    RunningStatistics,
+)
+from app.services.stream_framing import (
+    DEFAULT_WRITE_BYTES,
+    NDJSON_FRAMING,
+    SENTINEL_FRAMING,
+    coalesce_writes,
+    frame_records,
+)
+from app.services.tile_pyramid import DEFAULT_TILE_SIZE, iter_tiles
+from netCDF4 import Dataset, default_fillvals
+from werkzeug.datastructures import FileStorage
 
+# Number of grid rows serialized at once by the CERV2 chunk stream
+DEFAULT_BATCH_ROWS = 16
+# Uploads up to this size (in bytes) are opened directly from memory
+DEFAULT_IN_MEMORY_THRESHOLD = 64 * 1024 * 1024
+# Size of the chunks used when spooling an upload to disk
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# Approximate size (in bytes) of the slabs variables are streamed in
+DEFAULT_SLAB_BYTES = 8 * 1024 * 1024
+# Default maximum size (in bytes) of the selected data of all files merged at once
+DEFAULT_MERGE_MAX_BYTES = 1024 * 1024 * 1024
+# Layouts of the time variables of a CERV2 record: a dict per time index with the
+# values of all time variables, or an array per time variable
+INDEXED_TIME_LAYOUT = "indexed"
+COMPACT_TIME_LAYOUT = "compact"
+TIME_LAYOUTS = (INDEXED_TIME_LAYOUT, COMPACT_TIME_LAYOUT)
+# Schemas of the CERV2 JSON records: self-describing records, or a header message
+# followed by positional value arrays
+FULL_SCHEMA = "full"
+COMPACT_SCHEMA = "compact"
+SCHEMAS = (FULL_SCHEMA, COMPACT_SCHEMA)
+# Names of the longitude and latitude variables, in order of preference
+LONGITUDE_NAMES = ("lon", "longitude", "XLONG")
+LATITUDE_NAMES = ("lat", "latitude", "XLAT")
+# Names of the time coordinate variable, in order of preference
+TIME_NAMES = ("time", "Time", "XTIME")
 
-def custom_encoder(obj):
-    """
-    Custom JSON encoder to handle serialization of specific data types.
-
-    Args:
-        obj (object): The object to be serialized.
 
-    Returns:
-        object: A JSON serializable representation of the input object.
-    """
-    if isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, np.float32):
-        return float(obj)
-    elif isinstance(obj, np.int32):
-        return int(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+# Encoders shared by the request threads and the worker processes
+DATA_ENCODER = NumpyJSONEncoder()
+METADATA_ENCODER = NumpyJSONEncoder(allow_nan=True)
+CERV2_ENCODER = NumpyJSONEncoder(ignore_nan=True)
 
 
 class DataProcessingService:
@@ -34,135 +78,1576 @@ class DataProcessingService:
     This class provides methods for converting NetCDF metadata and data to JSON, as well as
     chunking NetCDF data into JSON format with filtering and dimension reduction.
     """
-    def convert_netcdf_metadata_to_json(self, netCDF4_file):
+    def __init__(
+        self,
+        in_memory_threshold=DEFAULT_IN_MEMORY_THRESHOLD,
+        slab_bytes=DEFAULT_SLAB_BYTES,
+        worker_pool=None,
+        write_bytes=DEFAULT_WRITE_BYTES,
+        metrics=None,
+    ):
+        self.in_memory_threshold = in_memory_threshold
+        self.slab_bytes = slab_bytes
+        self.write_bytes = write_bytes
+        self.worker_pool = worker_pool
+        self.metrics = metrics if metrics is not None else MetricsService()
+
+    def configure(self, config):
+        """
+        Applies the application configuration to the service.
+
+        Args:
+            config (dict): The Flask configuration.
+        """
+        self.in_memory_threshold = config.get(
+            "NETCDF_IN_MEMORY_THRESHOLD", DEFAULT_IN_MEMORY_THRESHOLD
+        )
+        self.slab_bytes = config.get("DATA_SLAB_BYTES", DEFAULT_SLAB_BYTES)
+        self.write_bytes = config.get("STREAM_WRITE_BYTES", DEFAULT_WRITE_BYTES)
+
+    def imap(self, function, iterable):
+        """
+        Applies a function to every item, in the worker pool if the service has one.
+
+        Yields:
+            object: The results, in the order of the items.
+        """
+        if self.worker_pool is None:
+            return map(function, iterable)
+        return self.worker_pool.imap(function, iterable)
+
+    @contextmanager
+    def open_dataset(self, netCDF4_file):
+        """
+        Opens a NetCDF file with open_dataset and measures the time as the open phase.
+
+        Yields:
+            Dataset: The opened dataset, which is closed afterwards.
+        """
+        with ExitStack() as stack:
+            with self.metrics.phase("open"):
+                dataset = stack.enter_context(
+                    open_dataset(netCDF4_file, self.in_memory_threshold)
+                )
+            yield dataset
+
+    def count_records(self, stream, items, count=len):
+        """
+        Counts the records of the items of a record stream while they pass.
+
+        Args:
+            stream (str): The name of the stream, the label of the metric.
+            items (iterable): The items.
+            count (callable): Returns the number of records of an item.
+
+        Yields:
+            object: The items.
+        """
+        for item in items:
+            self.metrics.increment(RECORDS_EMITTED, count(item), stream=stream)
+            yield item
+
+    def convert_netcdf_metadata_to_json(self, netCDF4_file, details=False):
         """
         Converts a NetCDF file to JSON format.
 
         Args:
-            netCDF4_file (FileStorage): The uploaded NetCDF file.
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+            details (bool): Whether to add the shape, dtype, chunking and compression
+                of every variable.
 
         Yields:
             str: JSON data generated from the NetCDF file.
         """
-        with tempfile.TemporaryDirectory() as temp_dir:
-            file_path = os.path.join(temp_dir, netCDF4_file.filename)
-            netCDF4_file.save(file_path)
-
-            dataset = Dataset(file_path)
+        with self.open_dataset(netCDF4_file) as dataset:
+            with self.metrics.phase("serialize"):
+                encoded = METADATA_ENCODER.encode(build_metadata(dataset, details))
+        yield encoded
 
-            data = {
-                "dimensions": {},  #  list of dimensions and their sizes
-                "variables_metadata": {},  #  metadata about each variable
-                "global_attributes": {},  # global metadata
-            }
+    def convert_netcdf_header_to_json(
+        self, stream, boundary, content_length=None, details=False
+    ):
+        """
+        Converts the metadata of a NetCDF file to JSON while it is being uploaded.
 
-            # Store dimensions
-            for dim_name, dim in dataset.dimensions.items():
-                data["dimensions"][dim_name] = len(dim)
+        The upload is read directly from the multipart request body. Headers of the
+        classic formats are parsed as soon as they arrived, without storing the file.
+        NetCDF4/HDF5 files can only be opened completely, so they are buffered like
+        regular uploads first. The rest of the request body is discarded after the
+        metadata has been sent.
 
-            # Store variables
-            for var_name, var in dataset.variables.items():
-                data["variables_metadata"][var_name] = {
-                    "dimensions": var.dimensions,
-                    "attributes": {},
-                }
+        Args:
+            stream (IO): The multipart request body.
+            boundary (str): The multipart boundary.
+            content_length (int): The length of the request body, if known.
+            details (bool): Whether to add details about every variable.
 
-                for attr_name in var.ncattrs():
-                    data["variables_metadata"][var_name]["attributes"][
-                        attr_name
-                    ] = getattr(var, attr_name)
+        Yields:
+            str: JSON data generated from the NetCDF header.
+        """
+        file_chunks = iter_multipart_file(stream, boundary)
+        header_buffer = bytearray()
+        data = None
+        with self.metrics.phase("header"):
+            for chunk in file_chunks:
+                header_buffer += chunk
+                if len(header_buffer) < len(CLASSIC_MAGIC):
+                    continue
+                if not is_classic_format(header_buffer):
+                    break
+                try:
+                    data = parse_classic_header(header_buffer, details)
+                    break
+                except IncompleteHeaderError:
+                    continue
 
-            # Store global attributes
-            for attr_name in dataset.ncattrs():
-                data["global_attributes"][attr_name] = getattr(dataset, attr_name)
+        if data is None:
+            if (
+                content_length is not None
+                and content_length <= self.in_memory_threshold
+            ):
+                buffer = io.BytesIO()
+            else:
+                buffer = tempfile.NamedTemporaryFile(suffix=".nc")
+            with buffer:
+                buffer.write(header_buffer)
+                for chunk in file_chunks:
+                    buffer.write(chunk)
+                netCDF4_file = FileStorage(stream=buffer, filename="upload.nc")
+                with self.open_dataset(netCDF4_file) as dataset:
+                    data = build_metadata(dataset, details)
 
-            yield json.dumps(data, default=custom_encoder)
+        yield METADATA_ENCODER.encode(data)
+        drain(stream)
 
     def convert_netcdf_data_to_json(self, netCDF4_file):
         """
         Converts a NetCDF file to JSON format.
 
+        The JSON document is written incrementally, one variable at a time. Large
+        variables are read and written in slabs along their leading dimension, so
+        only a bounded number of slabs is held in memory at once.
+
         Args:
-            netCDF4_file (FileStorage): The uploaded NetCDF file.
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
 
         Yields:
             str: JSON data generated from the NetCDF file.
         """
-        with tempfile.TemporaryDirectory() as temp_dir:
-            file_path = os.path.join(temp_dir, netCDF4_file.filename)
-            netCDF4_file.save(file_path)
+        with self.open_dataset(netCDF4_file) as dataset:
+            yield from self.metrics.measure_stream(
+                "serialize", self.iter_data_json(dataset)
+            )
+
+    def iter_data_json(self, dataset):
+        """
+        Writes the variables of an opened dataset as a JSON document.
 
-            dataset = Dataset(file_path)
+        Yields:
+            str: The parts of the JSON document.
+        """
+        yield '{"variables_data": {'
+        for index, (var_name, var) in enumerate(dataset.variables.items()):
+            # store variable data
+            yield (
+                (", " if index else "")
+                + DATA_ENCODER.encode(var_name)
+                + ': {"dimensions": '
+                + DATA_ENCODER.encode(var.dimensions)
+                + ', "data": '
+            )
+            if var.ndim == 0 or var.shape[0] == 0:
+                yield DATA_ENCODER.encode(var[:].filled())
+            else:
+                yield "["
+                slabs = (
+                    slab for _, slab in iter_variable_slabs(var, self.slab_bytes)
+                )
+                for slab_index, rows in enumerate(self.imap(encode_json_rows, slabs)):
+                    yield (", " if slab_index else "") + rows
+                yield "]"
+            yield "}"
+        yield "}}"
+
+    def convert_netcdf_data_to_columnar(self, netCDF4_file):
+        """
+        Converts the data of a NetCDF file to the binary columnar format.
+
+        Every variable is written as frames carrying the raw array buffers of slabs
+        along its leading dimension. The ``start`` field of a frame is the index of
+        its first element along that dimension.
+
+        Args:
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+
+        Yields:
+            bytes: Columnar frames generated from the NetCDF file.
+        """
+        with self.open_dataset(netCDF4_file) as dataset:
+            yield from self.metrics.measure_stream(
+                "serialize", self.iter_data_columnar(dataset)
+            )
 
-            data = {
-                "variables_data": {},  #  actual data
+    def iter_data_columnar(self, dataset):
+        """
+        Writes the variables of an opened dataset as columnar frames.
+
+        Yields:
+            bytes: The columnar frames.
+        """
+        for var_name, var in dataset.variables.items():
+            header = {
+                "name": var_name,
+                "dimensions": var.dimensions,
+                "fill_value": get_fill_value(var),
             }
+            if var.ndim == 0 or var.shape[0] == 0:
+                yield from encode_frame(dict(header, start=0), var[:].filled())
+                continue
+            for start, slab in iter_variable_slabs(var, self.slab_bytes):
+                yield from encode_frame(dict(header, start=start), slab)
 
-            # Store variables
-            for var_name, var in dataset.variables.items():
-                # store variable data
-                var_data = var[:].filled()
-                data["variables_data"][var_name] = {
-                    "dimensions": var.dimensions,
-                    "data": var_data.tolist(),
-                }
+    def convert_netcdf_statistics_to_json(
+        self,
+        netCDF4_file,
+        filter=None,
+        bins=DEFAULT_HISTOGRAM_BINS,
+        percentiles=DEFAULT_PERCENTILES,
+        per_time_step=False,
+    ):
+        """
+        Computes the statistics and histograms of the numeric variables of a NetCDF
+        file.
 
-            yield simplejson.dumps(data, default=custom_encoder)
+        Every variable is read once, in blocks of whole chunks of its native chunking,
+        so the memory usage is bounded by the slab size and does not depend on the
+        size of the file. Fill values and values which are not finite are counted as
+        missing. If the service has a worker pool and the dataset is on disk, the
+        variables are summarized in parallel by the worker processes.
+
+        Args:
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+            filter (list): The names of the variables, all variables if empty.
+            bins (int): The maximum number of bins of the histograms.
+            percentiles (sequence): The percentiles to compute.
+            per_time_step (bool): Whether to add the statistics of every time step
+                of variables with a time dimension.
+
+        Yields:
+            str: The parts of the JSON document.
+        """
+        with self.open_dataset(netCDF4_file) as dataset:
+            names = [
+                name
+                for name, var in dataset.variables.items()
+                if (not filter or name in filter) and is_numeric_variable(var)
+            ]
+            options = (bins, tuple(percentiles), per_time_step, self.slab_bytes)
+            file_path = get_dataset_path(dataset)
+            if self.worker_pool is not None and file_path is not None:
+                tasks = [(file_path, name) + options for name in names]
+                results = self.worker_pool.imap(compute_file_variable_statistics, tasks)
+            else:
+                results = (
+                    compute_variable_statistics(dataset.variables[name], *options)
+                    for name in names
+                )
+            yield from self.metrics.measure_stream(
+                "statistics", iter_statistics_json(names, results)
+            )
 
     def convert_cerv2_data_to_json_chunks(
-        self, netCDF4_file, filter, longitude_range, latitude_range, step_size
+        self,
+        netCDF4_file,
+        filter,
+        longitude_range,
+        latitude_range,
+        step_size,
+        batch_rows=DEFAULT_BATCH_ROWS,
+        aggregation=FIRST,
+        time_step=1,
+        time_range=None,
+        framing=SENTINEL_FRAMING,
+        time_layout=INDEXED_TIME_LAYOUT,
+        start=0,
+        max_records=None,
+        partitions=1,
+        partition=0,
+        schema=FULL_SCHEMA,
+        precision=None,
+        file_index=None,
     ):
         """
         Converts a NetCDF file to JSON format.
 
+        Every record carries its sequence number ``seq``, the index of its cell in
+        ``np.ndindex`` order over the selected grid, which does not depend on how
+        the stream is split. A stream can be resumed after its last received record,
+        or split into sub-ranges, with ``start`` and ``max_records``, or into bands
+        of grid rows with ``partitions``; only the grid rows of the requested
+        records are read from the file.
+
+        With the compact schema, the stream starts with a header message describing
+        the variables, the selected grid and the time coordinates once, followed by
+        one array of values per record, see build_compact_cerv2_records.
+
         Args:
-            netCDF4_file (FileStorage): The uploaded NetCDF file.
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+            batch_rows (int): The number of grid rows serialized per block.
+            aggregation (str): How blocks of step_size cells and time_step time
+                steps are downsampled, see downsampling.
+            time_step (int): The step size along the time dimension.
+            time_range (list): The optional [start, stop] time index range.
+            framing (str): The framing of the records, see stream_framing.
+            time_layout (str): The layout of the time variables, see
+                build_cerv2_records.
+            start (int): The sequence number of the first record.
+            max_records (int): The maximum number of records, None for all.
+            partitions (int): The number of disjoint bands of grid rows the grid is
+                split into, see select_record_rows.
+            partition (int): The index of the band to convert.
+            schema (str): "full" for self-describing records, "compact" for a header
+                followed by positional records.
+            precision (int): The optional number of decimals floats are rounded to.
+            file_index (int): The optional index of the file in a batch, which tags
+                the header and the records, see encode_cerv2_json_block.
 
         Yields:
-            str: JSON data generated from the NetCDF file.
+            str | bytes: JSON records generated from the NetCDF file, bytes for the
+                length-prefixed framing.
         """
-        with tempfile.TemporaryDirectory() as temp_dir:
-            file_path = os.path.join(temp_dir, netCDF4_file.filename)
-            netCDF4_file.save(file_path)
+        with self.open_dataset(netCDF4_file) as dataset:
+            grid_shape = get_selected_grid_shape(
+                dataset, longitude_range, latitude_range, step_size
+            )
+            first_row = 0
+            seq_range = None
+            if start or max_records is not None or partitions > 1:
+                longitude_range, first_row, seq_range = select_record_rows(
+                    dataset,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    start,
+                    max_records,
+                    partitions,
+                    partition,
+                )
+            with self.metrics.phase("preprocess"):
+                variables, time_variables = preprocess_variables(
+                    dataset,
+                    filter,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    self.worker_pool,
+                    aggregation,
+                    time_step,
+                    time_range,
+                )
+            if schema == COMPACT_SCHEMA:
+                header = build_compact_header(
+                    dataset,
+                    variables,
+                    time_variables,
+                    grid_shape,
+                    index_range_slice(time_range, time_step),
+                    precision,
+                )
+                if file_index is not None:
+                    header = tag_compact_header(header, file_index)
+                yield frame_records([CERV2_ENCODER.encode(header)], framing)
 
-            dataset = Dataset(file_path)
-            variables, time_variables = preprocess_variables(
-                dataset, filter, longitude_range, latitude_range, step_size
+            blocks = self.count_records(
+                "cerv2",
+                iter_cerv2_array_blocks(
+                    variables, time_variables, batch_rows, first_row
+                ),
+                partial(count_block_records, seq_range=seq_range),
             )
-            if time_variables:
-                max_t = max(len(v[1][0, 0]) for v in time_variables)
-            if variables:
-                shape = variables[0][1].shape
-            else:
-                shape = time_variables[0][1][:, :, 0].shape
+            # yield framed json records, joined into writes of at least write_bytes
+            encoded_blocks = self.imap(
+                partial(
+                    encode_cerv2_json_block,
+                    framing=framing,
+                    time_layout=time_layout,
+                    seq_range=seq_range,
+                    schema=schema,
+                    precision=precision,
+                    file_index=file_index,
+                ),
+                blocks,
+            )
+            yield from self.metrics.measure_stream(
+                "serialize", coalesce_writes(encoded_blocks, self.write_bytes)
+            )
+
+    def convert_cerv2_data_to_columnar_chunks(
+        self,
+        netCDF4_file,
+        filter,
+        longitude_range,
+        latitude_range,
+        step_size,
+        batch_rows=DEFAULT_BATCH_ROWS,
+        aggregation=FIRST,
+        time_step=1,
+        time_range=None,
+        partitions=1,
+        partition=0,
+    ):
+        """
+        Converts the CERV2 data of a NetCDF file to the binary columnar format.
 
-            for x, y in np.ndindex(shape):
-                data = {
-                    "x": x,
-                    "y": y,
+        For every block of grid rows, each variable is written as one frame. The
+        frame header contains the index of the first row of the block (``x``) and
+        whether the variable is a time variable.
+
+        Args:
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+            batch_rows (int): The number of grid rows per block.
+            aggregation (str): How blocks of step_size cells and time_step time
+                steps are downsampled, see downsampling.
+            time_step (int): The step size along the time dimension.
+            time_range (list): The optional [start, stop] time index range.
+            partitions (int): The number of disjoint bands of grid rows the grid is
+                split into, see select_record_rows.
+            partition (int): The index of the band to convert.
+
+        Yields:
+            bytes: Columnar frames generated from the NetCDF file.
+        """
+        with self.open_dataset(netCDF4_file) as dataset:
+            first_row = 0
+            if partitions > 1:
+                longitude_range, first_row, _ = select_record_rows(
+                    dataset,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    partitions=partitions,
+                    partition=partition,
+                )
+            with self.metrics.phase("preprocess"):
+                variables, time_variables = preprocess_variables(
+                    dataset,
+                    filter,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    self.worker_pool,
+                    aggregation,
+                    time_step,
+                    time_range,
+                )
+
+            blocks = self.count_records(
+                "cerv2-columnar",
+                iter_cerv2_array_blocks(
+                    variables, time_variables, batch_rows, first_row
+                ),
+                count_block_cells,
+            )
+            yield from self.metrics.measure_stream(
+                "serialize", iter_columnar_blocks(blocks)
+            )
+
+    def iter_cerv2_batch_streams(self, batch, framing=SENTINEL_FRAMING, **options):
+        """
+        Creates the CERV2 record streams of the files of a batch.
+
+        Every file is converted like by convert_cerv2_data_to_json_chunks, and all
+        its messages carry the index of the file in the batch as ``file``: a start
+        message with the name of the file, the records, and an end message, or an
+        error message if the file can not be converted. A file which fails ends its
+        stream early, without affecting the other files; its records received
+        before the error are incomplete.
+
+        Args:
+            batch (list): The BatchFile of every file, see batch_upload.
+            framing (str): The framing of the messages, see stream_framing.
+            options: The other keyword arguments of convert_cerv2_data_to_json_chunks.
+
+        Yields:
+            generator: The stream of every file, which is only started when it is
+                iterated, e.g. by StreamBufferService.interleave.
+        """
+        for index, batch_file in enumerate(batch):
+            yield self.convert_batch_file_to_json_chunks(
+                index, batch_file, framing, options
+            )
+
+    def convert_batch_file_to_json_chunks(self, index, batch_file, framing, options):
+        """
+        Converts a file of a batch to CERV2 records tagged with its index.
+
+        Yields:
+            str | bytes: The framed messages of the file.
+        """
+        start = {"file": index, "name": batch_file.name, "event": "start"}
+        yield frame_batch_event(start, framing)
+        try:
+            with batch_file.open() as netCDF4_file:
+                yield from self.convert_cerv2_data_to_json_chunks(
+                    netCDF4_file, framing=framing, file_index=index, **options
+                )
+        except Exception as e:
+            yield frame_batch_event(build_batch_error(index, batch_file, e), framing)
+            return
+        yield frame_batch_event({"file": index, "event": "end"}, framing)
+
+    def convert_merged_cerv2_data_to_json_chunks(
+        self,
+        batch,
+        filter,
+        longitude_range,
+        latitude_range,
+        step_size,
+        batch_rows=DEFAULT_BATCH_ROWS,
+        aggregation=FIRST,
+        time_step=1,
+        time_range=None,
+        framing=SENTINEL_FRAMING,
+        time_layout=INDEXED_TIME_LAYOUT,
+        schema=FULL_SCHEMA,
+        precision=None,
+        concurrency=1,
+        max_bytes=DEFAULT_MERGE_MAX_BYTES,
+    ):
+        """
+        Converts the files of a batch to one CERV2 record stream, merging them along
+        the time dimension.
+
+        The selections of the files are read by at most ``concurrency`` threads.
+        The files are ordered by the first value of their time coordinate if all of
+        them have one with the same units, otherwise they keep the order of the
+        batch. The time series of every record are the concatenated time series of
+        the files, the variables without a time dimension are those of the first
+        file. Unlike the stream of a single file, the selected data of all files is
+        held in memory at once, so it is limited to ``max_bytes``: a file whose
+        selection no longer fits is not read.
+
+        The stream starts with one message per file: ``merged`` with the number of
+        its time steps, or ``error`` if the file can not be read, its selection
+        exceeds the memory left or its variables or grid differ from the first
+        file, in which case it is left out. The records (preceded by the header
+        with the compact schema) follow.
+
+        Args:
+            batch (list): The BatchFile of every file, see batch_upload.
+            concurrency (int): The maximum number of files read at once.
+            max_bytes (int): The maximum size of the selected data of all files, 0
+                for no limit.
+            The other arguments are those of convert_cerv2_data_to_json_chunks.
+
+        Yields:
+            str | bytes: The framed messages and records.
+        """
+        read = partial(
+            self.read_cerv2_selection,
+            filter=filter,
+            longitude_range=longitude_range,
+            latitude_range=latitude_range,
+            step_size=step_size,
+            aggregation=aggregation,
+            time_step=time_step,
+            time_range=time_range,
+            precision=precision,
+            budget=MemoryBudget(max_bytes) if max_bytes else None,
+        )
+        executor = ThreadPoolExecutor(max(1, concurrency))
+        try:
+            futures = [executor.submit(read, batch_file) for batch_file in batch]
+            selections = []
+            for index, future in enumerate(futures):
+                try:
+                    selections.append((index, future.result()))
+                except Exception as e:
+                    error = build_batch_error(index, batch[index], e)
+                    yield frame_batch_event(error, framing)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        merged = []
+        for index, selection in order_selections_by_time(selections):
+            conflict = merged and get_merge_conflict(selection, merged[0][1])
+            if conflict:
+                error = {
+                    "file": index,
+                    "name": batch[index].name,
+                    "event": "error",
+                    "error": conflict,
                 }
-                if variables:
-                    data["vars"] = {name: data[x, y] for name, data in variables}
-                if time_variables:
-                    data["timeVars"] = {
-                        t: {
-                            name: data[x, y, t] if len(data[0, 0]) > t else None
-                            for name, data in time_variables
-                        }
-                        for t in range(max_t)
-                    }
-                # yield json lines
-                yield simplejson.dumps(
-                    data, default=custom_encoder, ignore_nan=True
-                ) + "||*split*||"
-
-
-def preprocess_variables(dataset, var_filter, lon_range, lat_range, step_size):
+                yield frame_batch_event(error, framing)
+            else:
+                merged.append((index, selection))
+        for index, selection in merged:
+            event = {
+                "file": index,
+                "name": batch[index].name,
+                "event": "merged",
+                "time": len(selection["header"]["time"]["indices"]),
+            }
+            yield frame_batch_event(event, framing)
+        if not merged:
+            return
+
+        variables, time_variables, header = merge_time_selections(
+            [selection for _, selection in merged]
+        )
+        if schema == COMPACT_SCHEMA:
+            yield frame_records([CERV2_ENCODER.encode(header)], framing)
+        blocks = self.count_records(
+            "cerv2",
+            iter_cerv2_array_blocks(variables, time_variables, batch_rows),
+            count_block_cells,
+        )
+        encoded_blocks = self.imap(
+            partial(
+                encode_cerv2_json_block,
+                framing=framing,
+                time_layout=time_layout,
+                schema=schema,
+                precision=precision,
+            ),
+            blocks,
+        )
+        yield from self.metrics.measure_stream(
+            "serialize", coalesce_writes(encoded_blocks, self.write_bytes)
+        )
+
+    def read_cerv2_selection(
+        self,
+        batch_file,
+        filter,
+        longitude_range,
+        latitude_range,
+        step_size,
+        aggregation=FIRST,
+        time_step=1,
+        time_range=None,
+        precision=None,
+        budget=None,
+    ):
+        """
+        Reads the selected CERV2 data of a file of a batch into memory.
+
+        Args:
+            budget (MemoryBudget): The memory the selection is reserved from before
+                it is read, None for no limit.
+            The other arguments are those of convert_cerv2_data_to_json_chunks.
+
+        Returns:
+            dict: The (name, data) tuples of the variables and time variables, the
+                axis of the time dimension of every time variable and the header of
+                the file in the compact schema, see build_compact_header.
+
+        Raises:
+            InvalidSelectionError: If the selection exceeds the memory left in the
+                budget.
+        """
+        with ExitStack() as stack:
+            netCDF4_file = stack.enter_context(batch_file.open())
+            dataset = stack.enter_context(self.open_dataset(netCDF4_file))
+            if budget is not None:
+                size = estimate_selection_bytes(
+                    dataset,
+                    filter,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    aggregation,
+                    time_step,
+                    time_range,
+                )
+                if not budget.reserve(size):
+                    raise InvalidSelectionError(
+                        f"The selection of the file ({size} bytes) exceeds the memory "
+                        "left for merging."
+                    )
+            grid_shape = get_selected_grid_shape(
+                dataset, longitude_range, latitude_range, step_size
+            )
+            with self.metrics.phase("preprocess"):
+                variables, time_variables = preprocess_variables(
+                    dataset,
+                    filter,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    self.worker_pool,
+                    aggregation,
+                    time_step,
+                    time_range,
+                )
+            header = build_compact_header(
+                dataset,
+                variables,
+                time_variables,
+                grid_shape,
+                index_range_slice(time_range, time_step),
+                precision,
+            )
+            time_axes = []
+            for name, _ in time_variables:
+                dimensions = change_dimensions_dict(dataset.variables[name].dimensions)
+                time_axes.append(list(dimensions).index("time"))
+        return {
+            "variables": variables,
+            "time_variables": time_variables,
+            "time_axes": time_axes,
+            "header": header["header"],
+        }
+
+    def build_spatial_index(self, netCDF4_file):
+        """
+        Builds the spatial index over the longitudes and latitudes of a NetCDF file.
+
+        Args:
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+
+        Returns:
+            SpatialIndex: The index of the whole grid.
+
+        Raises:
+            NoCoordinatesError: If the file has no longitude or latitude variable.
+        """
+        with self.open_dataset(netCDF4_file) as dataset, self.metrics.phase("index"):
+            lon, lat = read_coordinates(dataset, [], [])
+        if lon is None:
+            raise NoCoordinatesError(
+                "The file has no longitude and latitude variables."
+            )
+        return SpatialIndex(lon, lat)
+
+    def convert_cerv2_data_to_tiles(
+        self,
+        netCDF4_file,
+        filter,
+        longitude_range,
+        latitude_range,
+        step_size,
+        tile_size=DEFAULT_TILE_SIZE,
+        max_levels=None,
+        aggregation="nanmean",
+        time_step=1,
+        time_range=None,
+        framing=NDJSON_FRAMING,
+    ):
+        """
+        Converts the CERV2 data of a NetCDF file to a tile pyramid.
+
+        The variables are preprocessed like for the CERV2 chunks, and every tile of
+        the pyramid is emitted as one JSON record with the aggregated values of its
+        cells and its bounding box, see tile_pyramid.
+
+        Args:
+            netCDF4_file (FileStorage | str): The uploaded NetCDF file or the path of
+                a cached one.
+            tile_size (int): The number of cells along each side of a tile.
+            max_levels (int): An optional upper limit of the number of levels.
+            aggregation (str): How cells are downsampled, see downsampling.
+            time_step (int): The step size along the time dimension.
+            time_range (list): The optional [start, stop] time index range.
+            framing (str): The framing of the records, see stream_framing.
+
+        Yields:
+            str | bytes: The framed JSON tiles, from the coarsest level to the finest.
+        """
+        with self.open_dataset(netCDF4_file) as dataset:
+            # the bounding boxes cover all cells, also those skipped by the stride
+            lon, lat = read_coordinates(dataset, longitude_range, latitude_range)
+            with self.metrics.phase("preprocess"):
+                variables, time_variables = preprocess_variables(
+                    dataset,
+                    filter,
+                    longitude_range,
+                    latitude_range,
+                    step_size,
+                    self.worker_pool,
+                    aggregation,
+                    time_step,
+                    time_range,
+                )
+
+            tiles = iter_tiles(
+                variables,
+                time_variables,
+                lon,
+                lat,
+                tile_size,
+                max_levels,
+                aggregation,
+                coordinate_step=step_size,
+            )
+            tiles = self.count_records("tiles", tiles, lambda tile: 1)
+            encoded_tiles = self.imap(partial(encode_tile, framing=framing), tiles)
+            yield from self.metrics.measure_stream(
+                "serialize", coalesce_writes(encoded_tiles, self.write_bytes)
+            )
+
+
+@contextmanager
+def open_dataset(netCDF4_file, in_memory_threshold=DEFAULT_IN_MEMORY_THRESHOLD):
+    """
+    Opens an uploaded NetCDF file without copying it more often than needed.
+
+    Paths (e.g. of cached datasets) and uploads which were already spooled to a named
+    file are opened in place. Other uploads up to ``in_memory_threshold`` bytes are
+    opened from memory, larger ones are streamed to a temporary file once. Datasets
+    on disk are opened with absolute paths, see get_dataset_path.
+
+    Args:
+        netCDF4_file (FileStorage | str): The uploaded NetCDF file or a file path.
+        in_memory_threshold (int): The maximum size of an upload opened from memory.
+
+    Yields:
+        Dataset: The opened dataset, which is closed afterwards.
+    """
+    if isinstance(netCDF4_file, str):
+        with Dataset(os.path.abspath(netCDF4_file)) as dataset:
+            yield dataset
+        return
+
+    stream = netCDF4_file.stream
+    file_path = getattr(stream, "name", None)
+    if isinstance(file_path, str) and os.path.isfile(file_path):
+        stream.flush()
+        with Dataset(os.path.abspath(file_path)) as dataset:
+            yield dataset
+        return
+
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size <= in_memory_threshold:
+        memory = stream.getbuffer() if hasattr(stream, "getbuffer") else stream.read()
+        # the name of an in-memory dataset is only a label and never an absolute path
+        label = os.path.basename(netCDF4_file.filename or "") or "upload.nc"
+        with Dataset(label, memory=memory) as dataset:
+            yield dataset
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".nc") as spool_file:
+        shutil.copyfileobj(stream, spool_file, SPOOL_CHUNK_SIZE)
+        spool_file.flush()
+        with Dataset(spool_file.name) as dataset:
+            yield dataset
+
+
+def get_dataset_path(dataset):
+    """
+    Returns the absolute path of a dataset opened by open_dataset from disk.
+
+    Returns:
+        str: The path, or None if the dataset was opened from memory.
+    """
+    path = dataset.filepath()
+    return path if os.path.isabs(path) else None
+
+
+def iter_variable_slabs(var, slab_bytes=DEFAULT_SLAB_BYTES):
+    """
+    Reads a variable in slabs along its leading dimension.
+
+    Args:
+        var (Variable): The NetCDF variable with at least one dimension.
+        slab_bytes (int): The approximate size of a slab in bytes.
+
+    Yields:
+        tuple: The index of the first row of the slab and the slab data.
+    """
+    row_bytes = max(1, np.dtype(var.dtype).itemsize * int(np.prod(var.shape[1:])))
+    rows = max(1, slab_bytes // row_bytes)
+    for start in range(0, var.shape[0], rows):
+        yield start, var[start : start + rows].filled()
+
+
+def iter_chunk_blocks(var, block_bytes=DEFAULT_SLAB_BYTES):
+    """
+    Reads a variable in blocks of whole chunks of its native chunking.
+
+    Starting with a single chunk (or a single value of contiguous variables), the
+    block grows by whole chunks along the last dimensions first, as long as it
+    stays below ``block_bytes``, so every chunk is read and decompressed once.
+
+    Args:
+        var (Variable): The NetCDF variable.
+        block_bytes (int): The approximate size of a block in bytes.
+
+    Yields:
+        tuple: The slices of the block and its data, a masked array if the variable
+            has fill values.
+    """
+    if var.ndim == 0:
+        yield (), var[...]
+        return
+    chunking = var.chunking()
+    if chunking in (None, "contiguous"):
+        chunking = [1] * var.ndim
+    block = [max(1, min(size, length)) for size, length in zip(chunking, var.shape)]
+    budget = max(1, block_bytes // np.dtype(var.dtype).itemsize)
+    elements = int(np.prod(block))
+    for dim in reversed(range(var.ndim)):
+        factor = min(-(-var.shape[dim] // block[dim]), max(1, budget // elements))
+        block[dim] *= factor
+        elements *= factor
+    ranges = [range(0, length, size) for length, size in zip(var.shape, block)]
+    for starts in product(*ranges):
+        slices = tuple(slice(start, start + size) for start, size in zip(starts, block))
+        yield slices, var[slices]
+
+
+def is_numeric_variable(var):
+    """
+    Returns whether a NetCDF variable has a boolean, integer or float dtype.
+    """
+    return isinstance(var.dtype, np.dtype) and var.dtype.kind in "biuf"
+
+
+def compute_variable_statistics(
+    var,
+    bins=DEFAULT_HISTOGRAM_BINS,
+    percentiles=DEFAULT_PERCENTILES,
+    per_time_step=False,
+    block_bytes=DEFAULT_SLAB_BYTES,
+):
+    """
+    Computes the statistics of a numeric variable in a single pass over its blocks.
+
+    Returns:
+        dict: The dimensions of the variable and its statistics (see
+            RunningStatistics.to_dict), and with per_time_step the statistics of
+            every time step as ``time_steps``, if the variable has a time dimension.
+    """
+    statistics = RunningStatistics()
+    time_axis = None
+    if per_time_step and "time" in var.dimensions:
+        time_axis = var.dimensions.index("time")
+        time_statistics = [RunningStatistics() for _ in range(var.shape[time_axis])]
+    for slices, block in iter_chunk_blocks(var, block_bytes):
+        statistics.update(block)
+        if time_axis is not None:
+            time_indices = range(*slices[time_axis].indices(var.shape[time_axis]))
+            for i, t in enumerate(time_indices):
+                time_statistics[t].update(block.take(i, axis=time_axis))
+
+    result = {"dimensions": var.dimensions}
+    result.update(statistics.to_dict(bins, percentiles))
+    if time_axis is not None:
+        result["time_steps"] = [
+            step.to_dict(bins, percentiles) for step in time_statistics
+        ]
+    return result
+
+
+def compute_file_variable_statistics(task):
+    """
+    Computes the statistics of a variable of a NetCDF file, e.g. in a worker process.
+
+    Args:
+        task (tuple): The path of the file, the name of the variable and the
+            arguments of compute_variable_statistics.
+
+    Returns:
+        dict: The statistics as returned by compute_variable_statistics.
+    """
+    file_path, var_name, *options = task
+    with Dataset(file_path) as dataset:
+        return compute_variable_statistics(dataset.variables[var_name], *options)
+
+
+def iter_statistics_json(names, results):
+    """
+    Writes the statistics of the variables as a JSON document, one variable at a time.
+
+    Yields:
+        str: The parts of the JSON document.
+    """
+    yield '{"variables": {'
+    for index, (name, result) in enumerate(zip(names, results)):
+        separator = ", " if index else ""
+        yield separator + DATA_ENCODER.encode(name) + ": " + DATA_ENCODER.encode(result)
+    yield "}}"
+
+
+def iter_cerv2_array_blocks(variables, time_variables, batch_rows=1, first_row=0):
+    """
+    Splits the preprocessed CERV2 variables into blocks of grid rows.
+
+    Args:
+        variables (list): (name, data) tuples of variables without a time dimension.
+        time_variables (list): (name, data) tuples of variables with a time dimension.
+        batch_rows (int): The number of grid rows per block.
+        first_row (int): The index of the first row of the variables in the grid,
+            if only a part of the rows was read.
+
+    Yields:
+        tuple: The index of the first row of the block and the (name, data) tuples
+            of the variables and time variables restricted to the block.
+    """
+    batch_rows = max(1, int(batch_rows))
+    if variables:
+        rows = variables[0][1].shape[0]
+    else:
+        rows = time_variables[0][1].shape[0]
+
+    for x_start in range(0, rows, batch_rows):
+        x_stop = x_start + batch_rows
+        yield (
+            first_row + x_start,
+            [(name, data[x_start:x_stop]) for name, data in variables],
+            [(name, data[x_start:x_stop]) for name, data in time_variables],
+        )
+
+
+def count_block_cells(block):
+    """
+    Returns the number of grid cells (and CERV2 records) of a block as yielded by
+    iter_cerv2_array_blocks.
+    """
+    _, var_arrays, time_var_arrays = block
+    shape = (var_arrays or time_var_arrays)[0][1].shape
+    return shape[0] * shape[1]
+
+
+def count_block_records(block, seq_range=None):
+    """
+    Returns the number of CERV2 records of a block within an optional sequence range.
+    """
+    if seq_range is None:
+        return count_block_cells(block)
+    x_start, var_arrays, time_var_arrays = block
+    rows, columns = (var_arrays or time_var_arrays)[0][1].shape[:2]
+    first = max(seq_range[0], x_start * columns)
+    stop = min(seq_range[1], (x_start + rows) * columns)
+    return max(0, stop - first)
+
+
+def get_selected_grid_shape(dataset, lon_range, lat_range, step_size):
+    """
+    Returns the number of rows (west_east) and columns (south_north) of the selected
+    and downsampled grid, which is the same for all aggregations.
+    """
+    shape = []
+    for dim, index_range in (("west_east", lon_range), ("south_north", lat_range)):
+        index_slice = index_range_slice(index_range, step_size)
+        shape.append(len(range(*index_slice.indices(len(dataset.dimensions[dim])))))
+    return tuple(shape)
+
+
+def select_record_rows(
+    dataset,
+    lon_range,
+    lat_range,
+    step_size,
+    start=0,
+    max_records=None,
+    partitions=1,
+    partition=0,
+):
+    """
+    Restricts the longitude range to the grid rows containing a range of records.
+
+    The records are numbered in ``np.ndindex`` order over the selected (and
+    downsampled) grid, so a row holds one record per selected latitude. The
+    narrowed range starts at a multiple of the step size, so downsampled blocks
+    are the same as for the whole grid. With several partitions, the rows are
+    split into disjoint bands of (almost) equal size, and only the records of
+    one band are selected.
+
+    Args:
+        dataset (Dataset): The opened dataset.
+        lon_range (list): The optional [start, stop] west_east index range.
+        lat_range (list): The optional [start, stop] south_north index range.
+        step_size (int): The step size of the grid.
+        start (int): The sequence number of the first record.
+        max_records (int): The maximum number of records, None for all.
+        partitions (int): The number of bands of rows.
+        partition (int): The index of the selected band.
+
+    Returns:
+        tuple: The narrowed longitude range, the index of its first row in the
+            selected grid and the [start, stop) sequence range of the records.
+    """
+    if not 0 <= partition < partitions:
+        raise ValueError(f"Invalid partition {partition} of {partitions}")
+    lon_start, lon_stop, _ = index_range_slice(lon_range).indices(
+        len(dataset.dimensions["west_east"])
+    )
+    rows, columns = get_selected_grid_shape(dataset, lon_range, lat_range, step_size)
+    # the rows of the partition
+    start = max(start, rows * partition // partitions * columns)
+    stop = rows * (partition + 1) // partitions * columns
+    if max_records is not None:
+        stop = min(stop, start + max_records)
+    start = min(start, stop)
+    if columns == 0:
+        return lon_range, 0, (start, stop)
+    first_row = start // columns
+    last_row = -(-stop // columns)
+    narrowed = [
+        lon_start + first_row * step_size,
+        min(lon_start + last_row * step_size, lon_stop),
+    ]
+    return narrowed, first_row, (start, stop)
+
+
+def iter_columnar_blocks(blocks):
+    """
+    Encodes blocks as yielded by iter_cerv2_array_blocks as columnar frames, one
+    frame per variable and block.
+
+    Yields:
+        bytes: The columnar frames.
+    """
+    for x_start, var_blocks, time_var_blocks in blocks:
+        for name, block in var_blocks:
+            yield from encode_frame({"name": name, "x": x_start}, block)
+        for name, block in time_var_blocks:
+            header = {"name": name, "x": x_start, "time": True}
+            yield from encode_frame(header, block)
+
+
+def build_cerv2_records(block, time_layout=INDEXED_TIME_LAYOUT, seq_range=None):
+    """
+    Builds the CERV2 records of a block of grid rows.
+
+    The NumPy data of the block is converted to Python lists at once, so the records
+    only contain native types and can be serialized without falling back to the
+    custom encoder. The sequence number of a record is ``x * columns + y``.
+
+    Args:
+        block (tuple): A block as yielded by iter_cerv2_array_blocks.
+        time_layout (str): "indexed" for a dict of all time variables per time
+            index, "compact" for an array of values per time variable.
+        seq_range (tuple): The optional [start, stop) range of the sequence numbers
+            of the records to build.
+
+    Returns:
+        list: The records of the block, in the same order as ``np.ndindex``.
+    """
+    _, var_arrays, time_var_arrays = block
+    columns = (var_arrays or time_var_arrays)[0][1].shape[1]
+    seqs, cells = get_block_cells(block, seq_range)
+    var_names = [name for name, _ in var_arrays]
+    time_var_names = [name for name, _ in time_var_arrays]
+
+    records = [{"seq": seq, "x": seq // columns, "y": seq % columns} for seq in seqs]
+    if var_arrays:
+        for record, values in zip(records, iter_cell_values(var_arrays, cells)):
+            record["vars"] = dict(zip(var_names, values))
+    if time_var_arrays and time_layout == COMPACT_TIME_LAYOUT:
+        time_cells = iter_cell_values(time_var_arrays, cells)
+        for record, time_series in zip(records, time_cells):
+            record["timeVars"] = dict(zip(time_var_names, time_series))
+    elif time_var_arrays:
+        time_cells = iter_cell_values(time_var_arrays, cells)
+        for record, time_series in zip(records, time_cells):
+            # shorter time series are padded with None
+            record["timeVars"] = {
+                t: dict(zip(time_var_names, values))
+                for t, values in enumerate(zip_longest(*time_series))
+            }
+    return records
+
+
+def build_compact_cerv2_records(block, seq_range=None):
+    """
+    Builds the CERV2 records of a block of grid rows in the compact schema.
+
+    A record is an array of the sequence number followed by the values of the
+    variables and the time series of the time variables, in the order of the
+    fields of the header (see build_compact_header). The grid indices are not
+    repeated, they are ``x = seq // columns`` and ``y = seq % columns``.
+
+    Args:
+        block (tuple): A block as yielded by iter_cerv2_array_blocks.
+        seq_range (tuple): The optional [start, stop) range of the sequence numbers
+            of the records to build.
+
+    Returns:
+        list: The records of the block, in the same order as ``np.ndindex``.
+    """
+    _, var_arrays, time_var_arrays = block
+    seqs, cells = get_block_cells(block, seq_range)
+    values = iter_cell_values(var_arrays + time_var_arrays, cells)
+    return [[seq, *cell] for seq, cell in zip(seqs, values)]
+
+
+def get_block_cells(block, seq_range=None):
+    """
+    Returns the cells of a block within an optional [start, stop) sequence range.
+
+    Returns:
+        tuple: The sequence numbers of the cells and the slice of the cells in the
+            flattened grid rows of the block.
+    """
+    x_start, var_arrays, time_var_arrays = block
+    rows, columns = (var_arrays or time_var_arrays)[0][1].shape[:2]
+    first_seq = x_start * columns
+    start, stop = 0, rows * columns
+    if seq_range is not None:
+        start = min(max(start, seq_range[0] - first_seq), stop)
+        stop = max(start, min(stop, seq_range[1] - first_seq))
+    return range(first_seq + start, first_seq + stop), slice(start, stop)
+
+
+def iter_cell_values(arrays, cells):
+    """
+    Converts cells of a block to native values, all cells of a variable at once.
+
+    Args:
+        arrays (list): (name, data) tuples of the variables of a block.
+        cells (slice): The cells in the flattened grid rows, see get_block_cells.
+
+    Returns:
+        iterator: A tuple per cell with its value (or time series) of every variable.
+    """
+    return zip(*[
+        data.reshape((-1,) + data.shape[2:])[cells].tolist() for _, data in arrays
+    ])
+
+
+def build_compact_header(
+    dataset, variables, time_variables, grid_shape, time_slice, precision=None
+):
+    """
+    Builds the header message of a CERV2 stream in the compact schema.
+
+    Args:
+        dataset (Dataset): The opened dataset.
+        variables (list): (name, data) tuples of variables without a time dimension.
+        time_variables (list): (name, data) tuples of variables with a time dimension.
+        grid_shape (tuple): The number of rows and columns of the selected grid.
+        time_slice (slice): The selected time steps.
+        precision (int): The number of decimals floats are rounded to, if any.
+
+    Returns:
+        dict: The header, with the fields of the records, the number of variables
+            without a time dimension, the dimensions of the selected grid and the
+            file indices (and values of the time coordinate, if there is one) of
+            the selected time steps.
+    """
+    time_indices = []
+    if "time" in dataset.dimensions:
+        time_indices = list(range(*time_slice.indices(len(dataset.dimensions["time"]))))
+    time = {"indices": time_indices}
+    time_name = next((name for name in TIME_NAMES if name in dataset.variables), None)
+    if time_name is not None and dataset.variables[time_name].dimensions == ("time",):
+        time_var = dataset.variables[time_name]
+        time["name"] = time_name
+        time["values"] = np.ma.asarray(time_var[:])[time_indices].tolist()
+        if "units" in time_var.ncattrs():
+            time["units"] = time_var.getncattr("units")
+    return {
+        "header": {
+            "fields": ["seq"] + [name for name, _ in variables + time_variables],
+            "vars": len(variables),
+            "dimensions": {
+                "west_east": grid_shape[0],
+                "south_north": grid_shape[1],
+                "time": len(time_indices),
+            },
+            "time": time,
+            "precision": precision,
+        }
+    }
+
+
+def tag_compact_header(header, file_index):
+    """
+    Adds the index of the file in a batch to the header of a compact stream and
+    the file as the first field of its records.
+    """
+    fields = ["file"] + header["header"]["fields"]
+    return {"header": dict(header["header"], fields=fields, file=file_index)}
+
+
+def frame_batch_event(event, framing=SENTINEL_FRAMING):
+    """
+    Encodes a message about a file of a batch as a framed JSON record.
+    """
+    return frame_records([CERV2_ENCODER.encode(event)], framing)
+
+
+def build_batch_error(index, batch_file, error):
+    """
+    Builds the error message of a file of a batch which can not be converted.
+    Only errors about the selection are described, other errors get a generic message.
+    """
+    if isinstance(error, (NoCoordinatesError, InvalidSelectionError)):
+        description = str(error)
+    else:
+        description = "Failed to parse the provided NetCDF file."
+    return {
+        "file": index,
+        "name": batch_file.name,
+        "event": "error",
+        "error": description,
+    }
+
+
+def order_selections_by_time(selections):
+    """
+    Orders the selections of the files of a batch by the first value of their time
+    coordinate, if all of them have one with the same name and units.
+
+    Args:
+        selections (list): (index, selection) tuples, see read_cerv2_selection.
+
+    Returns:
+        list: The ordered tuples.
+    """
+    times = [selection["header"]["time"] for _, selection in selections]
+    if not has_common_time_coordinate(times) or not all(
+        time["values"] and time["values"][0] is not None for time in times
+    ):
+        return list(selections)
+    return sorted(selections, key=lambda item: item[1]["header"]["time"]["values"][0])
+
+
+def has_common_time_coordinate(times):
+    """
+    Returns whether the time steps of all files of a batch, as described by their
+    compact headers, have values of a time coordinate with the same name and units.
+    """
+    return bool(times) and all(
+        "values" in time
+        and time["name"] == times[0]["name"]
+        and time.get("units") == times[0].get("units")
+        for time in times
+    )
+
+
+def get_merge_conflict(selection, reference):
+    """
+    Describes why the selection of a file can not be merged along the time
+    dimension with the selection of the first file.
+
+    Returns:
+        str: The description, or None if the selections can be merged.
+    """
+    header, reference_header = selection["header"], reference["header"]
+    if (
+        header["fields"] != reference_header["fields"]
+        or header["vars"] != reference_header["vars"]
+    ):
+        return "The variables differ from the variables of the first file."
+    for key in ("west_east", "south_north"):
+        if header["dimensions"][key] != reference_header["dimensions"][key]:
+            return "The selected grid differs from the grid of the first file."
+    for (name, data), (_, reference_data), axis in zip(
+        selection["time_variables"], reference["time_variables"], selection["time_axes"]
+    ):
+        shape = np.delete(data.shape, axis).tolist()
+        if shape != np.delete(reference_data.shape, axis).tolist():
+            return f"The dimensions of {name} differ from the first file."
+    return None
+
+
+def merge_time_selections(selections):
+    """
+    Concatenates the time variables of the selections of several files along
+    the time dimension.
+
+    Args:
+        selections (list): The selections in time order, see read_cerv2_selection.
+
+    Returns:
+        tuple: The variables of the first file, the merged time variables and the
+            merged header in the compact schema, whose time indices are positions
+            in the merged time series.
+    """
+    first = selections[0]
+    time_variables = [
+        (
+            name,
+            np.concatenate(
+                [selection["time_variables"][i][1] for selection in selections], axis
+            ),
+        )
+        for i, ((name, _), axis) in enumerate(
+            zip(first["time_variables"], first["time_axes"])
+        )
+    ]
+    times = [selection["header"]["time"] for selection in selections]
+    time = {"indices": list(range(sum(len(t["indices"]) for t in times)))}
+    if has_common_time_coordinate(times):
+        time["name"] = times[0]["name"]
+        time["values"] = [value for t in times for value in t["values"]]
+        if "units" in times[0]:
+            time["units"] = times[0]["units"]
+    header = first["header"]
+    dimensions = dict(header["dimensions"], time=len(time["indices"]))
+    return (
+        first["variables"],
+        time_variables,
+        {"header": dict(header, dimensions=dimensions, time=time)},
+    )
+
+
+class MemoryBudget:
+    """
+    A number of bytes which concurrent readers reserve their data from.
+    """
+    def __init__(self, max_bytes):
+        self.available = max_bytes
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        """
+        Reserves a number of bytes, if they are still available.
+
+        Returns:
+            bool: Whether the bytes were reserved.
+        """
+        with self.lock:
+            if size > self.available:
+                return False
+            self.available -= size
+            return True
+
+
+def round_block(block, precision=None):
+    """
+    Rounds the floats of a block as yielded by iter_cerv2_array_blocks to a number
+    of decimals, so they are encoded with at most that many digits.
+    """
+    if precision is None:
+        return block
+    x_start, var_arrays, time_var_arrays = block
+    return (
+        x_start,
+        [(name, round_floats(data, precision)) for name, data in var_arrays],
+        [(name, round_floats(data, precision)) for name, data in time_var_arrays],
+    )
+
+
+def round_floats(data, precision):
+    if not np.issubdtype(data.dtype, np.floating):
+        return data
+    # rounded in double precision, so the values are the shortest decimals
+    return np.round(data.astype(np.float64), precision)
+
+
+def encode_cerv2_json_block(
+    block,
+    framing=SENTINEL_FRAMING,
+    time_layout=INDEXED_TIME_LAYOUT,
+    seq_range=None,
+    schema=FULL_SCHEMA,
+    precision=None,
+    file_index=None,
+):
+    """
+    Encodes the CERV2 records of a block of grid rows as framed JSON records.
+
+    Args:
+        block (tuple): A block as yielded by iter_cerv2_array_blocks.
+        framing (str): The framing of the records, see stream_framing.
+        time_layout (str): The layout of the time variables, see build_cerv2_records.
+        seq_range (tuple): The optional [start, stop) range of the sequence numbers
+            of the records, see build_cerv2_records.
+        schema (str): "full" or "compact", see build_compact_cerv2_records.
+        precision (int): The optional number of decimals floats are rounded to.
+        file_index (int): The optional index of the file in a batch, which is added
+            to every record as ``file`` (as the first value of compact records).
+
+    Returns:
+        str | bytes: The framed JSON records.
+    """
+    block = round_block(block, precision)
+    if schema == COMPACT_SCHEMA:
+        records = build_compact_cerv2_records(block, seq_range)
+        if file_index is not None:
+            records = [[file_index] + data for data in records]
+    else:
+        records = build_cerv2_records(block, time_layout, seq_range)
+        if file_index is not None:
+            for data in records:
+                data["file"] = file_index
+    return frame_records((CERV2_ENCODER.encode(data) for data in records), framing)
+
+
+def encode_tile(tile, framing=NDJSON_FRAMING):
+    """
+    Encodes a tile of the tile pyramid as a framed JSON record.
+
+    Args:
+        tile (dict): A tile as yielded by iter_tiles.
+        framing (str): The framing of the record, see stream_framing.
+
+    Returns:
+        str | bytes: The framed JSON record.
+    """
+    return frame_records([CERV2_ENCODER.encode(tile)], framing)
+
+
+def encode_json_rows(slab):
+    """
+    Encodes the rows of a slab as the inner part of a JSON array.
+
+    Args:
+        slab (numpy.ndarray): A slab along the leading dimension of a variable.
+
+    Returns:
+        str: The comma separated JSON rows, without the enclosing brackets.
+    """
+    return DATA_ENCODER.encode(slab)[1:-1]
+
+
+def preprocess_variables(
+    dataset,
+    var_filter,
+    lon_range,
+    lat_range,
+    step_size,
+    worker_pool=None,
+    aggregation=FIRST,
+    time_step=1,
+    time_range=None,
+):
     """
     Preprocess the dataset and split it into variables and time_variables lists.
+
+    Only the selected longitude/latitude/time window and every ``step_size``-th cell
+    of it (and every ``time_step``-th time step) is read from the file. With another
+    aggregation than "first", the whole window is read and every block of
+    ``step_size`` x ``step_size`` cells and ``time_step`` time steps is aggregated
+    instead. The returned arrays are ordered west_east, south_north followed by the
+    remaining dimensions. If a worker pool is given and the dataset is on disk, the
+    variables are read in parallel by the worker processes.
     """
-    variables = []
-    time_variables = []
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {aggregation}")
+    if aggregation == FIRST:
+        # the strides are read directly from the file
+        dim_slices = {
+            "west_east": index_range_slice(lon_range, step_size),
+            "south_north": index_range_slice(lat_range, step_size),
+            "time": index_range_slice(time_range, time_step),
+        }
+        block_sizes = {}
+    else:
+        dim_slices = {
+            "west_east": index_range_slice(lon_range),
+            "south_north": index_range_slice(lat_range),
+            "time": index_range_slice(time_range),
+        }
+        block_sizes = {
+            "west_east": step_size,
+            "south_north": step_size,
+            "time": time_step,
+        }
+    selected = []
     # Store variables
     for var_name, var in dataset.variables.items():
         if var_name in var_filter:
@@ -170,23 +1655,263 @@ def preprocess_variables(dataset, var_filter, lon_range, lat_range, step_size):
                 raise NoCoordinatesError(
                     f"this service doesn't handle the variable {var_name} as it doesn't contain the dimensions south_north and west_east"
                 )
+            selected.append((var_name, var))
 
-            var_data = var[:].filled()  # convert masked array to numpy array
-            if len(var.dimensions) > 2:
-                dim_map = change_dimensions_dict(var.dimensions)
-                var_data = var_data.transpose(list(dim_map.values()))
-            if lon_range:
-                var_data = var_data[int(lon_range[0]) : int(lon_range[1])]
-            if lat_range:
-                var_data = var_data[:, int(lat_range[0]) : int(lat_range[1])]
-            var_data = var_data[::step_size, ::step_size]
-            if "time" in var.dimensions:
-                time_variables.append((var_name, var_data))
-            else:
-                variables.append((var_name, var_data))
+    file_path = get_dataset_path(dataset)
+    if worker_pool is not None and file_path is not None:
+        tasks = [
+            (file_path, var_name, dim_slices, aggregation, block_sizes)
+            for var_name, _ in selected
+        ]
+        var_datas = list(worker_pool.imap(read_file_variable_subset, tasks))
+    else:
+        var_datas = [
+            read_variable_subset(var, dim_slices, aggregation, block_sizes)
+            for _, var in selected
+        ]
+
+    variables = []
+    time_variables = []
+    for (var_name, var), var_data in zip(selected, var_datas):
+        if "time" in var.dimensions:
+            time_variables.append((var_name, var_data))
+        else:
+            variables.append((var_name, var_data))
     return variables, time_variables
 
 
+def estimate_selection_bytes(
+    dataset,
+    var_filter,
+    lon_range,
+    lat_range,
+    step_size,
+    aggregation=FIRST,
+    time_step=1,
+    time_range=None,
+):
+    """
+    Estimates the size (in bytes) of the arrays preprocess_variables returns for a
+    selection, from the shapes and types of the variables without reading them.
+    Aggregated values are counted as 64 bit floats.
+    """
+    dim_slices = {
+        "west_east": index_range_slice(lon_range, step_size),
+        "south_north": index_range_slice(lat_range, step_size),
+        "time": index_range_slice(time_range, time_step),
+    }
+    size = 0
+    for var_name, var in dataset.variables.items():
+        if var_name not in var_filter:
+            continue
+        count = 1
+        for dimension, length in zip(var.dimensions, var.shape):
+            dim_slice = dim_slices.get(dimension, slice(None))
+            count *= len(range(*dim_slice.indices(length)))
+        itemsize = getattr(var.dtype, "itemsize", 8) if aggregation == FIRST else 8
+        size += count * itemsize
+    return size
+
+
+def find_coordinate_names(dataset):
+    """
+    Returns the names of the longitude and latitude variables of a dataset.
+
+    Returns:
+        tuple: The names, or None for coordinates which are not in the dataset.
+    """
+    names = []
+    for candidates in (LONGITUDE_NAMES, LATITUDE_NAMES):
+        names.append(
+            next((name for name in candidates if name in dataset.variables), None)
+        )
+    return tuple(names)
+
+
+def read_coordinates(dataset, lon_range, lat_range, step_size=1):
+    """
+    Reads the longitudes and latitudes of the selected grid cells.
+
+    The coordinate variables are sliced by their dimension names, so both 2-D
+    coordinates and 1-D axes along west_east and south_north are supported. 1-D
+    axes are broadcast to the grid. Coordinates with a time dimension (like XLONG
+    of WRF) are taken from the first time step.
+
+    Returns:
+        tuple: The longitudes and latitudes ordered west_east, south_north, or
+            (None, None) if the dataset has no coordinate variables.
+
+    Raises:
+        NoCoordinatesError: If a coordinate variable has neither the west_east nor
+            the south_north dimension.
+    """
+    lon_name, lat_name = find_coordinate_names(dataset)
+    if lon_name is None or lat_name is None:
+        return None, None
+    dim_slices = {
+        "west_east": index_range_slice(lon_range, step_size),
+        "south_north": index_range_slice(lat_range, step_size),
+    }
+    lon = read_coordinate_variable(dataset.variables[lon_name], dim_slices)
+    lat = read_coordinate_variable(dataset.variables[lat_name], dim_slices)
+    return tuple(np.broadcast_arrays(lon, lat))
+
+
+def read_coordinate_variable(var, dim_slices):
+    """
+    Reads the selected part of a coordinate variable as a grid ordered west_east,
+    south_north. Other dimensions are read at their first index, and a missing grid
+    dimension is kept with length 1.
+    """
+    grid_dims = [dim for dim in ("west_east", "south_north") if dim in var.dimensions]
+    if not grid_dims:
+        raise NoCoordinatesError(
+            f"The coordinate variable {var.name} has neither the dimension "
+            "south_north nor west_east."
+        )
+    index = tuple(dim_slices.get(dim, 0) for dim in var.dimensions)
+    var_data = np.ma.filled(var[index])
+    read_dims = [dim for dim in var.dimensions if dim in dim_slices]
+    var_data = var_data.transpose([read_dims.index(dim) for dim in grid_dims])
+    if "west_east" not in grid_dims:
+        return var_data[np.newaxis, :]
+    if "south_north" not in grid_dims:
+        return var_data[:, np.newaxis]
+    return var_data
+
+
+def index_range_slice(index_range, step_size=1):
+    """
+    Returns a slice for an optional [start, stop] index range and a step size.
+    """
+    if index_range:
+        return slice(int(index_range[0]), int(index_range[1]), step_size)
+    return slice(None, None, step_size)
+
+
+def read_variable_subset(var, dim_slices, aggregation=FIRST, block_sizes=None):
+    """
+    Reads the selected part of a NetCDF variable from disk.
+
+    The slices are given per dimension name and are passed to netCDF4, so only the
+    selected (and strided) part of the variable is read. Dimensions without a slice
+    are read completely. Dimensions with a block size are downsampled afterwards
+    with the aggregation, missing values are aggregated as NaN.
+
+    Args:
+        var (Variable): The NetCDF variable to read from.
+        dim_slices (dict): A mapping from dimension names to slices.
+        aggregation (str): The aggregation of the blocks, see downsampling.
+        block_sizes (dict): A mapping from dimension names to block sizes.
+
+    Returns:
+        numpy.ndarray: The data, with the dimensions ordered by change_dimensions_dict.
+    """
+    index = tuple(dim_slices.get(dim, slice(None)) for dim in var.dimensions)
+    var_data = var[index]
+    if block_sizes:
+        var_data = fill_masked_with_nan(var_data)
+        sizes = [block_sizes.get(dim, 1) for dim in var.dimensions]
+        var_data = block_reduce(var_data, sizes, aggregation)
+    else:
+        var_data = np.ma.filled(var_data)  # convert masked array to numpy array
+    dim_map = change_dimensions_dict(var.dimensions)
+    return var_data.transpose(list(dim_map.values()))
+
+
+def fill_masked_with_nan(var_data):
+    """
+    Converts a masked array to a NumPy array with NaN as missing value.
+
+    Arrays without masked values keep their dtype, others are converted to floats.
+    """
+    if not np.ma.is_masked(var_data):
+        return np.ma.getdata(var_data)
+    var_data = var_data.astype(np.result_type(var_data.dtype, np.float32))
+    return var_data.filled(np.nan)
+
+
+def build_metadata(dataset, details=False):
+    """
+    Collects the dimensions, variable metadata and global attributes of a dataset.
+
+    Args:
+        dataset (Dataset): The opened NetCDF dataset.
+        details (bool): Whether to add the shape, dtype, chunking and compression
+            of every variable.
+
+    Returns:
+        dict: The metadata of the dataset.
+    """
+    data = {
+        "dimensions": {},  #  list of dimensions and their sizes
+        "variables_metadata": {},  #  metadata about each variable
+        "global_attributes": {},  # global metadata
+    }
+
+    # Store dimensions
+    for dim_name, dim in dataset.dimensions.items():
+        data["dimensions"][dim_name] = len(dim)
+
+    # Store variables
+    for var_name, var in dataset.variables.items():
+        data["variables_metadata"][var_name] = {
+            "dimensions": var.dimensions,
+            "attributes": {},
+        }
+
+        for attr_name in var.ncattrs():
+            data["variables_metadata"][var_name]["attributes"][
+                attr_name
+            ] = getattr(var, attr_name)
+
+        if details:
+            data["variables_metadata"][var_name].update(
+                {
+                    "shape": var.shape,
+                    "dtype": str(var.dtype)
+                    if isinstance(var.dtype, np.dtype)
+                    else var.dtype.__name__,
+                    "chunking": var.chunking(),
+                    "compression": var.filters(),
+                }
+            )
+
+    # Store global attributes
+    for attr_name in dataset.ncattrs():
+        data["global_attributes"][attr_name] = getattr(dataset, attr_name)
+
+    return data
+
+
+def get_fill_value(var):
+    """
+    Returns the value masked entries of a variable are filled with.
+    """
+    fill_value = getattr(
+        var, "_FillValue", default_fillvals.get(np.dtype(var.dtype).str[1:])
+    )
+    return None if fill_value is None else np.asarray(fill_value).item()
+
+
+def read_file_variable_subset(task):
+    """
+    Reads the selected part of a variable of a NetCDF file, e.g. in a worker process.
+
+    Args:
+        task (tuple): The path of the file, the name of the variable, the slices
+            per dimension name, the aggregation and the block sizes per dimension name.
+
+    Returns:
+        numpy.ndarray: The data as returned by read_variable_subset.
+    """
+    file_path, var_name, dim_slices, aggregation, block_sizes = task
+    with Dataset(file_path) as dataset:
+        return read_variable_subset(
+            dataset.variables[var_name], dim_slices, aggregation, block_sizes
+        )
+
+
 def change_dimensions_dict(dimensions):
     """
     Returns a dict mapping the dimensions to an index
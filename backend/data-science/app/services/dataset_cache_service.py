@@ -0,0 +1,285 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+from app.errors import DatasetNotFoundError, FailedToParseError
+from netCDF4 import Dataset
+
+# Default upper bound for the size of all cached files (in bytes)
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# Default time (in seconds) after which an unused dataset is evicted
+DEFAULT_TTL = 60 * 60
+# Size of the chunks used when hashing and storing an upload
+STORE_CHUNK_SIZE = 1024 * 1024
+
+HANDLE_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DatasetCacheService:
+    """
+    A content-addressed cache for uploaded NetCDF files.
+
+    Every upload is stored once under the SHA-256 hash of its content, which is also
+    the handle clients use to refer to it. Files live in a directory on disk, so all
+    workers of the service share them. The cache is bounded by the total size of the
+    files (least recently used files are evicted first) and by a time to live after
+    the last use. Datasets which are still read by a response are pinned and are not
+    evicted until they are unpinned. Values derived from a dataset, such as its
+    metadata, are memoized per worker until the dataset is evicted.
+    """
+    def __init__(
+        self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL
+    ):
+        self.cache_dir = cache_dir or os.path.join(
+            tempfile.gettempdir(), "netcdf-dataset-cache"
+        )
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memoized = {}
+        self.memoize_locks = {}
+        self.pins = {}
+        self.lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        Applies the application configuration to the service.
+
+        Args:
+            config (dict): The Flask configuration.
+        """
+        self.cache_dir = config.get("DATASET_CACHE_DIR") or self.cache_dir
+        self.max_bytes = config.get("DATASET_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        self.ttl = config.get("DATASET_CACHE_TTL", DEFAULT_TTL)
+
+    def add(self, netCDF4_file):
+        """
+        Stores an uploaded NetCDF file in the cache.
+
+        The upload is hashed while it is written to disk, so it is read only once.
+        Uploading a file which is already cached only refreshes its entry.
+
+        Args:
+            netCDF4_file (FileStorage): The uploaded NetCDF file.
+
+        Returns:
+            dict: The handle of the dataset, its size and whether it was cached before.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        stream = netCDF4_file.stream
+        stream.seek(0)
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, suffix=".part", delete=False
+        ) as part_file:
+            try:
+                while chunk := stream.read(STORE_CHUNK_SIZE):
+                    digest.update(chunk)
+                    part_file.write(chunk)
+            except BaseException:
+                os.remove(part_file.name)
+                raise
+        handle = digest.hexdigest()
+        size = os.path.getsize(part_file.name)
+
+        with self.lock:
+            path = self.get_file_path(handle)
+            cached = os.path.isfile(path)
+            if cached:
+                os.remove(part_file.name)
+            else:
+                try:
+                    # make sure only valid NetCDF files are stored
+                    Dataset(part_file.name).close()
+                except OSError:
+                    os.remove(part_file.name)
+                    raise FailedToParseError("Failed to parse the provided NetCDF file.")
+                os.replace(part_file.name, path)
+            os.utime(path)
+            self.evict()
+
+        return {"handle": handle, "size": size, "cached": cached}
+
+    def get_path(self, handle):
+        """
+        Returns the path of a cached dataset and marks it as recently used.
+
+        Args:
+            handle (str): The handle of the dataset.
+
+        Returns:
+            str: The path of the cached NetCDF file.
+
+        Raises:
+            DatasetNotFoundError: If the dataset is not (or no longer) cached.
+        """
+        with self.lock:
+            return self.use_entry(handle)
+
+    def pin(self, handle):
+        """
+        Returns the path of a cached dataset like get_path, and keeps the dataset from
+        being evicted until it is unpinned, e.g. while a streamed response reads it.
+
+        Args:
+            handle (str): The handle of the dataset.
+
+        Returns:
+            str: The path of the cached NetCDF file.
+
+        Raises:
+            DatasetNotFoundError: If the dataset is not (or no longer) cached.
+        """
+        with self.lock:
+            path = self.use_entry(handle)
+            self.pins[handle] = self.pins.get(handle, 0) + 1
+        return path
+
+    def unpin(self, handle):
+        """
+        Releases a pin of a dataset, which can be evicted again once all its pins are
+        released.
+
+        Args:
+            handle (str): The handle of the dataset.
+        """
+        with self.lock:
+            self.pins[handle] -= 1
+            if self.pins[handle] == 0:
+                del self.pins[handle]
+
+    def memoize(self, handle, key, compute):
+        """
+        Returns a value derived from a cached dataset, computing it only once.
+
+        Args:
+            handle (str): The handle of the dataset.
+            key (str): The name of the derived value.
+            compute (callable): Computes the value from the path of the dataset.
+
+        Returns:
+            object: The memoized value.
+        """
+        path = self.pin(handle)
+        try:
+            return self.memoize_pinned(handle, key, compute, path)
+        finally:
+            self.unpin(handle)
+
+    def memoize_pinned(self, handle, key, compute, path):
+        """
+        Returns a memoized value of a pinned dataset, see memoize.
+        """
+        with self.lock:
+            values = self.memoized.setdefault(handle, {})
+            if key in values:
+                return values[key]
+            key_lock = self.memoize_locks.setdefault((handle, key), threading.Lock())
+        # the value is computed by one thread only, without blocking other datasets
+        with key_lock:
+            with self.lock:
+                values = self.memoized.setdefault(handle, {})
+                if key in values:
+                    return values[key]
+            try:
+                value = compute(path)
+            except BaseException:
+                with self.lock:
+                    self.memoize_locks.pop((handle, key), None)
+                raise
+            # the value is stored before the lock is dropped, so it is computed once
+            with self.lock:
+                # the dataset may have been removed while the value was computed
+                if self.memoized.get(handle) is values:
+                    values[key] = value
+                self.memoize_locks.pop((handle, key), None)
+        return value
+
+    def remove(self, handle):
+        """
+        Removes a dataset from the cache.
+
+        Args:
+            handle (str): The handle of the dataset.
+
+        Raises:
+            DatasetNotFoundError: If the dataset is not cached.
+        """
+        path = self.get_file_path(handle)
+        with self.lock:
+            if not os.path.isfile(path):
+                raise DatasetNotFoundError(f"The dataset {handle} is not cached.")
+            self.remove_entry(handle)
+
+    def evict(self):
+        """
+        Removes expired datasets and, if the cache is still too large, the least
+        recently used ones. Pinned datasets are kept, but count towards the size of
+        the cache. Must be called while holding the lock.
+        """
+        entries = []
+        pinned_size = 0
+        now = time.time()
+        for file_name in os.listdir(self.cache_dir):
+            handle, extension = os.path.splitext(file_name)
+            if extension != ".nc" or not HANDLE_PATTERN.match(handle):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, file_name))
+            if handle in self.pins:
+                pinned_size += stat.st_size
+            elif now - stat.st_mtime > self.ttl:
+                self.remove_entry(handle)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, handle))
+
+        total_size = pinned_size + sum(size for _, size, _ in entries)
+        # always keep the most recently used dataset
+        for _, size, handle in sorted(entries)[:-1]:
+            if total_size <= self.max_bytes:
+                break
+            self.remove_entry(handle)
+            total_size -= size
+
+    def use_entry(self, handle):
+        """
+        Returns the path of a cached dataset and marks it as recently used. Must be
+        called while holding the lock.
+
+        Raises:
+            DatasetNotFoundError: If the dataset is not (or no longer) cached.
+        """
+        path = self.get_file_path(handle)
+        try:
+            expired = time.time() - os.path.getmtime(path) > self.ttl
+            if expired and handle not in self.pins:
+                self.remove_entry(handle)
+                raise DatasetNotFoundError(f"The dataset {handle} has expired.")
+            os.utime(path)
+        except FileNotFoundError:
+            self.memoized.pop(handle, None)
+            raise DatasetNotFoundError(f"The dataset {handle} is not cached.")
+        return path
+
+    def remove_entry(self, handle):
+        """
+        Deletes the file and the memoized values of a dataset. Must be called while
+        holding the lock.
+        """
+        self.memoized.pop(handle, None)
+        try:
+            os.remove(self.get_file_path(handle))
+        except FileNotFoundError:
+            pass
+
+    def get_file_path(self, handle):
+        """
+        Returns the path a dataset is stored at.
+
+        Raises:
+            DatasetNotFoundError: If the handle is not a valid content hash.
+        """
+        if not HANDLE_PATTERN.match(handle):
+            raise DatasetNotFoundError(f"{handle} is not a valid dataset handle.")
+        return os.path.join(self.cache_dir, f"{handle}.nc")
@@ -0,0 +1,82 @@
+"""
+Module containing the block reductions used to downsample variables.
+
+Downsampling by a step size either keeps the first cell of every block of
+``step_size`` cells (the stride, which can be read directly from the file) or
+aggregates all cells of the block. Blocks at the end of an axis may be smaller.
+The NaN-aware aggregations ignore missing values, the others propagate them.
+"""
+
+import numpy as np
+
+FIRST = "first"
+
+# Aggregations and the ufuncs which reduce the blocks, means are computed from sums
+AGGREGATIONS = {
+    FIRST: None,
+    "mean": np.add,
+    "min": np.minimum,
+    "max": np.maximum,
+    "nanmean": np.add,
+    "nanmin": np.fmin,
+    "nanmax": np.fmax,
+}
+
+
+def block_reduce(array, block_sizes, aggregation=FIRST):
+    """
+    Reduces every block of cells to a single cell.
+
+    Args:
+        array (numpy.ndarray): The data to reduce.
+        block_sizes (sequence): The number of cells per block along every axis.
+        aggregation (str): The name of the aggregation, see AGGREGATIONS.
+
+    Returns:
+        numpy.ndarray: The reduced data, with ``ceil(n / block_size)`` cells along
+            every axis.
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {aggregation}")
+    axes = [
+        (axis, block_size)
+        for axis, block_size in enumerate(block_sizes)
+        if block_size > 1 and array.shape[axis] > 0
+    ]
+    if not axes:
+        return array
+    if aggregation == FIRST:
+        index = [slice(None)] * array.ndim
+        for axis, block_size in axes:
+            index[axis] = slice(None, None, block_size)
+        return array[tuple(index)]
+    if not aggregation.endswith("mean"):
+        for axis, block_size in axes:
+            starts = np.arange(0, array.shape[axis], block_size)
+            array = AGGREGATIONS[aggregation].reduceat(array, starts, axis=axis)
+        return array
+
+    # the sums and counts of all axes are reduced first, so the mean of a block
+    # weights every valid cell equally
+    array = array.astype(np.result_type(array.dtype, np.float32), copy=False)
+    if aggregation == "nanmean":
+        valid = ~np.isnan(array)
+        sums = np.where(valid, array, 0)
+        counts = valid.astype(np.intp)
+    else:
+        sums = array
+        counts = np.ones((1,) * array.ndim, dtype=np.intp)
+    for axis, block_size in axes:
+        starts = np.arange(0, array.shape[axis], block_size)
+        sums = np.add.reduceat(sums, starts, axis=axis)
+        if counts.shape[axis] == 1 and aggregation != "nanmean":
+            # the number of cells per block along this axis
+            shape = [1] * array.ndim
+            shape[axis] = len(starts)
+            sizes = np.diff(np.append(starts, array.shape[axis])).reshape(shape)
+            counts = counts * sizes
+        else:
+            counts = np.add.reduceat(counts, starts, axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # blocks without any valid value become NaN
+        return (sums / counts).astype(array.dtype, copy=False)
@@ -0,0 +1,106 @@
+"""
+Module containing the JSON encoding of NumPy data.
+
+Arrays of every numeric dtype are encoded directly from their buffers with orjson
+(a dependency of the service, the fallback only serves environments without it),
+which also formats floats much faster than ``repr``. Floats are
+widened to double precision first, so every value is encoded with the same digits
+as by the ``repr`` of the value (only the exponent notation and whitespace differ).
+Otherwise, and where orjson would change the encoding (NaN and infinity without
+``ignore_nan``), the C encoder of simplejson is used, which only calls back into
+Python for NumPy scalars and arrays.
+"""
+
+import numpy as np
+import simplejson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Kinds of the dtypes encoded from their buffers: booleans, integers and floats
+BUFFER_KINDS = "biuf"
+
+
+def custom_encoder(obj):
+    """
+    Converts NumPy scalars and arrays of every dtype to JSON serializable values.
+
+    Args:
+        obj (object): The object to be serialized.
+
+    Returns:
+        object: A JSON serializable representation of the input object.
+    """
+    if isinstance(obj, np.ndarray):
+        # masked values of masked arrays become None
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+class NumpyJSONEncoder:
+    """
+    A JSON encoder for data containing NumPy scalars and arrays.
+
+    NaN and infinity are handled like by simplejson: with ``ignore_nan`` they are
+    encoded as null, with ``allow_nan`` as the NaN and Infinity extensions of JSON,
+    otherwise they raise a ValueError.
+    """
+    def __init__(self, ignore_nan=False, allow_nan=False):
+        self.ignore_nan = ignore_nan
+        self.fallback = simplejson.JSONEncoder(
+            default=custom_encoder, ignore_nan=ignore_nan, allow_nan=allow_nan
+        )
+
+    def encode(self, obj):
+        """
+        Encodes an object, arrays are encoded from their buffers.
+
+        Args:
+            obj (object): The object, e.g. a record or an array.
+
+        Returns:
+            str: The JSON document.
+        """
+        if isinstance(obj, np.ndarray):
+            return self.encode_array(obj)
+        # orjson encodes NaN as null, so it can only be used with ignore_nan
+        if orjson is not None and self.ignore_nan:
+            try:
+                return orjson.dumps(
+                    obj, default=custom_encoder, option=orjson.OPT_NON_STR_KEYS
+                ).decode()
+            except TypeError:
+                # e.g. integers with more than 64 bits
+                pass
+        return self.fallback.encode(obj)
+
+    def encode_array(self, array):
+        """
+        Encodes an array as nested JSON arrays.
+
+        Args:
+            array (numpy.ndarray): The array, of any dtype and byte order.
+
+        Returns:
+            str: The JSON document.
+        """
+        if (
+            orjson is None
+            or array.ndim == 0
+            or array.dtype.kind not in BUFFER_KINDS
+            or np.ma.is_masked(array)
+        ):
+            return self.fallback.encode(array.tolist())
+        array = np.ma.getdata(array)
+        if array.dtype.kind == "f":
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            if not self.ignore_nan and not np.isfinite(array).all():
+                return self.fallback.encode(array.tolist())
+        else:
+            # orjson reads contiguous buffers in native byte order
+            array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("="))
+        return orjson.dumps(array, option=orjson.OPT_SERIALIZE_NUMPY).decode()
@@ -0,0 +1,215 @@
+"""
+Module containing the in-process metrics of the service.
+
+Metrics are kept per worker process and exposed in the Prometheus text format.
+Every series can carry the ``pid`` of its worker, so the series of the workers
+scraped through the same address are kept apart and can be summed up in queries.
+Observations only take a lock and a bisect, so the instrumentation can stay
+enabled under load.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PHASE_SECONDS = "netcdf_phase_seconds"
+REQUEST_SECONDS = "netcdf_request_seconds"
+BYTES_RECEIVED = "netcdf_bytes_received_total"
+BYTES_SENT = "netcdf_bytes_sent_total"
+RECORDS_EMITTED = "netcdf_records_emitted_total"
+ACTIVE_REQUESTS = "netcdf_active_requests"
+
+# Types and descriptions of the metrics
+METRICS = {
+    PHASE_SECONDS: ("histogram", "Time spent in the phases of the conversions"),
+    REQUEST_SECONDS: ("histogram", "Time from the start of a request until its response was sent"),
+    BYTES_RECEIVED: ("counter", "Bytes of the request bodies"),
+    BYTES_SENT: ("counter", "Bytes of the response bodies"),
+    RECORDS_EMITTED: ("counter", "Records emitted by the record streams"),
+    ACTIVE_REQUESTS: ("gauge", "Requests whose response has not been sent completely"),
+}
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)
+
+# Phases of the current request, for the Server-Timing header
+request_phases = ContextVar("request_phases", default=None)
+
+
+class MetricsService:
+    """
+    A registry of counters, gauges and latency histograms.
+
+    Every metric has a set of label values per series. Phases measured while a
+    request is active are also collected for that request, see start_request.
+    """
+    def __init__(self, enabled=True, buckets=LATENCY_BUCKETS, worker_label=False):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.worker_label = worker_label
+        self.series = {name: {} for name in METRICS}
+        self.lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        Applies the application configuration to the service.
+
+        Args:
+            config (dict): The Flask configuration.
+        """
+        self.enabled = config.get("METRICS_ENABLED", True)
+        self.worker_label = config.get("METRICS_WORKER_LABEL", True)
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds a value to a counter or gauge.
+        """
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds an observation to a histogram.
+        """
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series[name].get(key)
+            if series is None:
+                # the counts of the buckets and of +Inf, followed by the sum
+                series = self.series[name][key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def record_phase(self, phase, seconds):
+        """
+        Records the duration of a phase, also for the Server-Timing of the request.
+        """
+        self.observe(PHASE_SECONDS, seconds, phase=phase)
+        phases = request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0) + seconds
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Measures the duration of the enclosed block as a phase.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(phase, time.perf_counter() - start)
+
+    def measure_stream(self, phase, stream):
+        """
+        Measures the time spent producing the items of a stream as a phase.
+
+        The time the consumer of the stream spends between the items is excluded.
+
+        Args:
+            phase (str): The name of the phase.
+            stream (iterable): The stream.
+
+        Yields:
+            object: The items of the stream.
+        """
+        if not self.enabled:
+            yield from stream
+            return
+        iterator = iter(stream)
+        elapsed = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    return
+                elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.record_phase(phase, elapsed)
+
+    def start_request(self):
+        """
+        Starts collecting the phases of the request handled in the current context.
+
+        Returns:
+            dict: The seconds per phase, filled while the request is handled.
+        """
+        phases = {}
+        request_phases.set(phases)
+        return phases
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        worker = (("pid", os.getpid()),) if self.worker_label else ()
+        with self.lock:
+            # copy the histograms, which are updated in place
+            snapshot = {
+                name: {
+                    key: list(value) if isinstance(value, list) else value
+                    for key, value in series.items()
+                }
+                for name, series in self.series.items()
+            }
+        for name, (metric_type, description) in METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(snapshot[name].items()):
+                key += worker
+                if metric_type != "histogram":
+                    lines.append(f"{name}{format_labels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    labels = format_labels(key + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(key)} {value[-1]}")
+                lines.append(f"{name}_count{format_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(key):
+    if not key:
+        return ""
+    labels = ",".join(f'{name}="{escape_label_value(value)}"' for name, value in key)
+    return "{" + labels + "}"
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_server_timing(phases, total=None):
+    """
+    Formats phase durations (in seconds) as a Server-Timing header value.
+    """
+    metrics = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in phases.items()]
+    if total is not None:
+        metrics.append(f"app;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
@@ -0,0 +1,271 @@
+"""
+Module for reading the metadata of NetCDF files from the beginning of an upload.
+
+The classic formats (CDF-1, CDF-2 and CDF-5) store their complete header at the start
+of the file, so it can be parsed as soon as enough bytes of the upload arrived,
+without receiving or storing the rest of the file.
+"""
+
+import struct
+
+import numpy as np
+from app.errors import IncompleteHeaderError
+from werkzeug.http import parse_options_header
+
+# Size of the chunks the request body is read in
+READ_CHUNK_SIZE = 64 * 1024
+
+CLASSIC_MAGIC = b"CDF"
+
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+STREAMING = 0xFFFFFFFF
+
+# Big-endian NumPy dtypes of the classic external data types
+NC_TYPES = {
+    1: np.dtype(">i1"),
+    2: np.dtype("S1"),
+    3: np.dtype(">i2"),
+    4: np.dtype(">i4"),
+    5: np.dtype(">f4"),
+    6: np.dtype(">f8"),
+    7: np.dtype(">u1"),
+    8: np.dtype(">u2"),
+    9: np.dtype(">u4"),
+    10: np.dtype(">i8"),
+    11: np.dtype(">u8"),
+}
+NC_CHAR = 2
+
+
+def is_classic_format(buffer):
+    """
+    Returns whether a file starting with the given bytes is a classic NetCDF file.
+    """
+    return bytes(buffer[:3]) == CLASSIC_MAGIC
+
+
+class ClassicHeaderParser:
+    """
+    A parser for the header of a classic NetCDF file.
+
+    Raises IncompleteHeaderError if the buffer ends before the header does.
+    """
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        self.offset = 0
+        version = self.read(4)[3]
+        if version not in (1, 2, 5):
+            raise ValueError(f"Unsupported classic NetCDF version {version}")
+        # CDF-5 uses 64 bit sizes, CDF-2 and CDF-5 use 64 bit offsets
+        self.size_format = ">Q" if version == 5 else ">I"
+        self.offset_format = ">I" if version == 1 else ">Q"
+
+    def read(self, length):
+        if self.offset + length > len(self.buffer):
+            raise IncompleteHeaderError("The buffer ends before the header.")
+        data = self.buffer[self.offset : self.offset + length]
+        self.offset += length
+        return data
+
+    def read_value(self, value_format):
+        return struct.unpack(value_format, self.read(struct.calcsize(value_format)))[0]
+
+    def read_size(self):
+        return self.read_value(self.size_format)
+
+    def read_name(self):
+        length = self.read_size()
+        name = bytes(self.read(length)).decode("utf-8")
+        self.read(-length % 4)
+        return name
+
+    def read_list(self, tag):
+        list_tag = self.read_value(">I")
+        count = self.read_size()
+        if list_tag not in (0, tag) or (list_tag == 0 and count != 0):
+            raise ValueError("Invalid classic NetCDF header")
+        return count
+
+    def read_values(self, nc_type, count):
+        dtype = NC_TYPES[nc_type]
+        nbytes = dtype.itemsize * count
+        data = bytes(self.read(nbytes))
+        self.read(-nbytes % 4)
+        if nc_type == NC_CHAR:
+            return data.decode("utf-8").rstrip("\x00")
+        values = np.frombuffer(data, dtype=dtype)
+        return values[0].item() if count == 1 else values.tolist()
+
+    def read_attributes(self):
+        attributes = {}
+        for _ in range(self.read_list(NC_ATTRIBUTE)):
+            name = self.read_name()
+            nc_type = self.read_value(">I")
+            attributes[name] = self.read_values(nc_type, self.read_size())
+        return attributes
+
+    def parse(self, details=False):
+        """
+        Parses the header.
+
+        Args:
+            details (bool): Whether to add the shape, dtype, chunking and compression
+                of every variable.
+
+        Returns:
+            dict: The metadata in the format of the metadata endpoint.
+        """
+        num_records = self.read_size()
+        dimensions = []
+        for _ in range(self.read_list(NC_DIMENSION)):
+            name = self.read_name()
+            length = self.read_size()
+            if length == 0:
+                # the record dimension, its length is the number of records
+                length = None if num_records == STREAMING else num_records
+            dimensions.append((name, length))
+
+        global_attributes = self.read_attributes()
+
+        variables_metadata = {}
+        for _ in range(self.read_list(NC_VARIABLE)):
+            name = self.read_name()
+            dim_ids = [self.read_size() for _ in range(self.read_size())]
+            attributes = self.read_attributes()
+            nc_type = self.read_value(">I")
+            self.read_size()  # vsize
+            self.read_value(self.offset_format)  # begin
+            var_dimensions = [dimensions[dim_id][0] for dim_id in dim_ids]
+            variables_metadata[name] = {
+                "dimensions": var_dimensions,
+                "attributes": attributes,
+            }
+            if details:
+                variables_metadata[name].update(
+                    {
+                        "shape": [dimensions[dim_id][1] for dim_id in dim_ids],
+                        "dtype": str(NC_TYPES[nc_type].newbyteorder("=")),
+                        "chunking": None,
+                        "compression": None,
+                    }
+                )
+
+        return {
+            "dimensions": dict(dimensions),
+            "variables_metadata": variables_metadata,
+            "global_attributes": global_attributes,
+        }
+
+
+def parse_classic_header(buffer, details=False):
+    """
+    Parses the header of a classic NetCDF file from the beginning of the file.
+
+    Args:
+        buffer (bytes): The first bytes of the file.
+        details (bool): Whether to add details about every variable.
+
+    Returns:
+        dict: The metadata in the format of the metadata endpoint.
+
+    Raises:
+        IncompleteHeaderError: If the buffer does not contain the whole header.
+    """
+    return ClassicHeaderParser(buffer).parse(details)
+
+
+def iter_multipart_file(stream, boundary, field_name="file"):
+    """
+    Reads the content of a file field from a multipart request body incrementally.
+
+    Reading stops as soon as the file field is complete, the rest of the body is
+    left in the stream. Unlike werkzeug's MultipartDecoder, which holds back binary
+    data after line breaks, all data except a possible partial boundary at the end
+    of the buffer is passed on immediately.
+
+    Args:
+        stream (IO): The request body.
+        boundary (str): The multipart boundary from the Content-Type header.
+        field_name (str): The name of the file field.
+
+    Yields:
+        bytes: The content of the file, chunk by chunk.
+    """
+    delimiter = b"--" + boundary.encode()
+    buffer = bytearray(b"\r\n")
+    eof = False
+
+    def fill():
+        nonlocal eof
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer.extend(chunk)
+
+    position = -1
+    while True:
+        # find the next delimiter, which is always preceded by a line break
+        position = buffer.find(b"\r\n" + delimiter)
+        while position == -1 and not eof:
+            fill()
+            position = buffer.find(b"\r\n" + delimiter)
+        if position == -1:
+            return
+        del buffer[: position + 2 + len(delimiter)]
+        while len(buffer) < 2 and not eof:
+            fill()
+        if buffer.startswith(b"--"):
+            return  # the closing delimiter
+        line_end = buffer.find(b"\r\n")
+        while line_end == -1 and not eof:
+            fill()
+            line_end = buffer.find(b"\r\n")
+        if line_end == -1:
+            return
+        if bytes(buffer[:line_end]).strip(b" \t"):
+            # the boundary is only the beginning of a longer line
+            continue
+
+        # the headers of the part
+        headers_end = buffer.find(b"\r\n\r\n")
+        while headers_end == -1 and not eof:
+            fill()
+            headers_end = buffer.find(b"\r\n\r\n")
+        if headers_end == -1:
+            return
+        headers = bytes(buffer[:headers_end]).decode("latin-1").split("\r\n")
+        del buffer[: headers_end + 4]
+        name = None
+        for header in headers:
+            key, _, value = header.partition(":")
+            if key.strip().lower() == "content-disposition":
+                name = parse_options_header(value.strip())[1].get("name")
+        if name != field_name:
+            buffer[:0] = b"\r\n"
+            continue
+
+        # the content of the file, up to the next delimiter
+        tail_length = len(delimiter) + 1
+        while True:
+            position = buffer.find(b"\r\n" + delimiter)
+            if position != -1:
+                if position:
+                    yield bytes(buffer[:position])
+                return
+            if eof:
+                raise ValueError("The multipart body ends inside the file.")
+            if len(buffer) > tail_length:
+                yield bytes(buffer[:-tail_length])
+                del buffer[:-tail_length]
+            fill()
+
+
+def drain(stream):
+    """
+    Reads and discards the rest of a request body.
+    """
+    while stream.read(READ_CHUNK_SIZE):
+        pass
@@ -0,0 +1,219 @@
+"""
+Module for resolving geographic selections to index ranges of the grid.
+
+Rectilinear grids (longitudes only change along west_east and latitudes only along
+south_north) are indexed by their sorted axes and resolved with binary searches.
+Curvilinear grids are indexed by the bounding boxes of blocks of cells; only the
+cells of blocks intersecting a selection are tested individually.
+"""
+
+import numpy as np
+from app.errors import InvalidSelectionError
+
+# Number of cells along each side of the blocks of a curvilinear index
+DEFAULT_BLOCK_SIZE = 32
+
+
+class SpatialIndex:
+    """
+    An index over the longitudes and latitudes of a grid.
+
+    The coordinates are ordered west_east, south_north, like the preprocessed
+    variables. Selections resolve to [start, stop] index ranges along west_east
+    (longitude_range) and south_north (latitude_range) covering all selected cells.
+    """
+    def __init__(self, lon, lat, block_size=DEFAULT_BLOCK_SIZE):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        self.shape = lon.shape
+        self.block_size = block_size
+        self.lon_axis = None
+        self.lat_axis = None
+        if is_rectilinear(lon, lat):
+            self.lon_axis = lon[:, 0]
+            self.lat_axis = lat[0, :]
+        else:
+            self.lon = lon
+            self.lat = lat
+            self.block_bounds = [
+                reduce_blocks(values, block_size, function)
+                for values, function in (
+                    (lon, np.fmin),
+                    (lon, np.fmax),
+                    (lat, np.fmin),
+                    (lat, np.fmax),
+                )
+            ]
+
+    @property
+    def rectilinear(self):
+        return self.lon_axis is not None
+
+    def resolve_bbox(self, bbox):
+        """
+        Resolves a bounding box to the index ranges of the cells inside it.
+
+        Args:
+            bbox (list): [min lon, min lat, max lon, max lat].
+
+        Returns:
+            tuple: The longitude_range and latitude_range of the covering sub-grid.
+
+        Raises:
+            InvalidSelectionError: If the bounding box is invalid or no cell is
+                inside it.
+        """
+        if len(bbox) != 4:
+            raise InvalidSelectionError("A bounding box needs four values.")
+        min_lon, min_lat, max_lon, max_lat = map(float, bbox)
+        if self.rectilinear:
+            return (
+                axis_range(self.lon_axis, min_lon, max_lon),
+                axis_range(self.lat_axis, min_lat, max_lat),
+            )
+
+        window = self.candidate_window(min_lon, min_lat, max_lon, max_lat)
+        lon, lat = self.lon[window], self.lat[window]
+        inside = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        return covering_ranges(inside, window)
+
+    def resolve_polygon(self, polygon):
+        """
+        Resolves a polygon to the index ranges of the cells inside it.
+
+        Args:
+            polygon (list): The [lon, lat] vertices of the polygon.
+
+        Returns:
+            tuple: The longitude_range and latitude_range of the covering sub-grid.
+
+        Raises:
+            InvalidSelectionError: If the polygon is invalid or no cell is inside it.
+        """
+        vertices = np.asarray(polygon, dtype=np.float64)
+        if vertices.ndim != 2 or vertices.shape[0] < 3 or vertices.shape[1] != 2:
+            raise InvalidSelectionError("A polygon needs at least three [lon, lat] vertices.")
+        min_lon, min_lat = vertices.min(axis=0)
+        max_lon, max_lat = vertices.max(axis=0)
+
+        if self.rectilinear:
+            lon_range = axis_range(self.lon_axis, min_lon, max_lon)
+            lat_range = axis_range(self.lat_axis, min_lat, max_lat)
+            window = (slice(*lon_range), slice(*lat_range))
+            lon, lat = np.meshgrid(
+                self.lon_axis[window[0]], self.lat_axis[window[1]], indexing="ij"
+            )
+        else:
+            window = self.candidate_window(min_lon, min_lat, max_lon, max_lat)
+            lon, lat = self.lon[window], self.lat[window]
+        return covering_ranges(points_in_polygon(lon, lat, vertices), window)
+
+    def candidate_window(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Returns the window of cells of all blocks intersecting a bounding box.
+        """
+        block_min_lon, block_max_lon, block_min_lat, block_max_lat = self.block_bounds
+        candidates = (
+            (block_max_lon >= min_lon)
+            & (block_min_lon <= max_lon)
+            & (block_max_lat >= min_lat)
+            & (block_min_lat <= max_lat)
+        )
+        block_ranges = covering_ranges(candidates)
+        return tuple(
+            slice(start * self.block_size, min(stop * self.block_size, size))
+            for (start, stop), size in zip(block_ranges, self.shape)
+        )
+
+
+def is_rectilinear(lon, lat):
+    """
+    Returns whether longitudes only change along the first axis and latitudes only
+    along the second one, with monotonic axes.
+    """
+    if lon.ndim != 2 or lon.shape != lat.shape or 0 in lon.shape:
+        return False
+    lon_axis = lon[:, 0]
+    lat_axis = lat[0, :]
+    return (
+        np.array_equal(lon, np.broadcast_to(lon_axis[:, None], lon.shape), equal_nan=True)
+        and np.array_equal(lat, np.broadcast_to(lat_axis[None, :], lat.shape), equal_nan=True)
+        and is_monotonic(lon_axis)
+        and is_monotonic(lat_axis)
+    )
+
+
+def is_monotonic(axis):
+    steps = np.diff(axis)
+    return bool(np.all(steps >= 0) or np.all(steps <= 0))
+
+
+def axis_range(axis, minimum, maximum):
+    """
+    Returns the [start, stop] index range of the values of a sorted axis within
+    [minimum, maximum].
+    """
+    descending = len(axis) > 1 and axis[0] > axis[-1]
+    values = axis[::-1] if descending else axis
+    start = int(np.searchsorted(values, minimum, side="left"))
+    stop = int(np.searchsorted(values, maximum, side="right"))
+    if start >= stop:
+        raise InvalidSelectionError("No grid cell is inside the selected area.")
+    if descending:
+        start, stop = len(axis) - stop, len(axis) - start
+    return [start, stop]
+
+
+def reduce_blocks(values, block_size, function):
+    """
+    Reduces the blocks of ``block_size`` x ``block_size`` cells with a NaN-ignoring
+    ufunc like np.fmin.
+    """
+    for axis in range(values.ndim):
+        starts = np.arange(0, values.shape[axis], block_size)
+        values = function.reduceat(values, starts, axis=axis)
+    return values
+
+
+def covering_ranges(selected, window=None):
+    """
+    Returns the [start, stop] index ranges of both axes covering all selected cells.
+
+    Args:
+        selected (numpy.ndarray): A boolean mask of the cells of a window.
+        window (tuple): The slices of the window within the grid.
+
+    Raises:
+        InvalidSelectionError: If no cell is selected.
+    """
+    if not selected.any():
+        raise InvalidSelectionError("No grid cell is inside the selected area.")
+    ranges = []
+    for axis in range(2):
+        indices = np.flatnonzero(selected.any(axis=1 - axis))
+        offset = 0
+        if window is not None:
+            offset = window[axis].start or 0
+        ranges.append([offset + int(indices[0]), offset + int(indices[-1]) + 1])
+    return tuple(ranges)
+
+
+def points_in_polygon(lon, lat, vertices):
+    """
+    Tests which points are inside a polygon, with the even-odd rule.
+
+    Args:
+        lon (numpy.ndarray): The longitudes of the points.
+        lat (numpy.ndarray): The latitudes of the points.
+        vertices (numpy.ndarray): The [lon, lat] vertices of the polygon.
+
+    Returns:
+        numpy.ndarray: A boolean mask of the points inside the polygon.
+    """
+    inside = np.zeros(lon.shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        crosses = (y1 > lat) != (y2 > lat)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x_intersection = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (lon < x_intersection)
+    return inside
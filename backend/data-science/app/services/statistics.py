@@ -0,0 +1,171 @@
+"""
+Module containing the streaming statistics of variables.
+
+The statistics are updated block by block, so a variable is summarized in a single
+pass while only one block is held in memory. The count, minimum, maximum, mean and
+standard deviation are exact; the moments of the blocks are merged with the
+parallel algorithm of Chan et al. Percentiles and histograms are derived from a
+histogram with a bounded number of bins. Its bin width is a power of two, which
+doubles whenever the values do not fit into the bins anymore, so percentiles are
+accurate within one bin width, and histogram bins are aligned to multiples of it.
+"""
+
+import math
+
+import numpy as np
+
+# Maximum number of bins of the histogram the percentiles are derived from
+HISTOGRAM_RESOLUTION = 1024
+# Default maximum number of bins of the returned histograms
+DEFAULT_HISTOGRAM_BINS = 20
+# Default percentiles
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class RunningStatistics:
+    """
+    Statistics of a stream of blocks of values.
+
+    Masked values (e.g. fill values) and values which are not finite are counted as
+    missing and otherwise ignored.
+    """
+    def __init__(self, resolution=HISTOGRAM_RESOLUTION):
+        self.resolution = resolution
+        self.count = 0
+        self.missing = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        # sum of the squared differences from the mean
+        self.m2 = 0.0
+        # bin k covers [k * width, (k + 1) * width), counts[0] is bin first_bin
+        self.width = None
+        self.first_bin = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, data):
+        """
+        Adds the values of a block.
+
+        Args:
+            data (numpy.ndarray): The block, masked values are missing.
+        """
+        data = np.ma.asarray(data)
+        values = np.ma.getdata(data)[~np.ma.getmaskarray(data)].astype(np.float64)
+        values = values[np.isfinite(values)]
+        self.missing += data.size - values.size
+        if values.size == 0:
+            return
+
+        count = values.size
+        mean = values.mean()
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean += delta * count / total
+        self.m2 += np.square(values - mean).sum() + delta**2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.update_histogram(values)
+
+    def update_histogram(self, values):
+        if self.width is None:
+            self.width = initial_bin_width(self.min, self.max, self.resolution)
+            self.first_bin = math.floor(self.min / self.width)
+        while math.floor(self.max / self.width) - math.floor(self.min / self.width) >= self.resolution:
+            self.width, self.first_bin, self.counts = coarsen_histogram(
+                self.width, self.first_bin, self.counts
+            )
+
+        # extend the bins to the range of all values
+        first_bin = math.floor(self.min / self.width)
+        bins = math.floor(self.max / self.width) - first_bin + 1
+        counts = np.zeros(bins, dtype=np.int64)
+        offset = self.first_bin - first_bin
+        counts[offset : offset + self.counts.size] = self.counts
+        indices = np.floor(values / self.width).astype(np.int64) - first_bin
+        counts += np.bincount(indices, minlength=bins)
+        self.first_bin, self.counts = first_bin, counts
+
+    def percentile(self, q):
+        """
+        Returns the approximate q-th percentile, interpolated within its bin.
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        cumulative = np.cumsum(self.counts)
+        index = min(int(np.searchsorted(cumulative, rank)), self.counts.size - 1)
+        before = cumulative[index] - self.counts[index]
+        fraction = (rank - before) / self.counts[index] if self.counts[index] else 0
+        value = (self.first_bin + index + fraction) * self.width
+        return min(max(float(value), self.min), self.max)
+
+    def histogram(self, bins=DEFAULT_HISTOGRAM_BINS):
+        """
+        Returns a histogram with at most ``bins`` bins of equal width.
+
+        Returns:
+            dict: The edges of the bins and the number of values per bin.
+        """
+        width, first_bin, counts = self.width, self.first_bin, self.counts
+        if width is None:
+            return {"edges": [], "counts": []}
+        while counts.size > max(1, bins):
+            width, first_bin, counts = coarsen_histogram(width, first_bin, counts)
+        edges = [(first_bin + i) * width for i in range(counts.size + 1)]
+        return {"edges": edges, "counts": counts.tolist()}
+
+    def to_dict(self, bins=DEFAULT_HISTOGRAM_BINS, percentiles=DEFAULT_PERCENTILES):
+        """
+        Returns the statistics as a JSON serializable dict.
+
+        Args:
+            bins (int): The maximum number of bins of the histogram.
+            percentiles (sequence): The percentiles to compute.
+
+        Returns:
+            dict: The count, the number of missing values, the minimum, maximum,
+                mean and (population) standard deviation, the percentiles and the
+                histogram. Statistics of no values are None.
+        """
+        empty = self.count == 0
+        return {
+            "count": self.count,
+            "missing": self.missing,
+            "min": None if empty else self.min,
+            "max": None if empty else self.max,
+            "mean": None if empty else float(self.mean),
+            "std": None if empty else math.sqrt(self.m2 / self.count),
+            "percentiles": {f"p{q:g}": self.percentile(q) for q in percentiles},
+            "histogram": self.histogram(bins),
+        }
+
+
+def initial_bin_width(minimum, maximum, resolution):
+    """
+    Returns the smallest power of two bin width for which the values of the first
+    block fit into the bins. The width is at least 2**-40 times the largest absolute
+    value, so the bin indices fit into 64 bit integers.
+    """
+    span = maximum - minimum
+    if not math.isfinite(span):
+        return 2.0**1023
+    scale = max(abs(minimum), abs(maximum))
+    width = max(span / resolution, scale * 2.0**-40)
+    if width == 0:
+        return 1.0
+    return 2.0 ** math.ceil(math.log2(width))
+
+
+def coarsen_histogram(width, first_bin, counts):
+    """
+    Doubles the bin width of a histogram, merging every two aligned bins.
+
+    Returns:
+        tuple: The new bin width, the index of the first bin and the counts.
+    """
+    new_first_bin = first_bin // 2
+    indices = np.arange(first_bin, first_bin + counts.size) // 2 - new_first_bin
+    merged = np.bincount(indices, weights=counts, minlength=0).astype(np.int64)
+    return width * 2, new_first_bin, merged
@@ -0,0 +1,277 @@
+import contextvars
+import queue
+import threading
+
+# Default number of chunks a stream may produce ahead of its consumer, 0 disables
+# the buffering
+DEFAULT_MAX_CHUNKS = 16
+# Interval (in seconds) in which a blocked producer checks whether it was stopped
+PUT_INTERVAL = 0.5
+
+END = object()
+
+
+class StreamBufferService:
+    """
+    Decouples the production of a response stream from sending it.
+
+    A buffered stream is produced by a separate thread, which runs at most
+    ``max_chunks`` chunks ahead of the consumer. The reading and encoding of the
+    next chunks overlaps with writing the previous ones to a slow client, while the
+    bounded buffer blocks the producer once the client stops reading, so memory
+    stays bounded (backpressure). Together with a threaded server, one worker
+    process can hold many slow streams while still answering other requests.
+    """
+    def __init__(self, max_chunks=DEFAULT_MAX_CHUNKS):
+        self.max_chunks = max_chunks
+
+    def configure(self, config):
+        """
+        Applies the application configuration to the service.
+
+        Args:
+            config (dict): The Flask configuration.
+        """
+        self.max_chunks = config.get("STREAM_BUFFER_CHUNKS", DEFAULT_MAX_CHUNKS)
+
+    def buffer(self, stream):
+        """
+        Wraps a stream, so it is produced in a separate thread.
+
+        Args:
+            stream (iterable): The stream, e.g. of a conversion.
+
+        Returns:
+            iterable: The buffered stream, or the stream itself if buffering is disabled.
+        """
+        if self.max_chunks <= 0:
+            return stream
+        return BufferedStream(stream, self.max_chunks)
+
+    def interleave(self, streams, concurrency):
+        """
+        Produces several streams concurrently and merges their chunks.
+
+        Args:
+            streams (iterable): The streams, which are started one after the other
+                by at most ``concurrency`` threads.
+            concurrency (int): The maximum number of streams produced at once.
+
+        Returns:
+            InterleavedStream: The chunks of all streams, in the order they were
+                produced. The chunks of each stream keep their order.
+        """
+        return InterleavedStream(streams, max(1, concurrency), max(1, self.max_chunks))
+
+
+class BufferedStream:
+    """
+    An iterator over a stream produced by a thread into a bounded queue.
+
+    The producer thread starts with the first chunk requested. Errors of the stream
+    are raised to the consumer. Closing the buffered stream stops the producer,
+    closes the stream in the producer thread and waits for it, so resources of the
+    request (like the uploaded file) are not released while they are still used.
+    """
+    def __init__(self, stream, max_chunks):
+        self.stream = stream
+        self.chunks = queue.Queue(max_chunks)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        if self.thread is None:
+            # the producer runs in a copy of the context, e.g. for the metrics
+            context = contextvars.copy_context()
+            self.thread = threading.Thread(
+                target=context.run, args=(self.produce,), daemon=True
+            )
+            self.thread.start()
+        chunk = self.chunks.get()
+        if chunk is END:
+            self.finish()
+            raise StopIteration
+        if isinstance(chunk, BaseException):
+            self.finish()
+            raise chunk
+        return chunk
+
+    def produce(self):
+        try:
+            for chunk in self.stream:
+                if not self.put(chunk) or self.stopped.is_set():
+                    break
+            else:
+                self.put(END)
+        except BaseException as e:
+            self.put(e)
+        finally:
+            if hasattr(self.stream, "close"):
+                self.stream.close()
+
+    def put(self, chunk):
+        """
+        Puts a chunk into the queue, waiting while it is full.
+
+        Returns:
+            bool: False if the buffered stream was closed in the meantime.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(chunk, timeout=PUT_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        """
+        Waits for the producer after it put its last item into the queue.
+        """
+        self.done = True
+        self.thread.join()
+
+    def close(self):
+        if self.done:
+            return
+        self.done = True
+        self.stopped.set()
+        if self.thread is None:
+            if hasattr(self.stream, "close"):
+                self.stream.close()
+            return
+        # free the space the producer may be waiting for, it stops before the next chunk
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join()
+
+
+class InterleavedStream:
+    """
+    An iterator over the chunks of several streams, produced by a bounded number of
+    threads into a shared bounded queue.
+
+    Every thread takes the next stream once it finished the previous one, so at
+    most ``concurrency`` streams are open at once and the buffered chunks of all of
+    them are bounded by ``max_chunks``. An error of a stream is raised to the
+    consumer and stops all producers; closing the interleaved stream stops them,
+    closes their streams in the producer threads and waits for them.
+    """
+    def __init__(self, streams, concurrency, max_chunks):
+        self.streams = iter(streams)
+        self.concurrency = concurrency
+        self.chunks = queue.Queue(max_chunks)
+        self.stopped = threading.Event()
+        # the iterator of the streams is shared by the producers
+        self.lock = threading.Lock()
+        self.threads = None
+        self.running = 0
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        if self.threads is None:
+            self.start()
+        while True:
+            chunk = self.chunks.get()
+            if chunk is END:
+                self.running -= 1
+                if self.running == 0:
+                    self.finish()
+                    raise StopIteration
+                continue
+            if isinstance(chunk, BaseException):
+                self.close()
+                raise chunk
+            return chunk
+
+    def start(self):
+        self.threads = []
+        for _ in range(self.concurrency):
+            # every producer runs in its own copy of the context, e.g. for the metrics
+            context = contextvars.copy_context()
+            self.threads.append(
+                threading.Thread(target=context.run, args=(self.produce,), daemon=True)
+            )
+        self.running = len(self.threads)
+        for thread in self.threads:
+            thread.start()
+
+    def produce(self):
+        try:
+            while not self.stopped.is_set():
+                with self.lock:
+                    stream = next(self.streams, None)
+                if stream is None:
+                    break
+                try:
+                    for chunk in stream:
+                        if not self.put(chunk):
+                            break
+                finally:
+                    if hasattr(stream, "close"):
+                        stream.close()
+            self.put(END)
+        except BaseException as e:
+            self.put(e)
+
+    def put(self, chunk):
+        """
+        Puts a chunk into the queue, waiting while it is full.
+
+        Returns:
+            bool: False if the interleaved stream was closed in the meantime.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(chunk, timeout=PUT_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def finish(self):
+        """
+        Waits for the producers after all of them put their last item into the queue.
+        """
+        self.done = True
+        for thread in self.threads:
+            thread.join()
+        self.close_streams()
+
+    def close(self):
+        if self.done:
+            return
+        self.done = True
+        self.stopped.set()
+        if self.threads is not None:
+            # free the space the producers may be waiting for, they stop before the
+            # next chunk
+            while True:
+                try:
+                    self.chunks.get_nowait()
+                except queue.Empty:
+                    break
+            for thread in self.threads:
+                thread.join()
+        self.close_streams()
+
+    def close_streams(self):
+        """
+        Closes the iterator of the streams, e.g. a generator creating them.
+        """
+        if hasattr(self.streams, "close"):
+            self.streams.close()
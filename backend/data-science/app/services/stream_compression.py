@@ -0,0 +1,112 @@
+"""
+Module containing the incremental compression of response streams.
+
+Every chunk of a stream is compressed and flushed on its own (a sync flush for
+gzip, a block flush for zstd), so the client can decompress every chunk as soon
+as it is received and streaming and the time to the first byte are preserved.
+The conversion streams join their records into writes of at least
+STREAM_WRITE_BYTES, which keeps the overhead of the flushes small.
+
+zstd is only available if the optional ``zstandard`` package is installed.
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# Default compression levels of the content codings
+DEFAULT_LEVELS = {GZIP: 1, ZSTD: 3}
+
+
+def get_encodings():
+    """
+    Returns the available content codings, in order of preference.
+    """
+    return [ZSTD, GZIP] if zstandard is not None else [GZIP]
+
+
+def negotiate_encoding(accept_encodings, encodings=None):
+    """
+    Selects the content coding of a response.
+
+    Args:
+        accept_encodings (Accept): The parsed Accept-Encoding header of the request.
+        encodings (list): The available content codings in order of preference,
+            all available ones by default.
+
+    Returns:
+        str: The content coding with the highest quality for the client, None if
+            the client accepts none of them.
+    """
+    return accept_encodings.best_match(encodings or get_encodings())
+
+
+class StreamCompressor:
+    """
+    Compresses a stream chunk by chunk with a content coding.
+    """
+    def __init__(self, encoding, level=None):
+        if encoding not in get_encodings():
+            raise ValueError(f"Unsupported content coding {encoding}")
+        level = DEFAULT_LEVELS[encoding] if level is None else level
+        self.encoding = encoding
+        if encoding == GZIP:
+            # gzip container, written by zlib
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, chunk):
+        """
+        Compresses a chunk and flushes it.
+
+        Args:
+            chunk (str | bytes): The chunk, text is encoded as UTF-8.
+
+        Returns:
+            bytes: The compressed data of the chunk.
+        """
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if not chunk:
+            return b""
+        if self.encoding == GZIP:
+            return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return self.compressor.compress(chunk) + self.compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self):
+        """
+        Ends the compressed stream.
+
+        Returns:
+            bytes: The remaining compressed data.
+        """
+        return self.compressor.flush()
+
+
+def compress_stream(chunks, encoding, level=None):
+    """
+    Compresses a stream chunk by chunk.
+
+    Args:
+        chunks (iterable): The chunks of the stream, str or bytes.
+        encoding (str): The content coding.
+        level (int): The compression level, the default of the coding if None.
+
+    Yields:
+        bytes: The compressed chunks.
+    """
+    compressor = StreamCompressor(encoding, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
@@ -0,0 +1,107 @@
+"""
+Module containing the framings of the JSON record streams.
+
+A record stream is a sequence of JSON documents. The framing decides how the
+documents are delimited, so clients can split the stream without parsing it:
+
+- ``sentinel``: every record is followed by ``||*split*||`` (the original format).
+- ``ndjson``: every record is followed by a newline. The JSON encoder escapes
+  newlines inside strings, so a newline always ends a record.
+- ``length-prefixed``: every record is preceded by its length in bytes as a 4 byte
+  big-endian unsigned integer, followed by the UTF-8 encoded JSON.
+"""
+
+import struct
+
+SENTINEL = "||*split*||"
+
+SENTINEL_FRAMING = "sentinel"
+NDJSON_FRAMING = "ndjson"
+LENGTH_PREFIXED_FRAMING = "length-prefixed"
+
+# Media types of the framings
+MEDIA_TYPES = {
+    SENTINEL_FRAMING: "application/json",
+    NDJSON_FRAMING: "application/x-ndjson",
+    LENGTH_PREFIXED_FRAMING: "application/vnd.netcdf-length-prefixed-json",
+}
+
+RECORD_LENGTH = struct.Struct(">I")
+
+# Default minimum size (in bytes) of the writes of a record stream
+DEFAULT_WRITE_BYTES = 64 * 1024
+
+
+def frame_records(records, framing=SENTINEL_FRAMING):
+    """
+    Frames encoded JSON records.
+
+    Args:
+        records (iterable): The JSON encoded records.
+        framing (str): The name of the framing.
+
+    Returns:
+        str | bytes: The framed records, bytes for the length-prefixed framing.
+    """
+    if framing == NDJSON_FRAMING:
+        return "".join(record + "\n" for record in records)
+    if framing == LENGTH_PREFIXED_FRAMING:
+        frames = []
+        for record in records:
+            encoded = record.encode()
+            frames.append(RECORD_LENGTH.pack(len(encoded)))
+            frames.append(encoded)
+        return b"".join(frames)
+    if framing == SENTINEL_FRAMING:
+        return "".join(record + SENTINEL for record in records)
+    raise ValueError(f"Unknown framing {framing}")
+
+
+def iter_framed_records(buffer, framing=SENTINEL_FRAMING):
+    """
+    Splits a complete framed record stream into its JSON records.
+
+    Args:
+        buffer (str | bytes): The complete stream.
+        framing (str): The name of the framing.
+
+    Yields:
+        str: The JSON encoded records.
+    """
+    if framing == LENGTH_PREFIXED_FRAMING:
+        view = memoryview(buffer)
+        offset = 0
+        while offset < len(view):
+            (length,) = RECORD_LENGTH.unpack_from(view, offset)
+            offset += RECORD_LENGTH.size
+            yield bytes(view[offset : offset + length]).decode()
+            offset += length
+        return
+    if isinstance(buffer, bytes):
+        buffer = buffer.decode()
+    separator = "\n" if framing == NDJSON_FRAMING else SENTINEL
+    yield from buffer.split(separator)[:-1]
+
+
+def coalesce_writes(chunks, min_bytes=DEFAULT_WRITE_BYTES):
+    """
+    Joins small chunks of a stream into writes of at least ``min_bytes``.
+
+    Args:
+        chunks (iterable): The chunks, either all str or all bytes.
+        min_bytes (int): The minimum size of a write, except for the last one.
+
+    Yields:
+        str | bytes: The joined chunks.
+    """
+    pending = []
+    size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= min_bytes:
+            yield pending[0][:0].join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield pending[0][:0].join(pending)
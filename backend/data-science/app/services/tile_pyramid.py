@@ -0,0 +1,136 @@
+"""
+Module for building multi-resolution tile pyramids of CERV2 variables.
+
+Level 0 of the pyramid has the resolution of the preprocessed grid. On every
+further level, blocks of 2 x 2 cells of the level below are aggregated into one
+cell (computed from the grid directly, so every level aggregates the original
+cells). Every level is split into tiles of ``tile_size`` x ``tile_size`` cells, and
+the levels are added until the whole grid fits into a single tile.
+"""
+
+import math
+
+import numpy as np
+from app.services.downsampling import block_reduce
+
+# Default number of cells along each side of a tile
+DEFAULT_TILE_SIZE = 64
+
+
+def count_levels(shape, tile_size, max_levels=None):
+    """
+    Returns the number of levels needed until the whole grid fits into one tile.
+
+    Args:
+        shape (tuple): The number of cells along west_east and south_north.
+        tile_size (int): The number of cells along each side of a tile.
+        max_levels (int): An optional upper limit.
+
+    Returns:
+        int: The number of levels, at least one.
+    """
+    cells = max(shape[0], shape[1], 1)
+    levels = 1 + max(0, math.ceil(math.log2(cells / tile_size)))
+    if max_levels:
+        levels = min(levels, max_levels)
+    return levels
+
+
+def get_bounding_box(lon, lat):
+    """
+    Returns the [min lon, min lat, max lon, max lat] bounding box of coordinates.
+
+    Returns None without coordinates or if all of them are missing.
+    """
+    if lon is None or lat is None or lon.size == 0 or np.all(np.isnan(lon)):
+        return None
+    return [
+        float(np.nanmin(lon)),
+        float(np.nanmin(lat)),
+        float(np.nanmax(lon)),
+        float(np.nanmax(lat)),
+    ]
+
+
+def iter_tiles(
+    variables,
+    time_variables,
+    lon=None,
+    lat=None,
+    tile_size=DEFAULT_TILE_SIZE,
+    max_levels=None,
+    aggregation="nanmean",
+    coordinate_step=1,
+):
+    """
+    Builds the tiles of all levels, from the coarsest level to the finest one.
+
+    Args:
+        variables (list): (name, data) tuples of variables without a time dimension,
+            ordered west_east, south_north.
+        time_variables (list): (name, data) tuples of variables with a time dimension.
+        lon (numpy.ndarray): The longitudes of the grid cells, for the bounding boxes.
+        lat (numpy.ndarray): The latitudes of the grid cells.
+        tile_size (int): The number of cells along each side of a tile.
+        max_levels (int): An optional upper limit of the number of levels.
+        aggregation (str): The aggregation of the cells, see downsampling.
+        coordinate_step (int): The number of coordinates along each side of a grid
+            cell, if the coordinates have a finer resolution than the variables.
+
+    Yields:
+        dict: The tiles, with their level, tile indices, the covered range of grid
+            cells, the bounding box and the aggregated (time) variables.
+    """
+    tile_size = max(1, int(tile_size))
+    named_arrays = variables + time_variables
+    if not named_arrays:
+        return
+    shape = named_arrays[0][1].shape[:2]
+    if lon is not None and lat is not None:
+        lon = lon.astype(np.float64)
+        lat = lat.astype(np.float64)
+
+    for level in reversed(range(count_levels(shape, tile_size, max_levels))):
+        factor = 2**level
+        level_variables = [
+            (name, block_reduce(data, (factor, factor), aggregation))
+            for name, data in variables
+        ]
+        level_time_variables = [
+            (name, block_reduce(data, (factor, factor), aggregation))
+            for name, data in time_variables
+        ]
+        # the size of a tile in cells of the grid
+        span = tile_size * factor
+        for tx in range(math.ceil(shape[0] / span)):
+            for ty in range(math.ceil(shape[1] / span)):
+                x_range = [tx * span, min((tx + 1) * span, shape[0])]
+                y_range = [ty * span, min((ty + 1) * span, shape[1])]
+                cells = (
+                    slice(tx * tile_size, (tx + 1) * tile_size),
+                    slice(ty * tile_size, (ty + 1) * tile_size),
+                )
+                coordinate_cells = (
+                    slice(x_range[0] * coordinate_step, x_range[1] * coordinate_step),
+                    slice(y_range[0] * coordinate_step, y_range[1] * coordinate_step),
+                )
+                tile = {
+                    "level": level,
+                    "tx": tx,
+                    "ty": ty,
+                    "x_range": x_range,
+                    "y_range": y_range,
+                    "bbox": get_bounding_box(
+                        None if lon is None else lon[coordinate_cells],
+                        None if lat is None else lat[coordinate_cells],
+                    ),
+                }
+                if level_variables:
+                    tile["vars"] = {
+                        name: data[cells] for name, data in level_variables
+                    }
+                if level_time_variables:
+                    tile["timeVars"] = {
+                        name: data[cells] for name, data in level_time_variables
+                    }
+                yield tile
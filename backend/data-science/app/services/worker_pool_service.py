@@ -0,0 +1,186 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from app.errors import ServiceBusyError
+
+# Default number of tasks of one request which may be queued or running at once
+DEFAULT_MAX_PENDING = 8
+# Default number of conversions which may run at once, 0 means unlimited
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+# Start method of the worker processes. They are started from a fresh server
+# process instead of being forked from the threaded server worker, whose locks
+# (e.g. of logging or of other requests) may be held by another thread.
+START_METHOD = "forkserver"
+
+
+class WorkerPoolService:
+    """
+    A pool of worker processes for the CPU-bound parts of the conversions.
+
+    Requests submit their work through ``imap``, which keeps at most ``max_pending``
+    tasks per request in flight, so a single large file can not flood the pool.
+    The worker processes are not forked from the calling process, so the functions
+    and their arguments have to be picklable, e.g. module level functions.
+    Conversions have to be admitted first; once ``max_concurrent_requests`` streams
+    are running, further ones are rejected instead of queueing behind them.
+    Without worker processes, all work runs in the calling thread.
+    """
+    def __init__(
+        self,
+        processes=0,
+        max_pending=DEFAULT_MAX_PENDING,
+        max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+    ):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.max_concurrent_requests = max_concurrent_requests
+        self.active_requests = 0
+        self.executor = None
+        self.executor_pid = None
+        self.lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        Applies the application configuration to the service.
+
+        Args:
+            config (dict): The Flask configuration.
+        """
+        self.shutdown()
+        self.processes = config.get("WORKER_POOL_PROCESSES", 0)
+        self.max_pending = config.get("WORKER_POOL_MAX_PENDING", DEFAULT_MAX_PENDING)
+        self.max_concurrent_requests = config.get(
+            "MAX_CONCURRENT_CONVERSIONS", DEFAULT_MAX_CONCURRENT_REQUESTS
+        )
+
+    def get_executor(self):
+        """
+        Returns the process pool of the current process, creating it on first use.
+
+        The pool is created lazily, so every forked server worker gets its own pool.
+
+        Returns:
+            ProcessPoolExecutor: The pool, or None if no worker processes are configured.
+        """
+        if self.processes <= 0:
+            return None
+        with self.lock:
+            if self.executor is None or self.executor_pid != os.getpid():
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(START_METHOD),
+                )
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def imap(self, function, iterable):
+        """
+        Applies a function to every item in the worker processes.
+
+        Args:
+            function (callable): A picklable module level function.
+            iterable (iterable): The items, which are consumed lazily.
+
+        Yields:
+            object: The results, in the order of the items.
+        """
+        executor = self.get_executor()
+        if executor is None:
+            yield from map(function, iterable)
+            return
+
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(function, item))
+                if len(pending) >= max(1, self.max_pending):
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def admit(self, stream, slots=1):
+        """
+        Admits a conversion stream if the service is not saturated.
+
+        Args:
+            stream (iterable): The stream of the conversion.
+            slots (int): The number of conversions the stream runs at once, e.g.
+                the files of a batch converted concurrently.
+
+        Returns:
+            AdmittedStream: The stream, which frees its slots once it is exhausted or closed.
+
+        Raises:
+            ServiceBusyError: If the maximum number of concurrent conversions would
+                be exceeded.
+        """
+        with self.lock:
+            if 0 < self.max_concurrent_requests < self.active_requests + slots:
+                raise ServiceBusyError(
+                    "Too many conversions are running, please try again later."
+                )
+            self.active_requests += slots
+        return AdmittedStream(stream, partial(self.release, slots))
+
+    def get_max_slots(self, slots):
+        """
+        Limits a number of slots to the maximum number of concurrent conversions.
+        """
+        if self.max_concurrent_requests > 0:
+            slots = min(slots, self.max_concurrent_requests)
+        return max(1, slots)
+
+    def release(self, slots=1):
+        """
+        Frees the slots of a finished conversion.
+        """
+        with self.lock:
+            self.active_requests -= slots
+
+    def shutdown(self):
+        """
+        Shuts the process pool of the current process down.
+        """
+        with self.lock:
+            if self.executor is not None and self.executor_pid == os.getpid():
+                self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            self.executor_pid = None
+
+
+class AdmittedStream:
+    """
+    An iterator over an admitted stream which releases its slot exactly once, when the
+    stream is exhausted, fails or is closed by the server.
+    """
+    def __init__(self, stream, release):
+        self.stream = iter(stream)
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.released:
+            return
+        self.released = True
+        try:
+            if hasattr(self.stream, "close"):
+                self.stream.close()
+        finally:
+            self.release()
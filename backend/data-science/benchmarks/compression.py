@@ -0,0 +1,101 @@
+"""
+Benchmark of the compression of the response streams.
+
+Converts a synthetic CERV2-shaped file once per case, then compresses the chunks
+of the stream one by one, as the CompressionMiddleware does, with every content
+coding and level. For every combination, the benchmark reports the compressed
+size, the compression ratio, the CPU time spent compressing and the throughput in
+uncompressed megabytes per CPU second. zstd is only measured if the optional
+zstandard package is installed. Run it from the data science directory, e.g.
+
+    python3 -m benchmarks.compression --grid 200x200 --time 24 --levels 1 6 9
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.services import data_processing_service, stream_compression
+from app.services.stream_compression import GZIP, ZSTD, compress_stream
+from benchmarks.run_benchmarks import CASES, get_service_arguments
+from benchmarks.synthetic import create_cerv2_file, get_variable_names
+
+# Cases: the case of the benchmark suite and additional service arguments
+COMPRESSION_CASES = {
+    "data-json": ("data-json", {}),
+    "cerv2-json": ("cerv2-json", {}),
+    "cerv2-compact": ("cerv2-ndjson", {"schema": "compact"}),
+    "cerv2-columnar": ("cerv2-columnar", {}),
+}
+
+
+def convert(file_path, case, variables):
+    """
+    Returns the chunks of the stream of a case, encoded as bytes.
+    """
+    suite_case, options = COMPRESSION_CASES[case]
+    method = getattr(data_processing_service, CASES[suite_case]["method"])
+    arguments = dict(get_service_arguments(suite_case, variables), **options)
+    return [
+        chunk.encode() if isinstance(chunk, str) else chunk
+        for chunk in method(file_path, **arguments)
+    ]
+
+
+def measure_compression(chunks, encoding, level):
+    """
+    Compresses the chunks of a stream one by one.
+
+    Returns:
+        tuple: The compressed size in bytes and the CPU seconds spent compressing.
+    """
+    start = time.process_time()
+    size = sum(len(data) for data in compress_stream(chunks, encoding, level))
+    return size, time.process_time() - start
+
+
+def parse_grid(value):
+    west_east, south_north = value.lower().split("x")
+    return int(west_east), int(south_north)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the compression of the response streams")
+    parser.add_argument("--grid", type=parse_grid, default=(100, 100), help="Grid size as west_eastxsouth_north")
+    parser.add_argument("--time", type=int, default=24, help="Number of time steps")
+    parser.add_argument("--variables", type=int, default=4, help="Number of time variables")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9], help="gzip levels")
+    parser.add_argument("--zstd-levels", type=int, nargs="+", default=[1, 3, 9], help="zstd levels")
+    parser.add_argument("--cases", nargs="+", default=list(COMPRESSION_CASES), choices=list(COMPRESSION_CASES))
+    args = parser.parse_args()
+
+    codings = [(GZIP, level) for level in args.levels]
+    if stream_compression.zstandard is not None:
+        codings += [(ZSTD, level) for level in args.zstd_levels]
+    else:
+        print("zstandard is not installed, skipping zstd")
+
+    variables = ["lon", "lat"] + get_variable_names(args.variables)
+    with tempfile.TemporaryDirectory() as data_dir:
+        file_path = os.path.join(data_dir, "synthetic.nc")
+        create_cerv2_file(file_path, *args.grid, args.time, args.variables)
+
+        print(
+            f"{'case':<15} {'coding':<8} {'chunks':>7} {'raw (MB)':>9} {'out (MB)':>9}"
+            f" {'ratio':>6} {'CPU (s)':>8} {'MB/CPU s':>9}"
+        )
+        for case in args.cases:
+            chunks = convert(file_path, case, variables)
+            raw = sum(len(chunk) for chunk in chunks)
+            for encoding, level in codings:
+                size, cpu = measure_compression(chunks, encoding, level)
+                print(
+                    f"{case:<15} {f'{encoding}-{level}':<8} {len(chunks):>7} {raw / 1e6:>9.2f}"
+                    f" {size / 1e6:>9.2f} {raw / size:>6.1f} {cpu:>8.3f}"
+                    f" {raw / 1e6 / max(cpu, 1e-9):>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Microbenchmark of the JSON encoding of NumPy data.
+
+Compares the NumpyJSONEncoder with the previous encoding path, simplejson with the
+custom_encoder fallback, on a float32 grid (as written by the data conversion), on
+integer grids and on blocks of CERV2 records. Run it from the data science
+directory, e.g.
+
+    python3 -m benchmarks.json_encoder --grid 400x400 --repeat 5
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+import simplejson
+
+from app.services import json_encoder
+from app.services.data_processing_service import (
+    build_cerv2_records,
+    iter_cerv2_array_blocks,
+)
+from app.services.json_encoder import NumpyJSONEncoder, custom_encoder
+
+
+def measure(function, repeat):
+    """
+    Returns the median duration (in seconds) of a function and its result.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def create_cases(rows, columns, time_steps):
+    """
+    Creates the payloads of the cases and their previous and new encodings.
+    """
+    rng = np.random.default_rng(0)
+    grid = rng.random((rows, columns), dtype=np.float32) * 100
+    grid[0, 0] = np.nan
+    int16_grid = rng.integers(-1000, 1000, (rows, columns), dtype=np.int16)
+    uint8_grid = rng.integers(0, 255, (rows, columns), dtype=np.uint8)
+    block = next(
+        iter_cerv2_array_blocks(
+            [("lon", grid), ("lat", grid)],
+            [("temp", rng.random((rows, columns, time_steps), dtype=np.float32))],
+            batch_rows=rows,
+        )
+    )
+    records = build_cerv2_records(block)
+
+    previous = simplejson.JSONEncoder(default=custom_encoder, ignore_nan=True)
+    encoder = NumpyJSONEncoder(ignore_nan=True)
+    return {
+        "float32 grid": (
+            lambda: previous.encode(grid.tolist()),
+            lambda: encoder.encode(grid),
+        ),
+        "int16 grid": (
+            lambda: previous.encode(int16_grid.tolist()),
+            lambda: encoder.encode(int16_grid),
+        ),
+        "uint8 grid": (
+            lambda: previous.encode(uint8_grid.tolist()),
+            lambda: encoder.encode(uint8_grid),
+        ),
+        "float32 scalars": (
+            lambda: previous.encode([grid[x, y] for x, y in np.ndindex(grid.shape)]),
+            lambda: encoder.encode([grid[x, y] for x, y in np.ndindex(grid.shape)]),
+        ),
+        "cerv2 records": (
+            lambda: [previous.encode(record) for record in records],
+            lambda: [encoder.encode(record) for record in records],
+        ),
+    }
+
+
+def parse_grid(value):
+    rows, columns = value.lower().split("x")
+    return int(rows), int(columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of the JSON encoding of NumPy data")
+    parser.add_argument("--grid", type=parse_grid, default=(200, 200), help="Grid size as rowsxcolumns")
+    parser.add_argument("--time", type=int, default=24, help="Number of time steps of the CERV2 records")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per case")
+    args = parser.parse_args()
+
+    backend = "orjson" if json_encoder.orjson is not None else "simplejson"
+    print(f"NumpyJSONEncoder backend: {backend}")
+    print(f"{'case':<16} {'previous (ms)':>14} {'encoder (ms)':>13} {'speedup':>8}")
+    for name, (previous, encoder) in create_cases(*args.grid, args.time).items():
+        previous_time, _ = measure(previous, args.repeat)
+        encoder_time, _ = measure(encoder, args.repeat)
+        print(
+            f"{name:<16} {previous_time * 1000:>14.1f} {encoder_time * 1000:>13.1f}"
+            f" {previous_time / encoder_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
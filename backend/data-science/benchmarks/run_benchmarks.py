@@ -0,0 +1,480 @@
+"""
+Benchmark suite of the data science service.
+
+Generates synthetic CERV2-shaped NetCDF files and runs the conversions on them,
+either by calling the DataProcessingService directly ("service" mode) or by
+sending requests to the Flask application with its test client ("flask" mode).
+
+For every case, the suite reports the time to the first byte, the total time,
+the throughput in cells and megabytes per second and the peak resident set size.
+CERV2 cases are additionally split into the phases open, preprocess and encode.
+Every case runs in a fresh process (unless --no-isolate is given), so the peak
+resident set size belongs to that case alone.
+
+Run it from the data science directory, e.g.
+
+    python3 -m benchmarks.run_benchmarks --grid 200x200 --time 48 --output results.json
+    python3 -m benchmarks.run_benchmarks --baseline results.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import netCDF4
+import numpy as np
+
+from app import create_app
+from app.services import data_processing_service
+from app.services.data_processing_service import (
+    DEFAULT_BATCH_ROWS,
+    encode_cerv2_json_block,
+    iter_cerv2_array_blocks,
+    open_dataset,
+    preprocess_variables,
+)
+from benchmarks.synthetic import create_cerv2_file, get_variable_names
+from config.app_config import get_flask_config
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+SERVICE_MODE = "service"
+FLASK_MODE = "flask"
+MODES = (SERVICE_MODE, FLASK_MODE)
+
+# Cases: the endpoint, the service method and the form fields / keyword arguments
+CASES = {
+    "metadata": {
+        "endpoint": "/api/convert-netcdf-to-json/metadata",
+        "method": "convert_netcdf_metadata_to_json",
+        "options": {},
+    },
+    "data-json": {
+        "endpoint": "/api/convert-netcdf-to-json/data",
+        "method": "convert_netcdf_data_to_json",
+        "options": {"output_format": "json"},
+    },
+    "data-columnar": {
+        "endpoint": "/api/convert-netcdf-to-json/data",
+        "method": "convert_netcdf_data_to_columnar",
+        "options": {"output_format": "columnar"},
+    },
+    "cerv2-json": {
+        "endpoint": "/api/convert-netcdf-to-json/cerv2-data-chunks",
+        "method": "convert_cerv2_data_to_json_chunks",
+        "options": {"output_format": "json", "framing": "sentinel"},
+    },
+    "cerv2-ndjson": {
+        "endpoint": "/api/convert-netcdf-to-json/cerv2-data-chunks",
+        "method": "convert_cerv2_data_to_json_chunks",
+        "options": {"output_format": "json", "framing": "ndjson"},
+    },
+    "cerv2-columnar": {
+        "endpoint": "/api/convert-netcdf-to-json/cerv2-data-chunks",
+        "method": "convert_cerv2_data_to_columnar_chunks",
+        "options": {"output_format": "columnar"},
+    },
+    "cerv2-nanmean": {
+        "endpoint": "/api/convert-netcdf-to-json/cerv2-data-chunks",
+        "method": "convert_cerv2_data_to_json_chunks",
+        "options": {
+            "output_format": "json",
+            "framing": "ndjson",
+            "aggregation": "nanmean",
+            "step_size": 2,
+        },
+    },
+    "cerv2-tiles": {
+        "endpoint": "/api/convert-netcdf-to-json/cerv2-tiles",
+        "method": "convert_cerv2_data_to_tiles",
+        "options": {"framing": "ndjson"},
+    },
+}
+
+# Form fields which are only used by the endpoints, not by the service methods
+FORM_ONLY_FIELDS = ("output_format",)
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of the current process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_service_arguments(case, variables):
+    """
+    Returns the keyword arguments of the service method of a case.
+    """
+    options = {
+        key: value
+        for key, value in CASES[case]["options"].items()
+        if key not in FORM_ONLY_FIELDS
+    }
+    if CASES[case]["method"].startswith("convert_cerv2"):
+        options = dict(
+            {
+                "filter": variables,
+                "longitude_range": [],
+                "latitude_range": [],
+                "step_size": 1,
+            },
+            **options,
+        )
+    return options
+
+
+def get_form_fields(case, variables):
+    """
+    Returns the form fields of the request of a case.
+    """
+    fields = {key: str(value) for key, value in CASES[case]["options"].items()}
+    if CASES[case]["endpoint"].endswith(("cerv2-data-chunks", "cerv2-tiles")):
+        fields.setdefault("step_size", "1")
+        fields["filter_variables"] = ",".join(variables)
+    return fields
+
+
+def consume(chunks):
+    """
+    Reads a stream of chunks to its end.
+
+    Returns:
+        tuple: The time to the first chunk, the total time (both in seconds) and
+            the number of bytes, without the time spent before the call.
+    """
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in chunks:
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+    total = time.perf_counter() - start
+    return (total if first is None else first), total, size
+
+
+def run_service_case(service, case, file_path, variables):
+    """
+    Runs a case by calling the service method with the path of the file.
+    """
+    method = getattr(service, CASES[case]["method"])
+    start = time.perf_counter()
+    ttfb, _, size = consume(method(file_path, **get_service_arguments(case, variables)))
+    return ttfb, time.perf_counter() - start, size
+
+
+def run_flask_case(client, case, file_path, variables):
+    """
+    Runs a case by uploading the file to the endpoint with the test client.
+
+    The time to the first byte includes the upload and the request handling up
+    to the first chunk of the streamed response.
+    """
+    start = time.perf_counter()
+    with open(file_path, "rb") as file:
+        data = dict(get_form_fields(case, variables), file=(file, "synthetic.nc"))
+        response = client.post(
+            CASES[case]["endpoint"],
+            data=data,
+            content_type="multipart/form-data",
+            buffered=False,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"{case} failed with {response.status_code}: {response.get_data(as_text=True)}"
+            )
+        ttfb = None
+        size = 0
+        for chunk in response.response:
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        response.close()
+    total = time.perf_counter() - start
+    return (total if ttfb is None else ttfb), total, size
+
+
+def measure_cerv2_phases(service, case, file_path, variables):
+    """
+    Measures the phases of a CERV2 case separately.
+
+    Returns:
+        dict: The seconds spent opening the file, reading and downsampling the
+            variables (preprocess) and building and encoding the records (encode).
+    """
+    if CASES[case]["method"] != "convert_cerv2_data_to_json_chunks":
+        return {}
+    arguments = get_service_arguments(case, variables)
+    phases = {}
+    start = time.perf_counter()
+    with open_dataset(file_path, service.in_memory_threshold) as dataset:
+        phases["open"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        var_datas, time_var_datas = preprocess_variables(
+            dataset,
+            arguments["filter"],
+            arguments["longitude_range"],
+            arguments["latitude_range"],
+            arguments["step_size"],
+            service.worker_pool,
+            arguments.get("aggregation", "first"),
+        )
+        phases["preprocess"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        blocks = iter_cerv2_array_blocks(var_datas, time_var_datas, DEFAULT_BATCH_ROWS)
+        for block in blocks:
+            encode_cerv2_json_block(block, framing=arguments.get("framing", "sentinel"))
+        phases["encode"] = time.perf_counter() - start
+    return phases
+
+
+def summarize(values):
+    return {
+        "median": statistics.median(values),
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+def run_case(mode, case, file_info, repeat):
+    """
+    Runs a case repeatedly and summarizes the measurements.
+
+    Args:
+        mode (str): Either "service" or "flask".
+        case (str): The name of the case, see CASES.
+        file_info (dict): The synthetic file, see create_cerv2_file.
+        repeat (int): The number of runs.
+
+    Returns:
+        dict: The result of the case.
+    """
+    app = create_app("production", get_flask_config("production"))
+    client = app.test_client()
+    variables = get_variable_names(file_info["variables"])
+    rss_before = get_peak_rss()
+
+    runs = []
+    phases = []
+    for _ in range(repeat):
+        if mode == FLASK_MODE:
+            runs.append(run_flask_case(client, case, file_info["path"], variables))
+        else:
+            runs.append(
+                run_service_case(data_processing_service, case, file_info["path"], variables)
+            )
+            phases.append(
+                measure_cerv2_phases(data_processing_service, case, file_info["path"], variables)
+            )
+
+    ttfbs, totals, sizes = zip(*runs)
+    total = statistics.median(totals)
+    result = {
+        "mode": mode,
+        "case": case,
+        "file": file_info["name"],
+        "repeat": repeat,
+        "ttfb": summarize(ttfbs),
+        "total": summarize(totals),
+        "output_bytes": sizes[0],
+        "cells_per_second": file_info["cells"] / total,
+        "input_mb_per_second": file_info["size"] / total / 1e6,
+        "output_mb_per_second": sizes[0] / total / 1e6,
+        "rss_before_bytes": rss_before,
+        "peak_rss_bytes": get_peak_rss(),
+    }
+    if phases and phases[0]:
+        result["phases"] = {
+            phase: statistics.median(run[phase] for run in phases) for phase in phases[0]
+        }
+    return result
+
+
+def run_isolated_case(queue, *args):
+    try:
+        queue.put(run_case(*args))
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+
+def run_case_in_process(*args):
+    """
+    Runs a case in a freshly spawned process, to measure its peak resident set size.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_isolated_case, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+def parse_grid(value):
+    try:
+        west_east, south_north = (int(size) for size in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid grid size {value}, expected e.g. 100x100")
+    return west_east, south_north
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment():
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "netCDF4": netCDF4.__version__,
+    }
+
+
+def create_files(args, data_dir):
+    """
+    Creates the synthetic files of all combinations of grid sizes and compression levels.
+    """
+    files = []
+    for west_east, south_north in args.grid:
+        for compression in args.compression:
+            name = f"cerv2_{west_east}x{south_north}x{args.time}_v{args.variables}_z{compression}.nc"
+            path = os.path.join(data_dir, name)
+            start = time.perf_counter()
+            file_info = create_cerv2_file(
+                path,
+                west_east,
+                south_north,
+                args.time,
+                args.variables,
+                compression,
+                args.format,
+            )
+            logger.info(
+                f"Created {name} ({file_info['size'] / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s"
+            )
+            files.append(dict(file_info, name=name, path=path))
+    return files
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compares the median total times with a baseline.
+
+    Returns:
+        list: Descriptions of the cases which are slower than the baseline by more
+            than the tolerance.
+    """
+    baseline_totals = {
+        (result["mode"], result["case"], result["file"]): result["total"]["median"]
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        key = (result["mode"], result["case"], result["file"])
+        if key not in baseline_totals:
+            continue
+        ratio = result["total"]["median"] / baseline_totals[key]
+        logger.info(f"{' / '.join(key)}: {ratio:.2f}x of the baseline")
+        if ratio > 1 + tolerance:
+            regressions.append(f"{' / '.join(key)} is {ratio:.2f}x slower than the baseline")
+    return regressions
+
+
+def log_result(result):
+    phases = ", ".join(
+        f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in result.get("phases", {}).items()
+    )
+    logger.info(
+        f"{result['mode']:<8}{result['case']:<16}{result['file']}: "
+        f"ttfb {result['ttfb']['median'] * 1000:.1f}ms, "
+        f"total {result['total']['median'] * 1000:.1f}ms, "
+        f"{result['cells_per_second'] / 1e6:.2f}M cells/s, "
+        f"{result['output_mb_per_second']:.1f} MB/s out, "
+        f"peak rss {result['peak_rss_bytes'] / 2**20:.0f} MiB"
+        + (f" ({phases})" if phases else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of the data science service")
+    parser.add_argument("--grid", type=parse_grid, nargs="+", default=[(100, 100)], help="Grid sizes as west_eastxsouth_north")
+    parser.add_argument("--time", type=int, default=24, help="Number of time steps")
+    parser.add_argument("--variables", type=int, default=4, help="Number of time variables")
+    parser.add_argument("--compression", type=int, nargs="+", default=[0], help="zlib compression levels, 0 disables compression")
+    parser.add_argument("--format", type=str, default="NETCDF4", help="netCDF4 file format of the synthetic files")
+    parser.add_argument("--cases", type=str, nargs="+", choices=list(CASES), default=list(CASES), help="Cases to run")
+    parser.add_argument("--modes", type=str, nargs="+", choices=MODES, default=list(MODES), help="Run the service methods directly and/or through the Flask app")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per case")
+    parser.add_argument("--no-isolate", action="store_true", help="Run all cases in this process, the peak RSS is then shared")
+    parser.add_argument("--data-dir", type=str, help="Directory to keep the synthetic files in, a temporary one by default")
+    parser.add_argument("--output", type=str, help="Path of the JSON results")
+    parser.add_argument("--baseline", type=str, help="JSON results to compare the median total times with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown relative to the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        data_dir = args.data_dir or temporary_dir
+        os.makedirs(data_dir, exist_ok=True)
+        files = create_files(args, data_dir)
+
+        results = []
+        for file_info in files:
+            for mode in args.modes:
+                for case in args.cases:
+                    run = run_case if args.no_isolate else run_case_in_process
+                    result = run(mode, case, file_info, args.repeat)
+                    log_result(result)
+                    results.append(result)
+
+    report = {
+        "environment": get_environment(),
+        "files": [
+            {key: value for key, value in file_info.items() if key != "path"}
+            for file_info in files
+        ],
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        logger.info(f"Saved the results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            logger.warning(regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Module for generating synthetic CERV2-shaped NetCDF files for benchmarks.
+
+The files have the dimensions time, south_north and west_east, two-dimensional
+lon/lat coordinate variables on a slightly rotated grid and any number of float32
+time variables with smooth, deterministic values, so the compression ratio is
+close to the one of real model output.
+"""
+
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+# Names of the time variables, repeated with a suffix if more are requested
+VARIABLE_NAMES = ("T2", "Q2", "U10", "V10", "PSFC", "RAINNC", "SWDOWN", "GLW")
+
+
+def get_variable_names(count):
+    """
+    Returns the names of the first ``count`` synthetic time variables.
+    """
+    names = []
+    for index in range(count):
+        name = VARIABLE_NAMES[index % len(VARIABLE_NAMES)]
+        suffix = index // len(VARIABLE_NAMES)
+        names.append(f"{name}_{suffix}" if suffix else name)
+    return names
+
+
+def create_cerv2_file(
+    file_path,
+    west_east=100,
+    south_north=100,
+    time=24,
+    variables=4,
+    compression=0,
+    file_format="NETCDF4",
+    seed=0,
+):
+    """
+    Creates a synthetic CERV2-shaped NetCDF file.
+
+    Args:
+        file_path (str): The path of the file to create.
+        west_east (int): The number of grid cells along west_east.
+        south_north (int): The number of grid cells along south_north.
+        time (int): The number of time steps.
+        variables (int): The number of time variables besides lon and lat.
+        compression (int): The zlib compression level, 0 disables compression.
+            Only NETCDF4 files can be compressed.
+        file_format (str): The netCDF4 file format, e.g. NETCDF4 or NETCDF3_64BIT_OFFSET.
+        seed (int): The seed of the noise added to the values.
+
+    Returns:
+        dict: The parameters of the file, its size in bytes and the number of cells.
+    """
+    rng = np.random.default_rng(seed)
+    compression_options = {}
+    if compression and file_format.startswith("NETCDF4"):
+        compression_options = {"zlib": True, "complevel": compression}
+
+    with Dataset(file_path, "w", format=file_format) as dataset:
+        dataset.title = "Synthetic CERV2 benchmark file"
+        dataset.createDimension("time", time)
+        dataset.createDimension("south_north", south_north)
+        dataset.createDimension("west_east", west_east)
+
+        # a rotated regular grid around Berlin
+        y, x = np.meshgrid(np.arange(south_north), np.arange(west_east), indexing="ij")
+        lon = dataset.createVariable(
+            "lon", np.float32, ("south_north", "west_east"), **compression_options
+        )
+        lat = dataset.createVariable(
+            "lat", np.float32, ("south_north", "west_east"), **compression_options
+        )
+        lon.units = "degree_east"
+        lat.units = "degree_north"
+        lon[:] = 13.4 + 0.01 * x - 0.002 * y
+        lat[:] = 52.5 + 0.01 * y + 0.002 * x
+
+        for index, name in enumerate(get_variable_names(variables)):
+            variable = dataset.createVariable(
+                name,
+                np.float32,
+                ("time", "south_north", "west_east"),
+                **compression_options,
+            )
+            variable.units = "1"
+            # write one time step at a time, so large files do not need much memory
+            for t in range(time):
+                phase = 2 * np.pi * t / max(time, 1) + index
+                values = np.sin(x / 17 + phase) + np.cos(y / 23 - phase)
+                values += 0.01 * rng.standard_normal(values.shape)
+                variable[t] = values.astype(np.float32)
+
+    return {
+        "west_east": west_east,
+        "south_north": south_north,
+        "time": time,
+        "variables": variables,
+        "compression": compression,
+        "file_format": file_format,
+        "size": os.path.getsize(file_path),
+        "cells": west_east * south_north * time * variables,
+    }
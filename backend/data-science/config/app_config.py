@@ -2,11 +2,65 @@
 Module containing configuration classes and functions for the Flask application.
 """
 
+import os
+
 class Config:
     """
     Base configuration class containing common configuration variables.
     """
     DEBUG = False
+    # Number of grid rows the CERV2 chunk stream builds and serializes at once
+    CERV2_BATCH_ROWS = 16
+    # Uploads up to this size (in bytes) are kept and opened in memory,
+    # larger uploads are streamed once into a temporary file
+    NETCDF_IN_MEMORY_THRESHOLD = 64 * 1024 * 1024
+    # Directory for spooled uploads, None uses the system temporary directory
+    UPLOAD_SPOOL_DIR = None
+    # Approximate size (in bytes) of the slabs variables are read and streamed in
+    DATA_SLAB_BYTES = 8 * 1024 * 1024
+    # Directory of the content-addressed dataset cache, None uses a directory
+    # in the system temporary directory
+    DATASET_CACHE_DIR = None
+    # Maximum total size (in bytes) of the cached datasets
+    DATASET_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+    # Time (in seconds) after which an unused cached dataset is evicted
+    DATASET_CACHE_TTL = 60 * 60
+    # Number of worker processes for parsing and serialization, 0 runs everything
+    # in the request thread
+    WORKER_POOL_PROCESSES = int(os.environ.get("WORKER_POOL_PROCESSES", "0"))
+    # Maximum number of tasks a single request may have queued in the worker pool
+    WORKER_POOL_MAX_PENDING = 8
+    # Maximum number of data conversions running at once, further requests are
+    # rejected with 429 (0 disables the limit)
+    MAX_CONCURRENT_CONVERSIONS = int(os.environ.get("MAX_CONCURRENT_CONVERSIONS", "4"))
+    # Minimum size (in bytes) of the writes of the record streams, small blocks of
+    # records are joined until they reach it
+    STREAM_WRITE_BYTES = 64 * 1024
+    # Number of chunks a conversion stream is produced ahead of the client by its
+    # producer thread; a slow client blocks the producer once they are buffered
+    # (0 produces the stream in the request thread)
+    STREAM_BUFFER_CHUNKS = int(os.environ.get("STREAM_BUFFER_CHUNKS", "16"))
+    # Whether request and conversion phase metrics are collected and exposed on /metrics
+    METRICS_ENABLED = True
+    # Whether the metrics carry the pid of the worker process, as every worker keeps its own metrics
+    METRICS_WORKER_LABEL = True
+    # Whether responses carry a Server-Timing header with the phases measured
+    # before the response started
+    SERVER_TIMING_HEADER = os.environ.get("SERVER_TIMING_HEADER", "false") == "true"
+    # Whether the bulk streamed responses are compressed with the content coding accepted by
+    # the client (gzip, or zstd if the zstandard package is installed)
+    COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true") == "true"
+    # Compression levels of gzip (1-9) and zstd (1-22)
+    GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "1"))
+    ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", "3"))
+    # Number of files of a batch converted at once
+    BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+    # Maximum number of files of a batch
+    BATCH_MAX_FILES = 400
+    # Maximum total size (in bytes) of the files of an archive uploaded as a batch
+    BATCH_MAX_EXTRACTED_BYTES = 16 * 1024 * 1024 * 1024
+    # Maximum size (in bytes) of the selected data of all files of a batch merged along the time dimension
+    BATCH_MERGE_MAX_BYTES = int(os.environ.get("BATCH_MERGE_MAX_BYTES", str(1024 * 1024 * 1024)))
     # Add other configuration variables as needed
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,18 @@
+"""
+Gunicorn settings of the service, loaded automatically from the working directory.
+
+The workers are threaded, so a worker process can hold many slow streams at once
+while it still answers short requests like metadata. Conversion streams are
+produced by their own threads into bounded buffers, see StreamBufferService.
+"""
+
+import os
+
+# Use the threaded worker, the sync worker is blocked by a single slow stream
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+# Number of worker processes
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+# Number of threads (concurrent requests) per worker process
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+# Time (in seconds) a connection may stay idle between requests
+keepalive = 5
@@ -0,0 +1,375 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from app import create_app
+from app.services import dataset_cache_service, worker_pool_service
+from app.services.columnar_format import MEDIA_TYPE, decode_frames
+from config.app_config import ProductionConfig
+from netCDF4 import Dataset
+from werkzeug.test import EnvironBuilder
+
+API = "/api/convert-netcdf-to-json"
+
+
+def create_cerv2_content(axes=False):
+    """
+    Returns the content of a small CERV2-shaped NetCDF file, with 2-D coordinates or
+    1-D longitude and latitude axes.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "cerv2.nc")
+        with Dataset(path, "w") as dataset:
+            dataset.createDimension("time", 2)
+            dataset.createDimension("south_north", 4)
+            dataset.createDimension("west_east", 3)
+            time = dataset.createVariable("time", np.float64, ("time",))
+            time.units = "hours since 2020-01-01"
+            time[:] = [0, 12]
+            if axes:
+                dataset.createVariable("lon", np.float32, ("west_east",))[:] = np.arange(3)
+                dataset.createVariable("lat", np.float32, ("south_north",))[:] = np.arange(4)
+            else:
+                dataset.createVariable("lon", np.float32, ("south_north", "west_east"))[:] = np.arange(3)
+                dataset.createVariable("lat", np.float32, ("south_north", "west_east"))[:] = np.arange(4)[:, None]
+            temp = dataset.createVariable("temp", np.float32, ("time", "south_north", "west_east"))
+            temp[:] = np.arange(24).reshape(2, 4, 3)
+        with open(path, "rb") as file:
+            return file.read()
+
+
+class TestingConfig(ProductionConfig):
+    # produce the streams in the request thread, so their slots are free once they were read
+    STREAM_BUFFER_CHUNKS = 0
+
+
+def parse_ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+class TestDataProcessingController(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+        class CacheConfig(TestingConfig):
+            DATASET_CACHE_DIR = self.temp_dir.name
+
+        self.app = create_app("production", CacheConfig)
+        self.client = self.app.test_client()
+        self.content = create_cerv2_content()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        # every conversion released its admission slot
+        self.assertEqual(worker_pool_service.active_requests, 0)
+        # every response of a cached dataset released its pin
+        self.assertEqual(dataset_cache_service.pins, {})
+
+    def post(self, path, **form):
+        data = dict(form)
+        data.setdefault("file", (io.BytesIO(self.content), "cerv2.nc"))
+        return self.client.post(API + path, data=data, content_type="multipart/form-data")
+
+    def upload_dataset(self):
+        response = self.client.post(
+            API + "/datasets",
+            data={"file": (io.BytesIO(self.content), "cerv2.nc")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()["handle"]
+
+    def test_cached_dataset_routes(self):
+        handle = self.upload_dataset()
+        dataset = f"{API}/datasets/{handle}"
+
+        response = self.client.get(dataset + "/metadata")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("temp", response.get_data(as_text=True))
+
+        response = self.client.get(dataset + "/data")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("temp", response.get_data(as_text=True))
+        # the server closes the response, which unpins the dataset
+        response.close()
+
+        response = self.client.post(dataset + "/cerv2-data-chunks", data={"filter_variables": "temp", "step_size": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("temp", response.get_data(as_text=True))
+        response.close()
+
+        self.assertEqual(self.client.delete(dataset).status_code, 204)
+
+    def test_upload_requires_a_file(self):
+        response = self.client.post(API + "/datasets", data={}, content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 400)
+
+    def test_columnar_output(self):
+        response = self.post("/data", output_format="columnar")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, MEDIA_TYPE)
+        self.assertIn("temp", [header["name"] for header, _ in decode_frames(response.get_data())])
+
+        self.assertEqual(self.post("/data", output_format="xml").status_code, 400)
+
+    def test_ndjson_framing(self):
+        response = self.post("/cerv2-data-chunks", filter_variables="temp", step_size="1", framing="ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(parse_ndjson(response)), 12)
+
+        response = self.post("/cerv2-data-chunks", filter_variables="temp", step_size="1", framing="xml")
+        self.assertEqual(response.status_code, 400)
+
+    def test_aggregation(self):
+        options = {"filter_variables": "temp", "step_size": "2", "framing": "ndjson"}
+        response = self.post("/cerv2-data-chunks", aggregation="max", **options)
+        self.assertEqual(response.status_code, 200)
+        records = parse_ndjson(response)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]["timeVars"]["0"]["temp"], 4)
+
+        self.assertEqual(self.post("/cerv2-data-chunks", aggregation="median", **options).status_code, 400)
+
+    def test_time_selection(self):
+        options = {"filter_variables": "temp", "step_size": "1", "framing": "ndjson"}
+        response = self.post("/cerv2-data-chunks", time_range="1,2", time_layout="compact", **options)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(parse_ndjson(response)[0]["timeVars"], {"temp": [12]})
+
+        self.assertEqual(self.post("/cerv2-data-chunks", time_layout="wide", **options).status_code, 400)
+
+    def test_tiles(self):
+        response = self.post("/cerv2-tiles", filter_variables="temp", tile_size="2", max_levels="1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertTrue(all("bbox" in tile for tile in parse_ndjson(response)))
+
+        handle = self.upload_dataset()
+        response = self.client.post(f"{API}/datasets/{handle}/cerv2-tiles", data={"filter_variables": "temp", "tile_size": "2"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(parse_ndjson(response))
+        response.close()
+
+        self.assertEqual(self.post("/cerv2-tiles", filter_variables="temp", framing="xml").status_code, 400)
+
+    def test_tiles_report_errors_before_the_response(self):
+        # time has no grid dimensions, which is only found when the file is read
+        response = self.post("/cerv2-tiles", filter_variables="time")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()["message"], "Error processing the file")
+
+    def test_bbox_selection(self):
+        options = {"filter_variables": "temp", "step_size": "1", "framing": "ndjson"}
+        response = self.post("/cerv2-data-chunks", bbox="0,0,1,1", **options)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(parse_ndjson(response)), 4)
+
+        response = self.post("/cerv2-data-chunks", bbox="1,2", **options)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "Bad Request")
+
+    def test_bbox_selection_with_coordinate_axes(self):
+        self.content = create_cerv2_content(axes=True)
+        options = {"filter_variables": "temp", "step_size": "1", "framing": "ndjson"}
+        response = self.post("/cerv2-data-chunks", bbox="0,0,1,1", **options)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(parse_ndjson(response)), 4)
+
+    def test_metrics(self):
+        self.post("/data").get_data()
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('endpoint="/api/convert-netcdf-to-json/data"', response.get_data(as_text=True))
+
+        class NoMetricsConfig(ProductionConfig):
+            METRICS_ENABLED = False
+
+        app = create_app("production", NoMetricsConfig)
+        self.assertNotIn("/metrics", [rule.rule for rule in app.url_map.iter_rules()])
+
+    def test_buffered_streams(self):
+        class BufferedConfig(TestingConfig):
+            STREAM_BUFFER_CHUNKS = 2
+
+        buffered = create_app("production", BufferedConfig).test_client().post(
+            API + "/data",
+            data={"file": (io.BytesIO(self.content), "cerv2.nc")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(buffered.status_code, 200)
+        self.assertEqual(buffered.get_data(), self.post("/data").get_data())
+
+    def test_closing_an_unread_response_releases_its_slot(self):
+        for path in ("/data", "/cerv2-tiles"):
+            environ = EnvironBuilder(
+                path=API + path,
+                method="POST",
+                data={"file": (io.BytesIO(self.content), "cerv2.nc"), "filter_variables": "temp"},
+            ).get_environ()
+            statuses = []
+            body = self.app(environ, lambda status, headers: statuses.append(status))
+            self.assertEqual(statuses, ["200 OK"])
+            # the server closes the response before it requested the first chunk
+            body.close()
+            self.assertEqual(worker_pool_service.active_requests, 0)
+
+    def test_record_range(self):
+        options = {"filter_variables": "temp", "step_size": "1", "framing": "ndjson"}
+        response = self.post("/cerv2-data-chunks", start="5", max_records="3", **options)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([record["seq"] for record in parse_ndjson(response)], [5, 6, 7])
+
+        self.assertEqual(self.post("/cerv2-data-chunks", start="-1", **options).status_code, 400)
+
+    def test_partitions(self):
+        options = {"filter_variables": "temp", "step_size": "1", "framing": "ndjson", "partitions": "2"}
+        response = self.post("/cerv2-data-chunks", partition="1", **options)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([record["seq"] for record in parse_ndjson(response)], list(range(4, 12)))
+
+        self.assertEqual(self.post("/cerv2-data-chunks", partition="2", **options).status_code, 400)
+
+    def test_compact_schema(self):
+        options = {"filter_variables": "temp", "step_size": "1", "framing": "ndjson"}
+        response = self.post("/cerv2-data-chunks", schema="compact", **options)
+        self.assertEqual(response.status_code, 200)
+        messages = parse_ndjson(response)
+        self.assertEqual(messages[0]["header"]["fields"], ["seq", "temp"])
+        self.assertEqual(messages[1], [0, [0, 12]])
+
+        self.assertEqual(self.post("/cerv2-data-chunks", schema="short", **options).status_code, 400)
+
+    def test_statistics(self):
+        response = self.post("/statistics", filter_variables="temp", per_time_step="true")
+        self.assertEqual(response.status_code, 200)
+        steps = response.get_json()["variables"]["temp"]["time_steps"]
+        self.assertEqual([step["count"] for step in steps], [12, 12])
+        self.assertEqual(self.post("/statistics", bins="0").status_code, 400)
+
+        dataset = f"{API}/datasets/{self.upload_dataset()}"
+        response = self.client.post(dataset + "/statistics", data={"filter_variables": "temp"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["variables"]["temp"]["count"], 24)
+        response.close()
+        self.assertEqual(self.client.post(dataset + "/statistics", data={"percentiles": "150"}).status_code, 400)
+
+    def test_compression(self):
+        identity = self.post("/data")
+        self.assertNotIn("Content-Encoding", identity.headers)
+
+        response = self.client.post(
+            API + "/data",
+            data={"file": (io.BytesIO(self.content), "cerv2.nc")},
+            content_type="multipart/form-data",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.get_data()), identity.get_data())
+
+        # small JSON responses are not compressed
+        for path in ("/metadata", "/statistics"):
+            response = self.client.post(
+                API + path,
+                data={"file": (io.BytesIO(self.content), "cerv2.nc")},
+                content_type="multipart/form-data",
+                headers={"Accept-Encoding": "gzip"},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_batch(self):
+        files = [(io.BytesIO(self.content), "first.nc"), (io.BytesIO(self.content), "second.nc")]
+        response = self.client.post(
+            API + "/cerv2-batch",
+            data={"files": files, "filter_variables": "temp", "step_size": "2", "framing": "ndjson"},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        messages = parse_ndjson(response)
+        self.assertEqual(len(messages), 2 * (2 + 4))
+        self.assertEqual({(m["file"], m["event"]) for m in messages if "event" in m}, {(0, "start"), (0, "end"), (1, "start"), (1, "end")})
+
+        response = self.client.post(API + "/cerv2-batch", data={"filter_variables": "temp", "step_size": "1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_is_rejected_without_free_slots(self):
+        class BatchConfig(TestingConfig):
+            MAX_CONCURRENT_CONVERSIONS = 2
+            BATCH_CONCURRENCY = 4
+
+        client = create_app("production", BatchConfig).test_client()
+        # a running conversion takes one of the slots the two files of the batch need
+        stream = worker_pool_service.admit(iter([]))
+        try:
+            files = [(io.BytesIO(self.content), "first.nc"), (io.BytesIO(self.content), "second.nc")]
+            response = client.post(
+                API + "/cerv2-batch",
+                data={"files": files, "filter_variables": "temp", "step_size": "1"},
+                content_type="multipart/form-data",
+            )
+        finally:
+            stream.close()
+        self.assertEqual(response.status_code, 429)
+
+    def test_step_sizes_must_be_positive(self):
+        for field in ("step_size", "time_step"):
+            options = {"filter_variables": "temp", "step_size": "1", field: "-1"}
+            response = self.post("/cerv2-data-chunks", **options)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.get_json()["errors"])
+        for field in ("step_size", "time_step", "tile_size", "max_levels"):
+            response = self.post("/cerv2-tiles", filter_variables="temp", **{field: "0"})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.get_json()["errors"])
+
+
+class TestErrorResponses(unittest.TestCase):
+    def setUp(self):
+        class BusyConfig(TestingConfig):
+            MAX_CONCURRENT_CONVERSIONS = 1
+
+        self.app = create_app("production", BusyConfig)
+        self.client = self.app.test_client()
+
+    def test_errors_are_answered_with_json_bodies_without_debugging(self):
+        self.assertFalse(self.app.debug)
+        response = self.client.post(
+            API + "/cerv2-data-chunks",
+            data={"file": (io.BytesIO(b"CDF"), "cerv2.nc"), "filter_variables": "temp", "step_size": "1", "partitions": "2", "partition": "2"},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "Bad Request")
+
+        dataset = API + "/datasets/" + "0" * 64
+        for response in (
+            self.client.get(dataset + "/metadata"),
+            self.client.get(dataset + "/data"),
+            self.client.post(dataset + "/cerv2-tiles", data={"filter_variables": "temp"}),
+            self.client.delete(dataset),
+        ):
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.get_json()["error"], "Not Found")
+
+        # a running conversion takes the only slot
+        stream = worker_pool_service.admit(iter([]))
+        try:
+            response = self.client.post(
+                API + "/data",
+                data={"file": (io.BytesIO(create_cerv2_content()), "cerv2.nc")},
+                content_type="multipart/form-data",
+            )
+        finally:
+            stream.close()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.get_json()["error"], "Too Many Requests")
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
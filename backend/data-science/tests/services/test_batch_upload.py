@@ -0,0 +1,70 @@
+import io
+import tarfile
+import unittest
+import zipfile
+
+from app.errors import FailedToParseError, InvalidSelectionError
+from app.services.batch_upload import expand_batch_upload, is_hidden_member
+from werkzeug.datastructures import FileStorage
+
+
+class TestBatchUpload(unittest.TestCase):
+    def setUp(self):
+        self.members = {"a.nc": b"first", "data/b.nc": b"second"}
+
+    def create_zip(self, extra=None):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, content in dict(self.members, **(extra or {})).items():
+                archive.writestr(name, content)
+        return FileStorage(stream=buffer, filename="batch.zip")
+
+    def create_tar(self, mode="w:gz"):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode=mode) as archive:
+            for name, content in self.members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        return FileStorage(stream=buffer, filename="batch.tar.gz")
+
+    def read(self, batch_file):
+        with batch_file.open() as netCDF4_file:
+            if isinstance(netCDF4_file, str):
+                with open(netCDF4_file, "rb") as file:
+                    return file.read()
+            return netCDF4_file.stream.getvalue()
+
+    def test_files_and_archives(self):
+        upload = FileStorage(stream=io.BytesIO(b"upload"), filename="upload.nc")
+        for archive in (self.create_zip(), self.create_tar(), self.create_tar("w")):
+            batch = expand_batch_upload([upload], archive)
+            self.assertEqual([f.name for f in batch], ["upload.nc", "a.nc", "data/b.nc"])
+            self.assertEqual([self.read(f) for f in batch], [b"upload", b"first", b"second"])
+
+    def test_extracted_members_are_removed(self):
+        batch = expand_batch_upload(archive=self.create_zip())
+        with batch[0].open() as path:
+            pass
+        with self.assertRaises(FileNotFoundError):
+            open(path, "rb")
+
+    def test_hidden_members_are_skipped(self):
+        batch = expand_batch_upload(archive=self.create_zip({"__MACOSX/._a.nc": b"", ".hidden.nc": b""}))
+        self.assertEqual([f.name for f in batch], ["a.nc", "data/b.nc"])
+        self.assertTrue(is_hidden_member("data/.git/x.nc"))
+        self.assertFalse(is_hidden_member("./data/x.nc"[2:]))
+
+    def test_invalid_batches(self):
+        with self.assertRaises(FailedToParseError):
+            expand_batch_upload(archive=FileStorage(stream=io.BytesIO(b"garbage"), filename="x.zip"))
+        with self.assertRaises(InvalidSelectionError):
+            expand_batch_upload([])
+        with self.assertRaises(InvalidSelectionError):
+            expand_batch_upload(archive=self.create_zip(), max_files=1)
+        with self.assertRaises(InvalidSelectionError):
+            expand_batch_upload(archive=self.create_zip(), max_extracted_bytes=10)
+
+
+if __name__ == "__main__":
+    unittest.main()
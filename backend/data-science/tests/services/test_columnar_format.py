@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+from app.services.columnar_format import decode_frames, encode_frame
+
+
+def encode_stream(*frames):
+    return b"".join(b"".join(encode_frame(*frame)) for frame in frames)
+
+
+class TestColumnarFormat(unittest.TestCase):
+    def test_roundtrip_keeps_dtype_and_shape(self):
+        float_data = np.arange(6, dtype=np.float32).reshape(2, 3)
+        int_data = np.arange(4, dtype=">i2")
+        stream = encode_stream(({"name": "a"}, float_data), ({"name": "b"}, int_data))
+
+        (header_a, array_a), (header_b, array_b) = decode_frames(stream)
+        self.assertEqual(header_a["name"], "a")
+        self.assertEqual(header_a["shape"], [2, 3])
+        self.assertEqual(array_a.dtype, np.float32)
+        np.testing.assert_array_equal(array_a, float_data)
+        self.assertEqual(array_b.dtype, np.dtype(">i2"))
+        np.testing.assert_array_equal(array_b, int_data)
+
+    def test_non_contiguous_array(self):
+        data = np.arange(12, dtype=np.float64).reshape(3, 4).T
+        ((_, array),) = decode_frames(encode_stream(({"name": "t"}, data)))
+        np.testing.assert_array_equal(array, data)
+
+    def test_payload_is_raw_buffer(self):
+        data = np.array([1.5, np.nan], dtype=np.float32)
+        header, payload = encode_frame({"name": "a"}, data)
+        self.assertEqual(payload, data.tobytes())
+        self.assertEqual(len(header), 4 + int.from_bytes(header[:4], "big"))
+
+    def test_object_array_is_encoded_as_json(self):
+        data = np.array(["a", None], dtype=object)
+        ((header, array),) = decode_frames(encode_stream(({"name": "s"}, data)))
+        self.assertEqual(header["dtype"], "json")
+        self.assertEqual(array.tolist(), ["a", None])
+
+    def test_frame_without_data(self):
+        ((header, array),) = decode_frames(encode_stream(({"type": "end"},)))
+        self.assertEqual(header, {"type": "end", "nbytes": 0})
+        self.assertIsNone(array)
@@ -1,13 +1,30 @@
+import io
+import os
+import tempfile
 import unittest
 
 import numpy as np
+import simplejson
 from app.errors.errors import NoCoordinatesError
+from app.services.batch_upload import BatchFile
+from app.services.columnar_format import decode_frames
+from app.services.json_encoder import custom_encoder
+from app.services.stream_buffer_service import StreamBufferService
+from app.services.stream_framing import iter_framed_records
+from app.services.worker_pool_service import WorkerPoolService
 from app.services.data_processing_service import (
+    DataProcessingService,
+    build_cerv2_records,
+    build_compact_cerv2_records,
     change_dimensions_dict,
-    custom_encoder,
+    iter_cerv2_array_blocks,
+    iter_chunk_blocks,
+    open_dataset,
     preprocess_variables,
+    read_coordinates,
 )
 from netCDF4 import Dataset
+from werkzeug.datastructures import FileStorage
 
 
 class TestYourModule(unittest.TestCase):
@@ -58,6 +75,23 @@ class TestYourModule(unittest.TestCase):
             self.assertEqual(name, "variable")
             np.testing.assert_array_equal(data, expected_var_data)
 
+    def test_preprocess_variables_reads_window_by_dimension_name(self):
+        self.dataset.variables["variable"][:] = np.arange(100).reshape(10, 10)
+        self.dataset.variables["time_variable"][:] = np.arange(1000).reshape(
+            10, 10, 10
+        )
+        variables, time_variables = preprocess_variables(
+            self.dataset, ["variable", "time_variable"], ["1", "7"], ["2", "4"], 3
+        )
+        # arrays are ordered west_east, south_north (, time)
+        np.testing.assert_array_equal(
+            variables[0][1], self.dataset.variables["variable"][2:4:3, 1:7:3].T
+        )
+        np.testing.assert_array_equal(
+            time_variables[0][1],
+            self.dataset.variables["time_variable"][2:4:3, 1:7:3].transpose(1, 0, 2),
+        )
+
     def test_invalid_variable_dimensions(self):
         var_filter = ["bad_variable"]
         lon_range = [2, 8]
@@ -68,6 +102,25 @@ class TestYourModule(unittest.TestCase):
                 self.dataset, var_filter, lon_range, lat_range, step_size
             )
 
+    def test_read_coordinate_axes(self):
+        self.dataset.createVariable("lon", np.float32, ("west_east",))[:] = np.arange(10)
+        self.dataset.createVariable("lat", np.float32, ("south_north",))[:] = np.arange(
+            10, 20
+        )
+        lon, lat = read_coordinates(self.dataset, [2, 8], [1, 5], step_size=2)
+        # the axes are broadcast to the grid ordered west_east, south_north
+        np.testing.assert_array_equal(lon, np.repeat([[2], [4], [6]], 2, axis=1))
+        np.testing.assert_array_equal(lat, np.repeat([[11, 13]], 3, axis=0))
+
+    def test_read_coordinates_of_the_first_time_step(self):
+        xlong = self.dataset.createVariable(
+            "XLONG", np.float32, ("time", "south_north", "west_east")
+        )
+        xlong[:] = np.arange(1000).reshape(10, 10, 10)
+        self.dataset.createVariable("XLAT", np.float32, ("south_north", "west_east"))
+        lon, _ = read_coordinates(self.dataset, [0, 2], [0, 3])
+        np.testing.assert_array_equal(lon, xlong[0, 0:3, 0:2].T)
+
     def test_encode_np_float32_array(self):
         arr = np.array([1.5, 2.2, 4.4], dtype=np.float32)
         expected_result = [1.5, 2.2, 4.4]
@@ -102,3 +155,583 @@ class TestYourModule(unittest.TestCase):
         dimensions = ["time", "west_east", "south_north"]
         expected_result = {"west_east": 1, "south_north": 2, "time": 0}
         self.assertEqual(change_dimensions_dict(dimensions), expected_result)
+
+
+class TestCERV2Chunks(unittest.TestCase):
+    def setUp(self):
+        # Create a small non-square CERV2-like file with actual data
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "cerv2.nc")
+        with Dataset(self.file_path, "w") as dataset:
+            dataset.createDimension("time", 3)
+            dataset.createDimension("south_north", 4)
+            dataset.createDimension("west_east", 5)
+            lon = dataset.createVariable("lon", np.float32, ("south_north", "west_east"))
+            lat = dataset.createVariable("lat", np.float32, ("south_north", "west_east"))
+            temp = dataset.createVariable(
+                "temp", np.float32, ("time", "south_north", "west_east")
+            )
+            lon[:] = np.arange(20, dtype=np.float32).reshape(4, 5) / 10
+            lat[:] = np.arange(20, dtype=np.float32).reshape(4, 5) / 100
+            temp[:] = np.arange(60, dtype=np.float32).reshape(3, 4, 5) + 0.5
+            temp[1, 0, 0] = np.nan
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def convert(self, **kwargs):
+        with open(self.file_path, "rb") as stream:
+            file = FileStorage(stream=stream, filename="cerv2.nc")
+            chunks = DataProcessingService().convert_cerv2_data_to_json_chunks(
+                file, ["lon", "lat", "temp"], [], [], 1, **kwargs
+            )
+            return "".join(chunks)
+
+    def test_records_match_per_cell_encoding(self):
+        with Dataset(self.file_path) as dataset:
+            variables, time_variables = preprocess_variables(
+                dataset, ["lon", "lat", "temp"], [], [], 1
+            )
+        expected = []
+        for seq, (x, y) in enumerate(np.ndindex(variables[0][1].shape)):
+            data = {"seq": seq, "x": x, "y": y}
+            data["vars"] = {name: values[x, y] for name, values in variables}
+            data["timeVars"] = {
+                t: {name: values[x, y, t] for name, values in time_variables}
+                for t in range(3)
+            }
+            expected.append(
+                simplejson.dumps(data, default=custom_encoder, ignore_nan=True)
+            )
+
+        # the records contain the same values, the encoders only differ in whitespace
+        expected = [simplejson.loads(record) for record in expected]
+        for batch_rows in (1, 2, 16):
+            output = self.convert(batch_rows=batch_rows)
+            self.assertTrue(output.endswith("||*split*||"))
+            records = [simplejson.loads(record) for record in output.split("||*split*||")[:-1]]
+            self.assertEqual(records, expected)
+
+    def test_resumed_stream_continues_after_the_last_record(self):
+        for kwargs in ({}, {"aggregation": "nanmean"}):
+            full = self.convert(framing="ndjson", **kwargs).splitlines()
+            for start in (0, 1, 5, 7, 19, 20, 25):
+                resumed = self.convert(framing="ndjson", start=start, **kwargs)
+                self.assertEqual(resumed.splitlines(), full[start:])
+
+    def test_sub_ranges_add_up_to_the_whole_stream(self):
+        full = self.convert(framing="ndjson", batch_rows=2)
+        parts = [
+            self.convert(framing="ndjson", batch_rows=2, start=start, max_records=6)
+            for start in range(0, 20, 6)
+        ]
+        self.assertEqual("".join(parts), full)
+        self.assertEqual(self.convert(max_records=0), "")
+
+    def test_partitions_add_up_to_the_whole_stream(self):
+        full = self.convert(framing="ndjson")
+        for partitions in (1, 2, 3, 5, 7):
+            parts = [
+                self.convert(framing="ndjson", partitions=partitions, partition=partition)
+                for partition in range(partitions)
+            ]
+            self.assertEqual("".join(parts), full)
+        # a partition can be resumed like the whole stream
+        resumed = self.convert(framing="ndjson", partitions=2, partition=1, start=13)
+        self.assertEqual(resumed.splitlines(), full.splitlines()[13:])
+        with self.assertRaises(ValueError):
+            self.convert(partitions=2, partition=2)
+
+    def test_sequence_numbers_with_step_size(self):
+        with open(self.file_path, "rb") as stream:
+            file = FileStorage(stream=stream, filename="cerv2.nc")
+            chunks = DataProcessingService().convert_cerv2_data_to_json_chunks(
+                file, ["lon", "lat"], [], [1, 4], 2, framing="ndjson", start=3, max_records=2
+            )
+            records = [simplejson.loads(line) for line in "".join(chunks).splitlines()]
+        # 5 x 3 cells with a step size of 2 are 3 x 2 records
+        self.assertEqual(
+            [(record["seq"], record["x"], record["y"]) for record in records],
+            [(3, 1, 1), (4, 2, 0)],
+        )
+        # x = 1 is west_east index 2, y = 1 is south_north index 3
+        self.assertAlmostEqual(records[0]["vars"]["lon"], 1.7, places=5)
+
+    def test_compact_schema_contains_same_values(self):
+        full = [simplejson.loads(line) for line in self.convert(framing="ndjson").splitlines()]
+        lines = self.convert(framing="ndjson", schema="compact").splitlines()
+        header = simplejson.loads(lines[0])["header"]
+        records = [simplejson.loads(line) for line in lines[1:]]
+
+        self.assertEqual(header["fields"], ["seq", "lon", "lat", "temp"])
+        self.assertEqual(header["vars"], 2)
+        self.assertEqual(
+            header["dimensions"], {"west_east": 5, "south_north": 4, "time": 3}
+        )
+        self.assertEqual(header["time"], {"indices": [0, 1, 2]})
+        self.assertEqual(len(records), len(full))
+        for record, expected in zip(records, full):
+            columns = header["dimensions"]["south_north"]
+            self.assertEqual(record[0], expected["seq"])
+            self.assertEqual(divmod(record[0], columns), (expected["x"], expected["y"]))
+            self.assertEqual(record[1:3], [expected["vars"]["lon"], expected["vars"]["lat"]])
+            self.assertEqual(
+                record[3], [step["temp"] for step in expected["timeVars"].values()]
+            )
+        self.assertLess(len("\n".join(lines)), len(self.convert(framing="ndjson")) / 2)
+
+    def test_resumed_compact_stream_starts_with_the_header(self):
+        lines = self.convert(framing="ndjson", schema="compact").splitlines()
+        resumed = self.convert(framing="ndjson", schema="compact", start=7).splitlines()
+        self.assertEqual(resumed, lines[:1] + lines[8:])
+
+    def test_precision_rounds_floats(self):
+        lines = self.convert(framing="ndjson", schema="compact", precision=1).splitlines()
+        self.assertEqual(simplejson.loads(lines[0])["header"]["precision"], 1)
+        self.assertEqual(simplejson.loads(lines[1]), [0, 0.0, 0.0, [0.5, None, 40.5]])
+        # lon 0.5 and lat 0.05 (as float32)
+        self.assertEqual(lines[2].replace(" ", ""), "[1,0.5,0.1,[5.5,25.5,45.5]]")
+        full = simplejson.loads(self.convert(framing="ndjson", precision=2).splitlines()[1])
+        self.assertEqual(full["vars"], {"lon": 0.5, "lat": 0.05})
+
+    def test_worker_pool_produces_same_records(self):
+        worker_pool = WorkerPoolService(processes=2, max_pending=2)
+        try:
+            with open(self.file_path, "rb") as stream:
+                file = FileStorage(stream=stream, filename="cerv2.nc")
+                service = DataProcessingService(worker_pool=worker_pool)
+                chunks = service.convert_cerv2_data_to_json_chunks(
+                    file, ["lon", "lat", "temp"], [], [], 1, batch_rows=1
+                )
+                self.assertEqual("".join(chunks), self.convert(batch_rows=1))
+        finally:
+            worker_pool.shutdown()
+
+    def test_aggregated_downsampling(self):
+        with Dataset(self.file_path) as dataset:
+            # the full data, ordered time, south_north, west_east
+            full = dataset.variables["temp"][:].filled()
+            variables, time_variables = preprocess_variables(
+                dataset, ["lat", "temp"], [], [], 2, aggregation="nanmean", time_step=2
+            )
+        temp = time_variables[0][1]
+        # west_east 5 -> 3, south_north 4 -> 2, time 3 -> 2
+        self.assertEqual(temp.shape, (3, 2, 2))
+        self.assertAlmostEqual(temp[0, 0, 0], np.nanmean(full[0:2, 0:2, 0:2]), places=5)
+        self.assertAlmostEqual(temp[2, 1, 1], np.nanmean(full[2:3, 2:4, 4:5]), places=5)
+        lat = variables[0][1]
+        self.assertEqual(lat.shape, (3, 2))
+        self.assertAlmostEqual(lat[1, 0], (0.02 + 0.03 + 0.07 + 0.08) / 4, places=5)
+
+    def test_first_aggregation_strides_time(self):
+        with Dataset(self.file_path) as dataset:
+            full = dataset.variables["temp"][:].filled()
+            _, time_variables = preprocess_variables(
+                dataset, ["temp"], [], [], 2, time_step=2
+            )
+        np.testing.assert_array_equal(
+            time_variables[0][1], full[::2, ::2, ::2].transpose(2, 1, 0)
+        )
+
+    def test_time_range_and_step(self):
+        with Dataset(self.file_path) as dataset:
+            full = dataset.variables["temp"][:].filled()
+            variables, time_variables = preprocess_variables(
+                dataset, ["lon", "temp"], [], [], 1, time_step=2, time_range=["1", "3"]
+            )
+            _, aggregated = preprocess_variables(
+                dataset, ["temp"], [], [], 1, aggregation="nanmax", time_range=["1", "3"], time_step=2
+            )
+        # variables without a time dimension are not affected
+        self.assertEqual(variables[0][1].shape, (5, 4))
+        np.testing.assert_array_equal(time_variables[0][1], full[1:3:2].transpose(2, 1, 0))
+        np.testing.assert_array_equal(aggregated[0][1][..., 0], full[2].transpose())
+
+    def test_compact_time_layout(self):
+        indexed = [
+            simplejson.loads(record)
+            for record in self.convert(batch_rows=2).split("||*split*||")[:-1]
+        ]
+        compact = [
+            simplejson.loads(record)
+            for record in self.convert(batch_rows=2, time_layout="compact").split("||*split*||")[:-1]
+        ]
+        self.assertEqual(len(compact), len(indexed))
+        for indexed_record, compact_record in zip(indexed, compact):
+            self.assertEqual(compact_record["vars"], indexed_record["vars"])
+            self.assertEqual(
+                compact_record["timeVars"]["temp"],
+                [values["temp"] for values in indexed_record["timeVars"].values()],
+            )
+
+    def test_tiles(self):
+        with open(self.file_path, "rb") as stream:
+            file = FileStorage(stream=stream, filename="cerv2.nc")
+            chunks = DataProcessingService().convert_cerv2_data_to_tiles(
+                file, ["temp"], [], [], 1, tile_size=2
+            )
+            tiles = [simplejson.loads(tile) for tile in "".join(chunks).splitlines()]
+
+        self.assertEqual([tile["level"] for tile in tiles], [2] + [1] * 2 + [0] * 6)
+        root = tiles[0]
+        # the coordinates of the whole grid
+        np.testing.assert_allclose(root["bbox"], [0, 0, 1.9, 0.19], rtol=1e-6)
+        # the first time step of the 4 x 4 cells in the first west_east columns
+        expected = np.arange(20).reshape(4, 5)[:, :4].mean() + 0.5
+        self.assertAlmostEqual(root["timeVars"]["temp"][0][0][0], expected, places=4)
+
+    def test_framings_contain_same_records(self):
+        expected = self.convert(batch_rows=1).split("||*split*||")[:-1]
+        for framing in ("ndjson", "length-prefixed"):
+            with open(self.file_path, "rb") as stream:
+                file = FileStorage(stream=stream, filename="cerv2.nc")
+                service = DataProcessingService(write_bytes=1)
+                chunks = list(
+                    service.convert_cerv2_data_to_json_chunks(
+                        file, ["lon", "lat", "temp"], [], [], 1, batch_rows=1, framing=framing
+                    )
+                )
+            # one write per block of grid rows
+            self.assertEqual(len(chunks), 5)
+            records = list(iter_framed_records(chunks[0][:0].join(chunks), framing))
+            self.assertEqual(records, expected)
+
+    def test_small_blocks_are_joined_into_larger_writes(self):
+        with open(self.file_path, "rb") as stream:
+            file = FileStorage(stream=stream, filename="cerv2.nc")
+            chunks = list(
+                DataProcessingService().convert_cerv2_data_to_json_chunks(
+                    file, ["lon", "lat", "temp"], [], [], 1, batch_rows=1
+                )
+            )
+        self.assertEqual(len(chunks), 1)
+
+    def test_columnar_chunks_match_json_records(self):
+        with open(self.file_path, "rb") as stream:
+            file = FileStorage(stream=stream, filename="cerv2.nc")
+            chunks = DataProcessingService().convert_cerv2_data_to_columnar_chunks(
+                file, ["lon", "lat", "temp"], [], [], 1, batch_rows=3
+            )
+            frames = list(decode_frames(b"".join(chunks)))
+
+        records = [
+            simplejson.loads(record)
+            for record in self.convert(batch_rows=3).split("||*split*||")[:-1]
+        ]
+        self.assertEqual([header["x"] for header, _ in frames], [0] * 3 + [3] * 3)
+        for header, block in frames:
+            for i, j in np.ndindex(block.shape[:2]):
+                record = records[(header["x"] + i) * block.shape[1] + j]
+                if header.get("time"):
+                    values = [step[header["name"]] for step in record["timeVars"].values()]
+                    np.testing.assert_array_equal(
+                        block[i, j], np.array(values, dtype=float)
+                    )
+                else:
+                    self.assertEqual(block[i, j], record["vars"][header["name"]])
+
+    def test_columnar_partitions_add_up_to_the_whole_grid(self):
+        def convert(**kwargs):
+            with open(self.file_path, "rb") as stream:
+                file = FileStorage(stream=stream, filename="cerv2.nc")
+                chunks = DataProcessingService().convert_cerv2_data_to_columnar_chunks(
+                    file, ["lon", "lat", "temp"], [], [], 1, batch_rows=2, **kwargs
+                )
+                return list(decode_frames(b"".join(chunks)))
+
+        full = convert()
+        parts = [frame for partition in range(2) for frame in convert(partitions=2, partition=partition)]
+        # the frames keep the absolute index of their first row
+        self.assertEqual([header["x"] for header, _ in parts], [0] * 3 + [2] * 3 + [4] * 3)
+        self.assertEqual([header for header, _ in parts], [header for header, _ in full])
+        for (_, block), (_, expected) in zip(parts, full):
+            np.testing.assert_array_equal(block, expected)
+
+    def test_batch_rows_controls_block_size(self):
+        variables = [("a", np.zeros((5, 2), dtype=np.float32))]
+        blocks = [build_cerv2_records(block) for block in iter_cerv2_array_blocks(variables, [], batch_rows=2)]
+        self.assertEqual([len(block) for block in blocks], [4, 4, 2])
+        self.assertEqual(blocks[2][0], {"seq": 8, "x": 4, "y": 0, "vars": {"a": 0.0}})
+
+    def test_shorter_time_series_are_padded(self):
+        time_variables = [
+            ("long", np.ones((1, 1, 3), dtype=np.float32)),
+            ("short", np.zeros((1, 1, 2), dtype=np.float32)),
+        ]
+        (block,) = iter_cerv2_array_blocks([], time_variables)
+        self.assertEqual(
+            build_cerv2_records(block)[0]["timeVars"][2], {"long": 1.0, "short": None}
+        )
+
+    def test_records_within_a_sequence_range(self):
+        variables = [("a", np.arange(12).reshape(4, 3))]
+        time_variables = [("t", np.arange(24).reshape(4, 3, 2))]
+        (_, block) = iter_cerv2_array_blocks(variables, time_variables, batch_rows=2)
+        records = build_cerv2_records(block, "compact", seq_range=(5, 8))
+        self.assertEqual([(r["seq"], r["x"], r["y"]) for r in records], [(6, 2, 0), (7, 2, 1)])
+        self.assertEqual(records[0]["vars"], {"a": 6})
+        self.assertEqual(records[1]["timeVars"], {"t": [14, 15]})
+        self.assertEqual(build_compact_cerv2_records(block, (11, 20)), [[11, 11, [22, 23]]])
+        self.assertEqual(build_compact_cerv2_records(block, (0, 6)), [])
+
+
+class TestOpenDataset(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "upload.nc")
+        with Dataset(self.file_path, "w") as dataset:
+            dataset.createDimension("x", 3)
+            dataset.createVariable("v", np.int32, ("x",))[:] = [1, 2, 3]
+        with open(self.file_path, "rb") as file:
+            self.content = file.read()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_opens(self, file, in_memory_threshold):
+        with open_dataset(file, in_memory_threshold) as dataset:
+            self.assertEqual(dataset.variables["v"][:].tolist(), [1, 2, 3])
+        self.assertFalse(dataset.isopen())
+
+    def test_open_named_file_in_place(self):
+        with open(self.file_path, "rb") as stream:
+            self.assert_opens(FileStorage(stream=stream, filename="upload.nc"), 0)
+
+    def test_open_small_upload_from_memory(self):
+        stream = io.BytesIO(self.content)
+        self.assert_opens(FileStorage(stream=stream, filename="upload.nc"), 1024**2)
+
+    def test_open_large_upload_from_spool_file(self):
+        stream = tempfile.SpooledTemporaryFile()
+        stream.write(self.content)
+        self.assert_opens(FileStorage(stream=stream, filename="upload.nc"), 0)
+
+
+class TestNetCDFDataConversion(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "data.nc")
+        with Dataset(self.file_path, "w") as dataset:
+            dataset.createDimension("x", 2)
+            dataset.createDimension("y", 3)
+            dataset.createDimension("empty", None)
+            dataset.createVariable("a", np.int16, ("x", "y"))[:] = [[1, 2, 3], [4, 5, 6]]
+            dataset.createVariable("b", np.float64, ("y",))[:] = [0.5, 1.5, 2.5]
+            dataset.createVariable("scalar", np.int32)[:] = 7
+            dataset.createVariable("e", np.float32, ("empty",))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_json_is_streamed_in_slabs(self):
+        with Dataset(self.file_path) as dataset:
+            expected = simplejson.dumps(
+                {
+                    "variables_data": {
+                        name: {"dimensions": var.dimensions, "data": var[:].filled().tolist()}
+                        for name, var in dataset.variables.items()
+                    }
+                },
+                default=custom_encoder,
+            )
+
+        expected = simplejson.loads(expected)
+        for slab_bytes in (1, 6, 1024):
+            service = DataProcessingService(slab_bytes=slab_bytes)
+            chunks = list(service.convert_netcdf_data_to_json(self.file_path))
+            self.assertEqual(simplejson.loads("".join(chunks)), expected)
+        worker_pool = WorkerPoolService(processes=2)
+        try:
+            service = DataProcessingService(slab_bytes=6, worker_pool=worker_pool)
+            chunks = service.convert_netcdf_data_to_json(self.file_path)
+            self.assertEqual(simplejson.loads("".join(chunks)), expected)
+        finally:
+            worker_pool.shutdown()
+        # one row of "a" per slab
+        chunks = DataProcessingService(slab_bytes=6).convert_netcdf_data_to_json(self.file_path)
+        self.assertIn(",[4,5,6]", [chunk.replace(" ", "") for chunk in chunks])
+
+    def test_variables_are_written_as_frames(self):
+        service = DataProcessingService(slab_bytes=6)
+        chunks = service.convert_netcdf_data_to_columnar(self.file_path)
+        frames = list(decode_frames(b"".join(chunks)))
+
+        self.assertEqual(
+            [(header["name"], header["start"]) for header, _ in frames],
+            [("a", 0), ("a", 1), ("b", 0), ("b", 1), ("b", 2), ("scalar", 0), ("e", 0)],
+        )
+        self.assertEqual(frames[0][0]["dimensions"], ["x", "y"])
+        self.assertEqual(frames[0][0]["fill_value"], -32767)
+        self.assertEqual(frames[0][1].dtype, np.int16)
+        self.assertEqual(np.concatenate([frames[0][1], frames[1][1]]).tolist(), [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(frames[2][1].tolist(), [0.5])
+        self.assertEqual(frames[5][1].tolist(), 7)
+        self.assertEqual(frames[6][1].shape, (0,))
+
+
+class TestNetCDFStatistics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "statistics.nc")
+        rng = np.random.default_rng(0)
+        self.temp = rng.normal(280, 10, (6, 20, 30)).astype(np.float32)
+        self.temp[0, 0, :5] = -9999
+        with Dataset(self.file_path, "w") as dataset:
+            dataset.createDimension("time", 6)
+            dataset.createDimension("south_north", 20)
+            dataset.createDimension("west_east", 30)
+            temp = dataset.createVariable(
+                "temp",
+                np.float32,
+                ("time", "south_north", "west_east"),
+                fill_value=-9999,
+                chunksizes=(2, 8, 8),
+            )
+            temp[:] = self.temp
+            dataset.createVariable("mask", np.uint8, ("south_north", "west_east"))[:] = 1
+            dataset.createVariable("name", str, ("time",))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_blocks_consist_of_whole_chunks(self):
+        with Dataset(self.file_path) as dataset:
+            var = dataset.variables["temp"]
+            blocks = list(iter_chunk_blocks(var, block_bytes=4 * 2 * 8 * 16))
+            seen = np.zeros(var.shape, dtype=int)
+            for slices, block in blocks:
+                self.assertEqual([s.start % c for s, c in zip(slices, (2, 8, 8))], [0, 0, 0])
+                np.testing.assert_array_equal(block, var[slices])
+                seen[slices] += 1
+            self.assertTrue((seen == 1).all())
+            self.assertEqual(blocks[0][1].shape, (2, 8, 16))
+
+    def test_statistics_honour_fill_values(self):
+        for service in (DataProcessingService(slab_bytes=1024), DataProcessingService()):
+            chunks = service.convert_netcdf_statistics_to_json(self.file_path, percentiles=[50])
+            result = simplejson.loads("".join(chunks))["variables"]
+
+            self.assertEqual(list(result), ["temp", "mask"])
+            valid = self.temp[self.temp != -9999].astype(np.float64)
+            temp = result["temp"]
+            self.assertEqual(temp["dimensions"], ["time", "south_north", "west_east"])
+            self.assertEqual((temp["count"], temp["missing"]), (valid.size, 5))
+            self.assertEqual((temp["min"], temp["max"]), (valid.min(), valid.max()))
+            self.assertAlmostEqual(temp["mean"], valid.mean(), places=6)
+            self.assertAlmostEqual(temp["std"], valid.std(), places=6)
+            self.assertAlmostEqual(temp["percentiles"]["p50"], np.median(valid), delta=0.1)
+            self.assertEqual(sum(temp["histogram"]["counts"]), valid.size)
+            self.assertNotIn("time_steps", temp)
+            self.assertEqual((result["mask"]["min"], result["mask"]["max"]), (1, 1))
+
+    def test_statistics_per_time_step(self):
+        worker_pool = WorkerPoolService(processes=2)
+        try:
+            service = DataProcessingService(slab_bytes=1024, worker_pool=worker_pool)
+            chunks = service.convert_netcdf_statistics_to_json(
+                self.file_path, ["temp"], bins=4, per_time_step=True
+            )
+            result = simplejson.loads("".join(chunks))["variables"]
+        finally:
+            worker_pool.shutdown()
+
+        steps = result["temp"]["time_steps"]
+        self.assertEqual(len(steps), 6)
+        for t, step in enumerate(steps):
+            valid = self.temp[t][self.temp[t] != -9999].astype(np.float64)
+            self.assertEqual(step["count"], valid.size)
+            self.assertAlmostEqual(step["mean"], valid.mean(), places=6)
+            self.assertLessEqual(len(step["histogram"]["counts"]), 4)
+        self.assertEqual(steps[0]["missing"], 5)
+
+
+class TestCERV2Batch(unittest.TestCase):
+    def setUp(self):
+        # three consecutive days, uploaded in reverse order, and a file which is no NetCDF file
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.batch = []
+        for day in (2, 1, 0):
+            path = os.path.join(self.temp_dir.name, f"day{day}.nc")
+            self.create_file(path, day)
+            self.batch.append(BatchFile(f"day{day}.nc", netCDF4_file=path))
+        invalid = FileStorage(stream=io.BytesIO(b"no netcdf"), filename="invalid.nc")
+        self.batch.append(BatchFile("invalid.nc", netCDF4_file=invalid))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_file(self, path, day, south_north=4):
+        with Dataset(path, "w") as dataset:
+            dataset.createDimension("time", 2)
+            dataset.createDimension("south_north", south_north)
+            dataset.createDimension("west_east", 3)
+            time = dataset.createVariable("time", np.float64, ("time",))
+            time.units = "hours since 2020-01-01"
+            time[:] = [24 * day, 24 * day + 12]
+            dataset.createVariable("lon", np.float32, ("south_north", "west_east"))[:] = 1
+            temp = dataset.createVariable("temp", np.float32, ("time", "south_north", "west_east"))
+            temp[:] = np.arange(2)[:, None, None] + 10 * day
+
+    def test_streams_are_tagged_per_file(self):
+        streams = DataProcessingService().iter_cerv2_batch_streams(
+            self.batch,
+            framing="ndjson",
+            filter=["lon", "temp"],
+            longitude_range=[],
+            latitude_range=[],
+            step_size=1,
+        )
+        messages = [
+            simplejson.loads(record)
+            for chunk in StreamBufferService(max_chunks=2).interleave(streams, 2)
+            for record in chunk.splitlines()
+        ]
+        error = {"file": 3, "name": "invalid.nc", "event": "error", "error": "Failed to parse the provided NetCDF file."}
+        self.assertIn(error, messages)
+        self.assertEqual(len([m for m in messages if "event" in m]), 8)
+        for index, day in enumerate((2, 1, 0)):
+            messages_of_file = [m for m in messages if m["file"] == index]
+            self.assertEqual(messages_of_file[0], {"file": index, "name": f"day{day}.nc", "event": "start"})
+            self.assertEqual(messages_of_file[-1], {"file": index, "event": "end"})
+            records = messages_of_file[1:-1]
+            self.assertEqual([record["seq"] for record in records], list(range(12)))
+            self.assertEqual(records[0]["timeVars"], {"0": {"temp": 10 * day}, "1": {"temp": 10 * day + 1}})
+
+    def test_compact_records_start_with_the_file(self):
+        options = {"filter": ["temp"], "longitude_range": [], "latitude_range": [], "step_size": 1, "schema": "compact"}
+        chunks = DataProcessingService().convert_batch_file_to_json_chunks(1, self.batch[1], "ndjson", options)
+        messages = [simplejson.loads(record) for record in "".join(chunks).splitlines()]
+        self.assertEqual(messages[1]["header"]["fields"], ["file", "seq", "temp"])
+        self.assertEqual(messages[1]["header"]["file"], 1)
+        self.assertEqual(messages[2], [1, 0, [10, 11]])
+
+    def test_files_are_merged_along_the_time_dimension(self):
+        mismatched = os.path.join(self.temp_dir.name, "mismatched.nc")
+        self.create_file(mismatched, 3, south_north=5)
+        batch = self.batch + [BatchFile("mismatched.nc", netCDF4_file=mismatched)]
+        chunks = DataProcessingService().convert_merged_cerv2_data_to_json_chunks(
+            batch, ["temp"], [], [], 1, framing="ndjson", schema="compact", concurrency=3
+        )
+        messages = [simplejson.loads(record) for record in "".join(chunks).splitlines()]
+        self.assertEqual((messages[0]["file"], messages[0]["event"]), (3, "error"))
+        self.assertEqual((messages[1]["file"], messages[1]["event"]), (4, "error"))
+        # the files are ordered by their time coordinate
+        self.assertEqual([m["file"] for m in messages[2:5]], [2, 1, 0])
+        self.assertEqual({m["event"] for m in messages[2:5]}, {"merged"})
+        header = messages[5]["header"]
+        self.assertEqual(header["dimensions"], {"west_east": 3, "south_north": 4, "time": 6})
+        self.assertEqual(header["time"]["values"], [0, 12, 24, 36, 48, 60])
+        self.assertEqual(len(messages[6:]), 12)
+        self.assertEqual(messages[6], [0, [0, 1, 10, 11, 20, 21]])
+
+    def test_merged_selections_are_limited_in_size(self):
+        # the temperatures of a file take 2 x 4 x 3 x 4 bytes
+        chunks = DataProcessingService().convert_merged_cerv2_data_to_json_chunks(
+            self.batch[:3], ["temp"], [], [], 1, framing="ndjson", max_bytes=200
+        )
+        messages = [simplejson.loads(record) for record in "".join(chunks).splitlines()]
+        self.assertEqual((messages[0]["file"], messages[0]["event"]), (2, "error"))
+        self.assertIn("exceeds the memory left for merging", messages[0]["error"])
+        self.assertEqual([(m["file"], m["event"]) for m in messages[1:3]], [(1, "merged"), (0, "merged")])
+        self.assertEqual(len(messages[3:]), 12)
+        self.assertEqual(messages[3]["timeVars"], {"0": {"temp": 10}, "1": {"temp": 11}, "2": {"temp": 20}, "3": {"temp": 21}})
@@ -0,0 +1,158 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from app.errors.errors import DatasetNotFoundError, FailedToParseError
+from app.services.dataset_cache_service import DatasetCacheService
+from netCDF4 import Dataset
+from werkzeug.datastructures import FileStorage
+
+
+def create_netcdf_content(temp_dir, size):
+    file_path = os.path.join(temp_dir, f"dataset_{size}.nc")
+    with Dataset(file_path, "w") as dataset:
+        dataset.createDimension("x", size)
+        dataset.createVariable("v", np.int32, ("x",))[:] = np.arange(size)
+    with open(file_path, "rb") as file:
+        return file.read()
+
+
+def upload(content):
+    return FileStorage(stream=io.BytesIO(content), filename="dataset.nc")
+
+
+class TestDatasetCacheService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = DatasetCacheService(cache_dir=os.path.join(self.temp_dir.name, "cache"))
+        self.content = create_netcdf_content(self.temp_dir.name, 10)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_add_uses_content_hash_as_handle(self):
+        result = self.cache.add(upload(self.content))
+        self.assertEqual(result["handle"], hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(result["size"], len(self.content))
+        self.assertFalse(result["cached"])
+        with Dataset(self.cache.get_path(result["handle"])) as dataset:
+            self.assertEqual(dataset.variables["v"][:].tolist(), list(range(10)))
+
+    def test_add_same_content_twice_is_cached(self):
+        self.cache.add(upload(self.content))
+        result = self.cache.add(upload(self.content))
+        self.assertTrue(result["cached"])
+        self.assertEqual(len(os.listdir(self.cache.cache_dir)), 1)
+
+    def test_add_invalid_file(self):
+        with self.assertRaises(FailedToParseError):
+            self.cache.add(upload(b"not a netcdf file"))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_get_unknown_or_invalid_handle(self):
+        with self.assertRaises(DatasetNotFoundError):
+            self.cache.get_path("0" * 64)
+        with self.assertRaises(DatasetNotFoundError):
+            self.cache.get_path("../etc/passwd")
+
+    def test_expired_dataset_is_removed(self):
+        handle = self.cache.add(upload(self.content))["handle"]
+        path = self.cache.get_path(handle)
+        os.utime(path, (time.time() - self.cache.ttl - 1,) * 2)
+        with self.assertRaises(DatasetNotFoundError):
+            self.cache.get_path(handle)
+        self.assertFalse(os.path.exists(path))
+
+    def test_least_recently_used_dataset_is_evicted(self):
+        other_content = create_netcdf_content(self.temp_dir.name, 20)
+        third_content = create_netcdf_content(self.temp_dir.name, 30)
+        # only two of the three datasets fit into the cache
+        self.cache.max_bytes = len(self.content) + len(third_content)
+        first = self.cache.add(upload(self.content))["handle"]
+        second = self.cache.add(upload(other_content))["handle"]
+        path = self.cache.get_path(second)
+        os.utime(path, (time.time() - 10,) * 2)
+        # the first dataset was used more recently than the second one
+        self.cache.get_path(first)
+
+        third = self.cache.add(upload(third_content))
+        self.cache.get_path(first)
+        self.cache.get_path(third["handle"])
+        with self.assertRaises(DatasetNotFoundError):
+            self.cache.get_path(second)
+
+    def test_pinned_dataset_is_not_evicted(self):
+        other_content = create_netcdf_content(self.temp_dir.name, 20)
+        # only one of the two datasets fits into the cache
+        self.cache.max_bytes = len(other_content)
+        handle = self.cache.add(upload(self.content))["handle"]
+        path = self.cache.pin(handle)
+        os.utime(path, (time.time() - 10,) * 2)
+
+        # the evicting upload runs between looking up the dataset and opening it
+        self.cache.add(upload(other_content))
+        with Dataset(path) as dataset:
+            self.assertEqual(dataset.variables["v"][:].tolist(), list(range(10)))
+
+        self.cache.unpin(handle)
+        self.assertEqual(self.cache.pins, {})
+        self.cache.add(upload(other_content))
+        with self.assertRaises(DatasetNotFoundError):
+            self.cache.get_path(handle)
+
+    def test_memoize_computes_value_once(self):
+        handle = self.cache.add(upload(self.content))["handle"]
+        calls = []
+
+        def compute(path):
+            calls.append(path)
+            return len(calls)
+
+        self.assertEqual(self.cache.memoize(handle, "value", compute), 1)
+        self.assertEqual(self.cache.memoize(handle, "value", compute), 1)
+        self.assertEqual(len(calls), 1)
+
+        self.cache.remove(handle)
+        with self.assertRaises(DatasetNotFoundError):
+            self.cache.memoize(handle, "value", compute)
+
+    def test_memoize_computes_value_once_for_concurrent_requests(self):
+        handle = self.cache.add(upload(self.content))["handle"]
+        calls = []
+
+        def compute(path):
+            calls.append(path)
+            time.sleep(0.05)
+            return len(calls)
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: self.cache.memoize(handle, "value", compute), range(8)))
+        self.assertEqual(results, [1] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.memoize_locks, {})
+
+    def test_memoize_computes_value_again_after_an_error(self):
+        handle = self.cache.add(upload(self.content))["handle"]
+
+        def fail(path):
+            raise ValueError("broken")
+
+        with self.assertRaises(ValueError):
+            self.cache.memoize(handle, "value", fail)
+        self.assertEqual(self.cache.memoize_locks, {})
+        self.assertEqual(self.cache.memoize(handle, "value", lambda path: "value"), "value")
+
+    def test_value_of_a_removed_dataset_is_not_memoized(self):
+        handle = self.cache.add(upload(self.content))["handle"]
+
+        def compute(path):
+            self.cache.remove(handle)
+            return "value"
+
+        self.assertEqual(self.cache.memoize(handle, "value", compute), "value")
+        self.assertNotIn(handle, self.cache.memoized)
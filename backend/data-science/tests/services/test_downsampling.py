@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+from app.services.downsampling import block_reduce
+
+
+class TestBlockReduce(unittest.TestCase):
+    def setUp(self):
+        self.array = np.arange(20, dtype=np.float32).reshape(4, 5)
+
+    def test_first_is_stride(self):
+        np.testing.assert_array_equal(
+            block_reduce(self.array, (1, 2), "first"), self.array[:, ::2]
+        )
+
+    def test_aggregations_with_partial_last_block(self):
+        expected = {
+            "mean": [[0.5, 2.5, 4], [5.5, 7.5, 9]],
+            "min": [[0, 2, 4], [5, 7, 9]],
+            "max": [[1, 3, 4], [6, 8, 9]],
+        }
+        for aggregation, values in expected.items():
+            with self.subTest(aggregation=aggregation):
+                result = block_reduce(self.array[:2], (1, 2), aggregation)
+                np.testing.assert_array_equal(result, values)
+                self.assertEqual(result.dtype, np.float32)
+
+    def test_nan_aware_aggregations(self):
+        array = np.array([[1.0, np.nan, 3.0, 5.0], [np.nan, np.nan, 2.0, 4.0]])
+        np.testing.assert_array_equal(block_reduce(array, (1, 2), "mean"), [[np.nan, 4], [np.nan, 3]])
+        np.testing.assert_array_equal(block_reduce(array, (1, 2), "nanmean"), [[1, 4], [np.nan, 3]])
+        np.testing.assert_array_equal(block_reduce(array, (1, 2), "nanmin"), [[1, 3], [np.nan, 2]])
+        np.testing.assert_array_equal(block_reduce(array, (1, 2), "nanmax"), [[1, 5], [np.nan, 4]])
+        np.testing.assert_array_equal(block_reduce(array, (2, 1), "max"), [[np.nan, np.nan, 3, 5]])
+
+    def test_mean_over_several_axes_weights_every_cell(self):
+        array = np.array([[1.0, np.nan], [2.0, 6.0]])
+        self.assertEqual(block_reduce(array, (2, 2), "nanmean")[0, 0], 3.0)
+        array = np.arange(15, dtype=np.float64).reshape(3, 5)
+        np.testing.assert_allclose(
+            block_reduce(array, (2, 3), "mean"),
+            [[array[0:2, 0:3].mean(), array[0:2, 3:5].mean()], [array[2:3, 0:3].mean(), array[2:3, 3:5].mean()]],
+        )
+
+    def test_integer_mean_is_float(self):
+        result = block_reduce(np.arange(6), (4,), "mean")
+        np.testing.assert_array_equal(result, [1.5, 4.5])
+        self.assertEqual(result.dtype, np.float64)
+
+    def test_unknown_aggregation(self):
+        with self.assertRaises(ValueError):
+            block_reduce(self.array, (2, 1), "median")
@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import simplejson
+from app.services import json_encoder
+from app.services.json_encoder import NumpyJSONEncoder, custom_encoder
+
+
+class TestNumpyJSONEncoder(unittest.TestCase):
+    def assert_same_values(self, encoded, expected):
+        self.assertEqual(simplejson.loads(encoded), expected)
+
+    def test_custom_encoder_handles_all_numeric_scalars(self):
+        for value in (np.float64(1.5), np.float16(1.5), np.int16(-3), np.uint8(200), np.bool_(True)):
+            self.assertEqual(custom_encoder(value), value.item())
+            self.assertIs(type(custom_encoder(value)), type(value.item()))
+        with self.assertRaises(TypeError):
+            custom_encoder({"a": np.array([1, 2, 3])})
+
+    def test_arrays_of_all_numeric_dtypes(self):
+        encoder = NumpyJSONEncoder()
+        for dtype in (np.float16, np.float32, np.float64, np.int8, np.int16, np.int64, np.uint8, np.uint32, np.bool_):
+            array = np.arange(6).reshape(2, 3).astype(dtype)
+            self.assert_same_values(encoder.encode(array), array.tolist())
+
+    def test_floats_have_the_digits_of_their_repr(self):
+        array = np.array([0.1, 1e16, 1e-5, 2.5, 1 / 3], dtype=np.float32)
+        encoded = NumpyJSONEncoder().encode(array)
+        self.assertEqual(simplejson.loads(encoded), [float(value) for value in array])
+
+    def test_byte_order_and_layout(self):
+        array = np.arange(12, dtype=">i4").reshape(3, 4)
+        self.assert_same_values(NumpyJSONEncoder().encode(array.T[::2]), array.T[::2].tolist())
+        array = np.arange(12, dtype=">f8").reshape(3, 4)
+        self.assert_same_values(NumpyJSONEncoder().encode(array.T), array.T.tolist())
+
+    def test_nan_semantics(self):
+        array = np.array([1.0, np.nan, np.inf], dtype=np.float32)
+        self.assertEqual(simplejson.loads(NumpyJSONEncoder(ignore_nan=True).encode(array)), [1.0, None, None])
+        self.assertEqual(NumpyJSONEncoder(allow_nan=True).encode(array), "[1.0, NaN, Infinity]")
+        with self.assertRaises(ValueError):
+            NumpyJSONEncoder().encode(array)
+        record = {"vars": {"a": float("nan")}, "timeVars": {0: {"a": 1.5}}}
+        self.assertEqual(
+            simplejson.loads(NumpyJSONEncoder(ignore_nan=True).encode(record)),
+            {"vars": {"a": None}, "timeVars": {"0": {"a": 1.5}}},
+        )
+
+    def test_masked_and_scalar_arrays(self):
+        masked = np.ma.masked_array([1, 2, 3], mask=[False, True, False], dtype=np.int16)
+        self.assertEqual(simplejson.loads(NumpyJSONEncoder().encode(masked)), [1, None, 3])
+        self.assertEqual(NumpyJSONEncoder().encode(np.array(7, dtype=np.int32)), "7")
+
+    def test_scalars_in_records(self):
+        record = {"a": np.float32(0.5), "b": np.int16(2), "c": [np.uint8(3)]}
+        for encoder in (NumpyJSONEncoder(), NumpyJSONEncoder(ignore_nan=True)):
+            self.assert_same_values(encoder.encode(record), {"a": 0.5, "b": 2, "c": [3]})
+        with self.assertRaises(TypeError):
+            NumpyJSONEncoder(ignore_nan=True).encode({"a": object()})
+
+    def test_without_orjson(self):
+        with mock.patch.object(json_encoder, "orjson", None):
+            encoder = NumpyJSONEncoder(ignore_nan=True)
+            array = np.array([[0.5, np.nan]], dtype=np.float32)
+            self.assertEqual(encoder.encode(array), "[[0.5, null]]")
+            self.assertEqual(encoder.encode({"a": np.int16(1)}), '{"a": 1}')
+
+
+if __name__ == "__main__":
+    unittest.main()
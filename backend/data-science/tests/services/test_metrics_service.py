@@ -0,0 +1,106 @@
+import os
+import time
+import unittest
+
+from app.middlewares.metrics_middleware import MeasuredBody
+from app.services.metrics_service import (
+    ACTIVE_REQUESTS,
+    PHASE_SECONDS,
+    RECORDS_EMITTED,
+    MetricsService,
+    format_server_timing,
+    request_phases,
+)
+
+
+class TestMetricsService(unittest.TestCase):
+    def test_render_histogram_buckets_are_cumulative(self):
+        metrics = MetricsService(buckets=(0.1, 1))
+        metrics.observe(PHASE_SECONDS, 0.05, phase="open")
+        metrics.observe(PHASE_SECONDS, 0.5, phase="open")
+        metrics.observe(PHASE_SECONDS, 5, phase="open")
+        lines = metrics.render().splitlines()
+
+        self.assertIn('netcdf_phase_seconds_bucket{phase="open",le="0.1"} 1', lines)
+        self.assertIn('netcdf_phase_seconds_bucket{phase="open",le="1"} 2', lines)
+        self.assertIn('netcdf_phase_seconds_bucket{phase="open",le="+Inf"} 3', lines)
+        self.assertIn('netcdf_phase_seconds_sum{phase="open"} 5.55', lines)
+        self.assertIn('netcdf_phase_seconds_count{phase="open"} 3', lines)
+        self.assertIn("# TYPE netcdf_phase_seconds histogram", lines)
+
+    def test_counters_and_gauges(self):
+        metrics = MetricsService()
+        metrics.increment(RECORDS_EMITTED, 10, stream="cerv2")
+        metrics.increment(RECORDS_EMITTED, 5, stream="cerv2")
+        metrics.increment(ACTIVE_REQUESTS)
+        metrics.increment(ACTIVE_REQUESTS, -1)
+        lines = metrics.render().splitlines()
+
+        self.assertIn('netcdf_records_emitted_total{stream="cerv2"} 15', lines)
+        self.assertIn("netcdf_active_requests 0", lines)
+
+    def test_series_carry_the_pid_of_the_worker(self):
+        metrics = MetricsService(worker_label=True)
+        metrics.increment(RECORDS_EMITTED, 3, stream="cerv2")
+        metrics.increment(ACTIVE_REQUESTS)
+        lines = metrics.render().splitlines()
+
+        self.assertIn(f'netcdf_records_emitted_total{{stream="cerv2",pid="{os.getpid()}"}} 3', lines)
+        self.assertIn(f'netcdf_active_requests{{pid="{os.getpid()}"}} 1', lines)
+
+    def test_measured_body_counts_encoded_bytes(self):
+        body = MeasuredBody(["{\"name\": \"\u00e4\"}", b"\n"], time.perf_counter(), {"endpoint": "/", "status": "200"})
+        list(body)
+        self.assertEqual(body.size, 15)
+
+    def test_label_values_are_escaped(self):
+        metrics = MetricsService()
+        metrics.increment(RECORDS_EMITTED, stream='a"b\\c')
+        self.assertIn('{stream="a\\"b\\\\c"}', metrics.render())
+
+    def test_phases_are_collected_for_the_current_request(self):
+        metrics = MetricsService()
+        token = request_phases.set(None)
+        try:
+            phases = metrics.start_request()
+            with metrics.phase("open"):
+                pass
+            with metrics.phase("open"):
+                pass
+            self.assertEqual(list(phases), ["open"])
+            self.assertIn("netcdf_phase_seconds_count{phase=\"open\"} 2", metrics.render())
+        finally:
+            request_phases.reset(token)
+
+    def test_measure_stream_excludes_consumer_time(self):
+        metrics = MetricsService()
+        token = request_phases.set(None)
+        try:
+            phases = metrics.start_request()
+            items = []
+            for item in metrics.measure_stream("serialize", iter([1, 2, 3])):
+                items.append(item)
+            self.assertEqual(items, [1, 2, 3])
+            self.assertLess(phases["serialize"], 0.1)
+            self.assertIn('netcdf_phase_seconds_count{phase="serialize"} 1', metrics.render())
+        finally:
+            request_phases.reset(token)
+
+    def test_disabled_service_records_nothing(self):
+        metrics = MetricsService(enabled=False)
+        metrics.increment(RECORDS_EMITTED, stream="cerv2")
+        with metrics.phase("open"):
+            pass
+        self.assertEqual(list(metrics.measure_stream("serialize", [1])), [1])
+        self.assertNotIn("netcdf_records_emitted_total{", metrics.render())
+        self.assertNotIn("netcdf_phase_seconds_count", metrics.render())
+
+    def test_format_server_timing(self):
+        self.assertEqual(
+            format_server_timing({"upload": 0.0123, "open": 0.002}, 0.02),
+            "upload;dur=12.3, open;dur=2.0, app;dur=20.0",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import simplejson
+from app.errors.errors import IncompleteHeaderError
+from app.services.data_processing_service import DataProcessingService, build_metadata
+from app.services.json_encoder import custom_encoder
+from app.services.netcdf_header import iter_multipart_file, parse_classic_header
+from netCDF4 import Dataset
+
+BOUNDARY = "test-boundary"
+
+
+def create_netcdf_content(file_path, file_format):
+    with Dataset(file_path, "w", format=file_format) as dataset:
+        dataset.title = "header test"
+        dataset.version = np.int32(3)
+        dataset.createDimension("time", None)
+        dataset.createDimension("south_north", 3)
+        dataset.createDimension("west_east", 4)
+        temperature = dataset.createVariable(
+            "T", np.float32, ("time", "south_north", "west_east")
+        )
+        temperature.units = "K"
+        temperature.valid_range = np.array([0, 400], dtype=np.float32)
+        temperature[0:2] = np.ones((2, 3, 4))
+        dataset.createVariable("name", "S1", ("west_east",))
+        dataset.createVariable("level", np.int16, ("south_north",))
+    with open(file_path, "rb") as file:
+        return file.read()
+
+
+def create_multipart_body(content, field_name="file"):
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="note"\r\n\r\n'
+        f"--{BOUNDARY} is not a delimiter\r\n"
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field_name}"; filename="test.nc"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def normalize(data):
+    return simplejson.loads(simplejson.dumps(data, default=custom_encoder))
+
+
+class TestClassicHeader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "header.nc")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_header_matches_netcdf4_metadata(self):
+        for file_format in ("NETCDF3_CLASSIC", "NETCDF3_64BIT_OFFSET"):
+            for details in (False, True):
+                with self.subTest(file_format=file_format, details=details):
+                    content = create_netcdf_content(self.file_path, file_format)
+                    with Dataset(self.file_path) as dataset:
+                        expected = build_metadata(dataset, details)
+                    self.assertEqual(
+                        normalize(parse_classic_header(content, details)),
+                        normalize(expected),
+                    )
+
+    def test_truncated_header(self):
+        content = create_netcdf_content(self.file_path, "NETCDF3_CLASSIC")
+        with self.assertRaises(IncompleteHeaderError):
+            parse_classic_header(content[:40])
+
+    def test_multipart_file_is_read_incrementally(self):
+        content = create_netcdf_content(self.file_path, "NETCDF3_CLASSIC")
+        body = create_multipart_body(content)
+        self.assertEqual(b"".join(iter_multipart_file(io.BytesIO(body), BOUNDARY)), content)
+
+    def test_header_only_metadata_stops_reading_early(self):
+        content = create_netcdf_content(self.file_path, "NETCDF3_CLASSIC")
+        # large data after the header, which is not needed for the metadata
+        content += b"\0" * (1024 * 1024)
+        stream = io.BytesIO(create_multipart_body(content))
+        service = DataProcessingService()
+
+        generator = service.convert_netcdf_header_to_json(stream, BOUNDARY, len(content))
+        metadata = simplejson.loads(next(generator))
+        self.assertEqual(metadata["dimensions"], {"time": 2, "south_north": 3, "west_east": 4})
+        self.assertLess(stream.tell(), len(content))
+
+        # the rest of the body is discarded afterwards
+        list(generator)
+        self.assertEqual(stream.tell(), len(stream.getvalue()))
+
+    def test_header_only_metadata_of_netcdf4_file(self):
+        content = create_netcdf_content(self.file_path, "NETCDF4")
+        stream = io.BytesIO(create_multipart_body(content))
+        service = DataProcessingService()
+
+        generator = service.convert_netcdf_header_to_json(stream, BOUNDARY, len(content), True)
+        metadata = simplejson.loads("".join(generator))
+        self.assertEqual(metadata["variables_metadata"]["T"]["shape"], [2, 3, 4])
+        self.assertEqual(metadata["variables_metadata"]["T"]["dtype"], "float32")
+        self.assertEqual(metadata["global_attributes"]["title"], "header test")
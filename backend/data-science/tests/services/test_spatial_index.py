@@ -0,0 +1,68 @@
+import unittest
+
+import numpy as np
+from app.errors.errors import InvalidSelectionError
+from app.services.spatial_index import SpatialIndex
+
+
+def brute_force_ranges(inside):
+    rows = np.flatnonzero(inside.any(axis=1))
+    columns = np.flatnonzero(inside.any(axis=0))
+    return [int(rows[0]), int(rows[-1]) + 1], [int(columns[0]), int(columns[-1]) + 1]
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        # a rectilinear grid ordered west_east, south_north with descending latitudes
+        lon_axis = np.linspace(10, 15, 11)
+        lat_axis = np.linspace(55, 50, 21)
+        self.lon, self.lat = np.meshgrid(lon_axis, lat_axis, indexing="ij")
+        # a rotated (curvilinear) grid
+        x, y = np.meshgrid(np.arange(70), np.arange(50), indexing="ij")
+        angle = np.deg2rad(30)
+        self.curved_lon = 10 + 0.1 * (x * np.cos(angle) - y * np.sin(angle))
+        self.curved_lat = 50 + 0.1 * (x * np.sin(angle) + y * np.cos(angle))
+
+    def test_rectilinear_bbox(self):
+        index = SpatialIndex(self.lon, self.lat)
+        self.assertTrue(index.rectilinear)
+        # longitudes 11.0 to 12.5, latitudes 52.0 to 53.0
+        self.assertEqual(index.resolve_bbox(["11", "52", "12.5", "53"]), ([2, 6], [8, 13]))
+
+    def test_curvilinear_bbox_matches_brute_force(self):
+        index = SpatialIndex(self.curved_lon, self.curved_lat, block_size=8)
+        self.assertFalse(index.rectilinear)
+        bbox = [11, 52, 12, 53.5]
+        inside = (
+            (self.curved_lon >= 11)
+            & (self.curved_lon <= 12)
+            & (self.curved_lat >= 52)
+            & (self.curved_lat <= 53.5)
+        )
+        self.assertEqual(list(index.resolve_bbox(bbox)), list(brute_force_ranges(inside)))
+
+    def test_polygon(self):
+        # the vertices are off the grid, so no cell is on an edge
+        triangle = [[11.05, 51.05], [13.05, 51.05], [11.05, 53.05]]
+        for lon, lat in ((self.lon, self.lat), (self.curved_lon, self.curved_lat)):
+            with self.subTest(rectilinear=lon is self.lon):
+                index = SpatialIndex(lon, lat, block_size=8)
+                # the even-odd rule, computed cell by cell
+                inside = np.zeros(lon.shape, dtype=bool)
+                for i, j in np.ndindex(lon.shape):
+                    x, y = lon[i, j], lat[i, j]
+                    inside[i, j] = x > 11.05 and y > 51.05 and (x - 11.05) + (y - 51.05) < 2
+                self.assertEqual(
+                    list(index.resolve_polygon(triangle)), list(brute_force_ranges(inside))
+                )
+
+    def test_empty_and_invalid_selections(self):
+        index = SpatialIndex(self.curved_lon, self.curved_lat)
+        with self.assertRaises(InvalidSelectionError):
+            index.resolve_bbox([0, 0, 1, 1])
+        with self.assertRaises(InvalidSelectionError):
+            index.resolve_bbox([0, 0, 1])
+        with self.assertRaises(InvalidSelectionError):
+            index.resolve_polygon([[11, 51], [12, 52]])
+        with self.assertRaises(InvalidSelectionError):
+            SpatialIndex(self.lon, self.lat).resolve_bbox([20, 52, 21, 53])
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+from app.services.statistics import RunningStatistics, coarsen_histogram
+
+
+class TestRunningStatistics(unittest.TestCase):
+    def setUp(self):
+        self.values = np.random.default_rng(0).normal(10, 3, 10000)
+
+    def summarize(self, blocks, **kwargs):
+        statistics = RunningStatistics(**kwargs)
+        for block in blocks:
+            statistics.update(block)
+        return statistics
+
+    def test_moments_are_exact_for_any_blocks(self):
+        for count in (1, 7, 100):
+            result = self.summarize(np.array_split(self.values, count)).to_dict()
+            self.assertEqual(result["count"], self.values.size)
+            self.assertEqual(result["min"], self.values.min())
+            self.assertEqual(result["max"], self.values.max())
+            self.assertAlmostEqual(result["mean"], self.values.mean(), places=10)
+            self.assertAlmostEqual(result["std"], self.values.std(), places=10)
+
+    def test_percentiles_are_accurate_within_a_bin(self):
+        statistics = self.summarize(np.array_split(self.values, 13))
+        for q in (1, 25, 50, 75, 99):
+            self.assertLessEqual(
+                abs(statistics.percentile(q) - np.percentile(self.values, q)),
+                statistics.width,
+            )
+        self.assertEqual(statistics.percentile(0), self.values.min())
+        self.assertEqual(statistics.percentile(100), self.values.max())
+
+    def test_bins_are_bounded_when_the_range_grows(self):
+        statistics = self.summarize([np.arange(10.0), np.array([1e6, -1e6])], resolution=64)
+        self.assertLessEqual(statistics.counts.size, 64)
+        self.assertEqual(statistics.counts.sum(), 12)
+        self.assertEqual(np.log2(statistics.width) % 1, 0)
+
+    def test_histogram(self):
+        histogram = self.summarize([self.values]).histogram(bins=8)
+        self.assertLessEqual(len(histogram["counts"]), 8)
+        self.assertEqual(len(histogram["edges"]), len(histogram["counts"]) + 1)
+        self.assertEqual(sum(histogram["counts"]), self.values.size)
+        self.assertLessEqual(histogram["edges"][0], self.values.min())
+        self.assertGreater(histogram["edges"][-1], self.values.max())
+        expected, _ = np.histogram(self.values, histogram["edges"])
+        self.assertEqual(histogram["counts"], expected.tolist())
+
+    def test_masked_and_non_finite_values_are_missing(self):
+        block = np.ma.masked_array([1.0, 2.0, np.nan, np.inf, -9999.0], mask=[0, 0, 0, 0, 1])
+        result = self.summarize([block]).to_dict(percentiles=[50])
+        self.assertEqual((result["count"], result["missing"]), (2, 3))
+        self.assertEqual((result["min"], result["max"], result["mean"]), (1.0, 2.0, 1.5))
+
+    def test_no_values(self):
+        result = self.summarize([np.array([np.nan])]).to_dict(percentiles=[50])
+        self.assertEqual(result["count"], 0)
+        self.assertIsNone(result["mean"])
+        self.assertEqual(result["percentiles"], {"p50": None})
+        self.assertEqual(result["histogram"], {"edges": [], "counts": []})
+
+    def test_coarsen_histogram_merges_aligned_bins(self):
+        width, first_bin, counts = coarsen_histogram(0.5, -3, np.array([1, 2, 3, 4]))
+        # bins -3 .. 0 become bins -2 (-3) and -1 (-2, -1) and 0 (0)
+        self.assertEqual((width, first_bin, counts.tolist()), (1.0, -2, [1, 5, 4]))
+
+
+if __name__ == "__main__":
+    unittest.main()
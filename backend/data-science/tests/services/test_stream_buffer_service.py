@@ -0,0 +1,142 @@
+import threading
+import time
+import unittest
+
+from app.services.stream_buffer_service import (
+    BufferedStream,
+    InterleavedStream,
+    StreamBufferService,
+)
+
+
+class TestStreamBufferService(unittest.TestCase):
+    def test_buffered_stream_yields_all_chunks_in_order(self):
+        service = StreamBufferService(max_chunks=2)
+        self.assertEqual(list(service.buffer(iter(range(100)))), list(range(100)))
+
+    def test_buffering_can_be_disabled(self):
+        service = StreamBufferService(max_chunks=0)
+        stream = iter([1, 2])
+        self.assertIs(service.buffer(stream), stream)
+
+    def test_producer_is_blocked_by_a_slow_consumer(self):
+        produced = []
+
+        def stream():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        buffered = BufferedStream(stream(), max_chunks=3)
+        self.assertEqual(next(buffered), 0)
+        time.sleep(0.1)
+        # the chunk taken, the full buffer and the chunk waiting to be put
+        self.assertLessEqual(len(produced), 5)
+        buffered.close()
+
+    def test_errors_are_raised_to_the_consumer(self):
+        def stream():
+            yield 1
+            raise ValueError("broken")
+
+        buffered = BufferedStream(stream(), max_chunks=2)
+        self.assertEqual(next(buffered), 1)
+        with self.assertRaisesRegex(ValueError, "broken"):
+            next(buffered)
+        self.assertFalse(buffered.thread.is_alive())
+
+    def test_close_stops_the_producer_and_closes_the_stream(self):
+        closed = threading.Event()
+
+        def stream():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                closed.set()
+
+        buffered = BufferedStream(stream(), max_chunks=2)
+        self.assertEqual(next(buffered), 0)
+        buffered.close()
+        self.assertTrue(closed.is_set())
+        self.assertFalse(buffered.thread.is_alive())
+        self.assertEqual(list(buffered), [])
+
+    def test_close_before_the_first_chunk_closes_the_stream(self):
+        closed = []
+
+        class Stream:
+            def __iter__(self):
+                return iter([1])
+
+            def close(self):
+                closed.append(True)
+
+        buffered = BufferedStream(Stream(), max_chunks=2)
+        buffered.close()
+        self.assertEqual(closed, [True])
+        self.assertIsNone(buffered.thread)
+
+
+class TestInterleavedStream(unittest.TestCase):
+    def test_all_chunks_keep_their_order_per_stream(self):
+        streams = [[(name, i) for i in range(50)] for name in "abcde"]
+        chunks = list(StreamBufferService(max_chunks=2).interleave(streams, 3))
+        self.assertEqual(len(chunks), 250)
+        for name in "abcde":
+            self.assertEqual([i for n, i in chunks if n == name], list(range(50)))
+
+    def test_at_most_concurrency_streams_are_open(self):
+        lock = threading.Lock()
+        open_streams = []
+        peak = []
+
+        def stream(name):
+            with lock:
+                open_streams.append(name)
+                peak.append(len(open_streams))
+            try:
+                for i in range(3):
+                    time.sleep(0.01)
+                    yield i
+            finally:
+                with lock:
+                    open_streams.remove(name)
+
+        chunks = list(InterleavedStream((stream(n) for n in range(6)), 2, 4))
+        self.assertEqual(len(chunks), 18)
+        self.assertEqual(max(peak), 2)
+
+    def test_errors_are_raised_to_the_consumer(self):
+        def broken():
+            yield 1
+            raise ValueError("broken")
+
+        interleaved = InterleavedStream([broken()], 2, 2)
+        self.assertEqual(next(interleaved), 1)
+        with self.assertRaisesRegex(ValueError, "broken"):
+            next(interleaved)
+        self.assertFalse(any(thread.is_alive() for thread in interleaved.threads))
+
+    def test_close_stops_the_producers_and_closes_the_streams(self):
+        closed = []
+
+        def endless(name):
+            try:
+                while True:
+                    yield name
+            finally:
+                closed.append(name)
+
+        interleaved = InterleavedStream([endless("a"), endless("b"), endless("c")], 2, 2)
+        next(interleaved)
+        interleaved.close()
+        self.assertEqual(sorted(closed), ["a", "b"])
+        self.assertFalse(any(thread.is_alive() for thread in interleaved.threads))
+        self.assertEqual(list(interleaved), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import gzip
+import unittest
+import zlib
+
+from app.services import stream_compression
+from app.services.stream_compression import (
+    GZIP,
+    ZSTD,
+    StreamCompressor,
+    compress_stream,
+    negotiate_encoding,
+)
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+
+class TestStreamCompression(unittest.TestCase):
+    def setUp(self):
+        self.chunks = ['{"x": 0}||*split*||' * 100, b'{"x": "\xc3\xa4"}', "", '{"x": 2}']
+
+    def test_gzip_round_trip(self):
+        compressed = b"".join(compress_stream(self.chunks, GZIP))
+        expected = b"".join(c.encode() if isinstance(c, str) else c for c in self.chunks)
+        self.assertEqual(gzip.decompress(compressed), expected)
+
+    def test_every_chunk_can_be_decompressed_when_it_is_received(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        compressor = StreamCompressor(GZIP, 9)
+        for chunk in ["[1, 2, 3]", "[4, 5, 6]"]:
+            self.assertEqual(decompressor.decompress(compressor.compress(chunk)), chunk.encode())
+        decompressor.decompress(compressor.finish())
+        self.assertTrue(decompressor.eof)
+
+    def test_empty_chunks_are_skipped(self):
+        self.assertEqual(StreamCompressor(GZIP).compress(""), b"")
+        self.assertEqual(gzip.decompress(b"".join(compress_stream([], GZIP))), b"")
+
+    def test_negotiation(self):
+        def negotiate(header, encodings=(ZSTD, GZIP)):
+            return negotiate_encoding(parse_accept_header(header, Accept), list(encodings))
+
+        self.assertEqual(negotiate("gzip, deflate, br"), GZIP)
+        self.assertEqual(negotiate("gzip, zstd"), ZSTD)
+        self.assertEqual(negotiate("zstd;q=0.5, gzip"), GZIP)
+        self.assertEqual(negotiate("gzip, zstd", [GZIP]), GZIP)
+        self.assertEqual(negotiate("*"), ZSTD)
+        self.assertIsNone(negotiate("identity"))
+        self.assertIsNone(negotiate(""))
+
+    def test_unsupported_coding(self):
+        with self.assertRaises(ValueError):
+            StreamCompressor("br")
+        if stream_compression.zstandard is None:
+            with self.assertRaises(ValueError):
+                StreamCompressor(ZSTD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from app.services.stream_framing import (
+    coalesce_writes,
+    frame_records,
+    iter_framed_records,
+)
+
+
+class TestStreamFraming(unittest.TestCase):
+    def setUp(self):
+        # the second record contains the sentinel and a newline inside a string
+        self.records = ['{"x": 0}', '{"name": "a||*split*||b\\nc"}', '{"x": "\u00e4"}']
+
+    def test_round_trip(self):
+        for framing in ("ndjson", "length-prefixed"):
+            with self.subTest(framing=framing):
+                framed = frame_records(self.records, framing)
+                self.assertEqual(list(iter_framed_records(framed, framing)), self.records)
+
+    def test_sentinel_framing_is_unchanged(self):
+        self.assertEqual(
+            frame_records(['{"x": 0}', '{"x": 1}']),
+            '{"x": 0}||*split*||{"x": 1}||*split*||',
+        )
+
+    def test_length_prefixed_framing(self):
+        # the length counts the bytes of the UTF-8 encoding, not the characters
+        framed = frame_records(['{"x": "\u00e4"}', "{}"], "length-prefixed")
+        self.assertEqual(framed, b'\x00\x00\x00\x0b{"x": "\xc3\xa4"}\x00\x00\x00\x02{}')
+
+    def test_unknown_framing(self):
+        with self.assertRaises(ValueError):
+            frame_records(self.records, "xml")
+
+    def test_coalesce_writes(self):
+        self.assertEqual(list(coalesce_writes(["ab", "c", "de", "f"], 3)), ["abc", "def"])
+        self.assertEqual(list(coalesce_writes([b"ab", b"c", b"d"], 3)), [b"abc", b"d"])
+        self.assertEqual(list(coalesce_writes([], 3)), [])
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+from app.services.tile_pyramid import count_levels, iter_tiles
+
+
+class TestTilePyramid(unittest.TestCase):
+    def setUp(self):
+        # a 5 x 4 grid, ordered west_east, south_north
+        self.temp = np.arange(20, dtype=np.float64).reshape(5, 4)
+        self.series = np.arange(40, dtype=np.float64).reshape(5, 4, 2)
+        self.lon = np.repeat(np.arange(5, dtype=np.float32)[:, None], 4, axis=1)
+        self.lat = np.repeat(np.arange(4, dtype=np.float32)[None, :], 5, axis=0) + 50
+
+    def test_count_levels(self):
+        self.assertEqual(count_levels((5, 4), 2), 3)
+        self.assertEqual(count_levels((2, 2), 2), 1)
+        self.assertEqual(count_levels((1000, 10), 64), 5)
+        self.assertEqual(count_levels((1000, 10), 64, max_levels=2), 2)
+
+    def test_tiles_of_all_levels(self):
+        tiles = list(
+            iter_tiles([("temp", self.temp)], [("series", self.series)], self.lon, self.lat, tile_size=2)
+        )
+        self.assertEqual([tile["level"] for tile in tiles], [2] + [1] * 2 + [0] * 6)
+
+        root = tiles[0]
+        self.assertEqual((root["x_range"], root["y_range"]), ([0, 5], [0, 4]))
+        self.assertEqual(root["bbox"], [0, 50, 4, 53])
+        np.testing.assert_allclose(
+            root["vars"]["temp"],
+            [[self.temp[0:4, 0:4].mean()], [self.temp[4:5, 0:4].mean()]],
+        )
+        self.assertEqual(root["timeVars"]["series"].shape, (2, 1, 2))
+
+        finest = [tile for tile in tiles if tile["level"] == 0]
+        last = finest[-1]
+        self.assertEqual((last["tx"], last["ty"]), (2, 1))
+        self.assertEqual((last["x_range"], last["y_range"]), ([4, 5], [2, 4]))
+        self.assertEqual(last["bbox"], [4, 52, 4, 53])
+        np.testing.assert_array_equal(last["vars"]["temp"], self.temp[4:5, 2:4])
+
+    def test_coordinates_with_finer_resolution(self):
+        tiles = list(
+            iter_tiles([("temp", self.temp[::2, ::2])], [], self.lon, self.lat, tile_size=2, coordinate_step=2)
+        )
+        self.assertEqual(tiles[0]["bbox"], [0, 50, 4, 53])
+
+    def test_without_coordinates(self):
+        tiles = list(iter_tiles([("temp", self.temp)], [], tile_size=8))
+        self.assertEqual(len(tiles), 1)
+        self.assertIsNone(tiles[0]["bbox"])
@@ -0,0 +1,82 @@
+import unittest
+
+from app.errors.errors import ServiceBusyError
+from app.services.worker_pool_service import WorkerPoolService
+
+
+def square(value):
+    return value * value
+
+
+class TestWorkerPoolService(unittest.TestCase):
+    def test_imap_without_processes_runs_inline(self):
+        pool = WorkerPoolService(processes=0)
+        self.assertEqual(list(pool.imap(square, range(5))), [0, 1, 4, 9, 16])
+        self.assertIsNone(pool.executor)
+
+    def test_imap_keeps_order_of_items(self):
+        pool = WorkerPoolService(processes=2, max_pending=3)
+        try:
+            self.assertEqual(list(pool.imap(square, range(20))), [i * i for i in range(20)])
+        finally:
+            pool.shutdown()
+
+    def test_worker_processes_are_not_forked(self):
+        pool = WorkerPoolService(processes=1)
+        try:
+            self.assertEqual(list(pool.imap(square, [3])), [9])
+            self.assertEqual(pool.executor._mp_context.get_start_method(), "forkserver")
+        finally:
+            pool.shutdown()
+
+    def test_imap_consumes_items_lazily(self):
+        pool = WorkerPoolService(processes=1, max_pending=2)
+        consumed = []
+
+        def items():
+            for i in range(10):
+                consumed.append(i)
+                yield i
+
+        try:
+            results = pool.imap(square, items())
+            self.assertEqual(next(results), 0)
+            self.assertEqual(consumed, [0, 1])
+            results.close()
+        finally:
+            pool.shutdown()
+
+    def test_admit_rejects_when_saturated(self):
+        pool = WorkerPoolService(max_concurrent_requests=1)
+        stream = pool.admit(iter(["a", "b"]))
+        with self.assertRaises(ServiceBusyError):
+            pool.admit(iter([]))
+
+        self.assertEqual(list(stream), ["a", "b"])
+        self.assertEqual(pool.active_requests, 0)
+        pool.admit(iter([]))
+
+    def test_closing_a_stream_releases_it_once(self):
+        pool = WorkerPoolService(max_concurrent_requests=1)
+        stream = pool.admit(iter(["a", "b"]))
+        self.assertEqual(next(stream), "a")
+        stream.close()
+        stream.close()
+        self.assertEqual(pool.active_requests, 0)
+
+    def test_admit_reserves_several_slots(self):
+        pool = WorkerPoolService(max_concurrent_requests=4)
+        first = pool.admit(iter([]), 3)
+        with self.assertRaises(ServiceBusyError):
+            pool.admit(iter([]), 2)
+        self.assertEqual(pool.active_requests, 3)
+        pool.admit(iter([]))
+        first.close()
+        self.assertEqual(pool.active_requests, 1)
+        self.assertEqual(pool.get_max_slots(8), 4)
+        self.assertEqual(pool.get_max_slots(0), 1)
+
+    def test_unlimited_concurrent_requests(self):
+        pool = WorkerPoolService(max_concurrent_requests=0)
+        streams = [pool.admit(iter([])) for _ in range(10)]
+        self.assertEqual(pool.active_requests, 10)
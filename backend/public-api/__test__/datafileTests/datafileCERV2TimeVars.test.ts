@@ -0,0 +1,19 @@
+import { expect, describe, it } from "@jest/globals";
+import { toIndexedTimeVars } from "../../src/services/datafile/datafileCERV2.service";
+
+describe("Checks if CERV2 time variables are stored indexed by time", () => {
+  it("Should group the values of all time variables per time index", () => {
+    expect(toIndexedTimeVars({ temp: [1, 2], rain: [0.5, 0] })).toEqual({
+      0: { temp: 1, rain: 0.5 },
+      1: { temp: 2, rain: 0 },
+    });
+  });
+
+  it("Should pad shorter time series with null", () => {
+    expect(toIndexedTimeVars({ temp: [1, 2], rain: [0.5] })).toEqual({
+      0: { temp: 1, rain: 0.5 },
+      1: { temp: 2, rain: null },
+    });
+    expect(toIndexedTimeVars({})).toEqual({});
+  });
+});
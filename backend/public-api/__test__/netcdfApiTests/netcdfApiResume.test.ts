@@ -0,0 +1,80 @@
+import { expect, describe, it, afterEach, jest } from "@jest/globals";
+import axios, { AxiosError } from "axios";
+import { Readable } from "stream";
+import NetcdfApi from "../../src/services/netcdfApi.service";
+
+// Header of a CERv2 stream in the compact schema with one time variable
+const header = {
+  header: {
+    fields: ["seq", "lon", "temp"],
+    vars: 1,
+    dimensions: { south_north: 2, west_east: 2 },
+  },
+};
+
+// Returns a response streaming the header and the given records as NDJSON lines
+function recordsResponse(seqs: number[], broken: boolean) {
+  const lines = [header, ...seqs.map((seq) => [seq, seq * 10, [seq]])];
+  const data = Readable.from(
+    (async function* () {
+      for (const line of lines) {
+        yield Buffer.from(JSON.stringify(line) + "\n");
+      }
+      if (broken) {
+        throw new Error("aborted");
+      }
+    })()
+  );
+  return { data } as any;
+}
+
+// Returns the error of a request the remote service was too busy for
+function busyError() {
+  return new AxiosError("busy", "ERR_BAD_REQUEST", undefined, undefined, {
+    status: 429,
+    headers: { "retry-after": "0" },
+  } as any);
+}
+
+describe("Checks if the CERv2 data chunks stream is resumed", () => {
+  afterEach(() => {
+    jest.restoreAllMocks();
+  });
+
+  it("Should resume after the last record when the service is busy", async () => {
+    const post = jest
+      .spyOn(axios, "post")
+      .mockResolvedValueOnce(recordsResponse([0, 1], true))
+      .mockRejectedValueOnce(busyError())
+      .mockResolvedValueOnce(recordsResponse([2, 3], false));
+
+    const seqs: number[] = [];
+    for await (const record of NetcdfApi.getCERv2DataChunks("handle")) {
+      seqs.push(record.seq);
+    }
+
+    expect(seqs).toEqual([0, 1, 2, 3]);
+    expect(post).toHaveBeenCalledTimes(3);
+    const starts = post.mock.calls.map((call) =>
+      (call[1] as FormData).get("start")
+    );
+    expect(starts).toEqual(["0", "2", "2"]);
+  });
+
+  it("Should fail fast when the request is rejected", async () => {
+    const post = jest
+      .spyOn(axios, "post")
+      .mockRejectedValueOnce(
+        new AxiosError("bad", "ERR_BAD_REQUEST", undefined, undefined, {
+          status: 400,
+          headers: {},
+        } as any)
+      );
+
+    const records = NetcdfApi.getCERv2DataChunks("handle");
+    await expect(records.next()).rejects.toThrow(
+      "Failed to parse the provided NetCDF file."
+    );
+    expect(post).toHaveBeenCalledTimes(1);
+  });
+});
@@ -181,10 +181,17 @@ export default class DatafileService extends CrudService<
         break;
       }
       case SupportedRawFileTypes.NETCDF: {
-        // get netcdf metadata
-        const metadata = await NetcdfApi.getMetaData(file);
-        // get netcdf large data
-        largeFileData = await NetcdfApi.getFileData(file);
+        // upload the file once and refer to it by its handle
+        const handle = await NetcdfApi.uploadDataset(file);
+        let metadata;
+        try {
+          // get netcdf metadata
+          metadata = await NetcdfApi.getMetaData(handle);
+          // get netcdf large data
+          largeFileData = await NetcdfApi.getFileData(handle);
+        } finally {
+          await NetcdfApi.deleteDataset(handle);
+        }
 
         // upload raw data to bucket
         const dataId = await this.netCDFbucketService.uploadFile(
@@ -26,27 +26,35 @@ export async function handleCERV2File(
 ) {
   const uploadId = uuidv4();
 
-  // Retrieve metadata from the NetCDF file
-  const metadata = await NetcdfApi.getMetaData(file);
+  // Upload the NetCDF file once and refer to it by its handle
+  const handle = await NetcdfApi.uploadDataset(file);
 
-  // Get variable names with location data
-  const locationVariableNames = getVariablesNamesWithLocationData(metadata);
+  try {
+    // Retrieve metadata from the NetCDF file
+    const metadata = await NetcdfApi.getMetaData(handle);
 
-  // Split and trim tags
-  const tagList = tags.split(",").map((tag) => tag.trim());
+    // Get variable names with location data
+    const locationVariableNames = getVariablesNamesWithLocationData(metadata);
 
-  console.log("Adding data to data files");
-  for await (const datafile of createDatafiles(
-    file,
-    metadata,
-    locationVariableNames,
-    stepSize,
-    tagList,
-    uploadId,
-    description
-  )) {
-    // Create and store datafiles in the database
-    await datafileModel.create(datafile);
+    // Split and trim tags
+    const tagList = tags.split(",").map((tag) => tag.trim());
+
+    console.log("Adding data to data files");
+    for await (const datafile of createDatafiles(
+      file,
+      handle,
+      metadata,
+      locationVariableNames,
+      stepSize,
+      tagList,
+      uploadId,
+      description
+    )) {
+      // Create and store datafiles in the database
+      await datafileModel.create(datafile);
+    }
+  } finally {
+    await NetcdfApi.deleteDataset(handle);
   }
 }
 
@@ -54,6 +62,7 @@ export async function handleCERV2File(
  * Generates datafiles based on the CERV2 dataset file.
  *
  * @param file - The CERV2 dataset file to generate datafiles from.
+ * @param handle - The handle of the file in the dataset cache of the data science service.
  * @param metadata - Metadata extracted from the NetCDF file.
  * @param locationVariableNames - List of variable names containing location data.
  * @param stepSize - The sampling interval (sample every Nth data point)
@@ -64,6 +73,7 @@ export async function handleCERV2File(
  */
 async function* createDatafiles(
   file: Express.Multer.File,
+  handle: string,
   metadata: any,
   locationVariableNames: string[],
   stepSize: number,
@@ -71,7 +81,7 @@ async function* createDatafiles(
   uploadID: string,
   description?: string
 ) {
-  const cerv2_var_gen = await NetcdfApi.getCERv2DataChunks(file, {
+  const cerv2_var_gen = await NetcdfApi.getCERv2DataChunks(handle, {
     filter: locationVariableNames,
     stepSize,
   });
@@ -98,7 +108,8 @@ async function* createDatafiles(
         data: {
           netCDFInfo: metadata,
           vars: remainingVars,
-          timeVars: data["timeVars"],
+          // The records are received in the compact schema, but stored indexed by time
+          timeVars: toIndexedTimeVars(data["timeVars"]),
         },
         location: {
           type: "Point",
@@ -111,6 +122,31 @@ async function* createDatafiles(
   }
 }
 
+/**
+ * Converts the time variables of a compact CERV2 record, an array of values per time variable,
+ * to the stored layout with the values of all time variables per time index.
+ *
+ * @param timeVars - The array of values of every time variable.
+ * @returns {Record<number, Record<string, any>>} - The values of the time variables per time index,
+ * shorter time series are padded with null.
+ */
+export function toIndexedTimeVars(
+  timeVars: Record<string, any[]>
+): Record<number, Record<string, any>> {
+  const steps = Math.max(
+    0,
+    ...Object.values(timeVars).map((values) => values.length)
+  );
+  const indexedTimeVars: Record<number, Record<string, any>> = {};
+  for (let t = 0; t < steps; t++) {
+    indexedTimeVars[t] = {};
+    for (const [name, values] of Object.entries(timeVars)) {
+      indexedTimeVars[t][name] = values[t] ?? null;
+    }
+  }
+  return indexedTimeVars;
+}
+
 /**
  * Retrieves variable names with location data from the metadata.
  *
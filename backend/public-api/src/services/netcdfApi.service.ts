@@ -14,23 +14,63 @@ export default abstract class NetcdfApi {
     config.DATASCIENCE_BASE_URL + "/convert-netcdf-to-json";
 
   /**
-   * Retrieves metadata for a given NetCDF file.
+   * The number of times a broken CERv2 stream is resumed without receiving a record.
+   */
+  static readonly MAX_RESUME_ATTEMPTS = 3;
+
+  /**
+   * Uploads a NetCDF file once into the dataset cache of the remote service.
+   * The returned handle is used to request metadata and data without uploading the file again.
    *
-   * @param netCDFFile - The NetCDF file to extract metadata from.
-   * @returns A Promise that resolves to the extracted metadata.
+   * @param netCDFFile - The NetCDF file to upload.
+   * @returns A Promise that resolves to the handle of the cached dataset.
    * @throws FailedToParseError if there's an issue parsing the NetCDF file or processing the request.
    */
-  static async getMetaData(netCDFFile: Express.Multer.File): Promise<any> {
+  static async uploadDataset(netCDFFile: Express.Multer.File): Promise<string> {
     try {
-      const url = this.netCdf_endpoint + "/metadata";
+      const url = this.netCdf_endpoint + "/datasets";
 
       // Create form data
       const formData = new FormData();
       const blob = new Blob([netCDFFile.buffer], { type: netCDFFile.mimetype });
       formData.append("file", blob, netCDFFile.originalname);
 
-      // Post form data and receive response stream
-      const response = await axios.post(url, formData, {
+      const response = await axios.post(url, formData);
+      return response.data.handle;
+    } catch (error) {
+      throw new FailedToParseError(
+        `Failed to parse the provided NetCDF file. ${error}`
+      );
+    }
+  }
+
+  /**
+   * Removes a dataset from the dataset cache of the remote service.
+   *
+   * @param handle - The handle of the cached dataset.
+   */
+  static async deleteDataset(handle: string): Promise<void> {
+    try {
+      await axios.delete(this.netCdf_endpoint + "/datasets/" + handle);
+    } catch (error) {
+      // The dataset is evicted by the remote service eventually
+      console.log(error);
+    }
+  }
+
+  /**
+   * Retrieves metadata for a given NetCDF file.
+   *
+   * @param handle - The handle of the cached NetCDF file to extract metadata from.
+   * @returns A Promise that resolves to the extracted metadata.
+   * @throws FailedToParseError if there's an issue parsing the NetCDF file or processing the request.
+   */
+  static async getMetaData(handle: string): Promise<any> {
+    try {
+      const url = this.netCdf_endpoint + "/datasets/" + handle + "/metadata";
+
+      // Receive response stream
+      const response = await axios.get(url, {
         responseType: "stream",
       });
 
@@ -51,21 +91,16 @@ export default abstract class NetcdfApi {
   /**
    * Retrieves data from a given NetCDF file.
    *
-   * @param file - The NetCDF file to retrieve data from.
+   * @param handle - The handle of the cached NetCDF file to retrieve data from.
    * @returns A Promise that resolves to the retrieved data.
    * @throws FailedToParseError if there's an issue parsing the NetCDF file or processing the request.
    */
-  static async getFileData(file: Express.Multer.File): Promise<any> {
+  static async getFileData(handle: string): Promise<any> {
     try {
-      const url = this.netCdf_endpoint + "/data";
+      const url = this.netCdf_endpoint + "/datasets/" + handle + "/data";
 
-      // Create form data
-      const formData = new FormData();
-      const blob = new Blob([file.buffer], { type: file.mimetype });
-      formData.append("file", blob, file.originalname);
-
-      // Post form data and receive response stream
-      const response = await axios.post(url, formData, {
+      // Receive response stream
+      const response = await axios.get(url, {
         responseType: "stream",
       });
 
@@ -86,54 +121,189 @@ export default abstract class NetcdfApi {
   /**
    * Retrieves data chunks from a NetCDF file using CERv2 format.
    *
-   * @param file - The NetCDF file to retrieve data chunks from.
-   * @param options - Additional options for filtering and chunk size.
+   * Every record carries its sequence number. If the stream breaks, it is resumed
+   * after the last received record, up to MAX_RESUME_ATTEMPTS times in a row.
+   * Requests the remote service is too busy for (429 and 503) are retried the same
+   * way after the delay of their Retry-After header.
+   * The records are received in the compact schema and decoded to objects with
+   * the grid indices, the variables and an array of values per time variable.
+   *
+   * @param handle - The handle of the cached NetCDF file to retrieve data chunks from.
+   * @param options - Additional options for filtering, chunk size, the range of records
+   * and the number of decimals values are rounded to.
    * @returns An AsyncGenerator that yields individual data chunks.
    * @throws FailedToParseError if there's an issue parsing the NetCDF file or processing the request.
    */
   static async *getCERv2DataChunks(
-    file: Express.Multer.File,
-    options?: { filter?: string[]; stepSize?: number }
+    handle: string,
+    options?: {
+      filter?: string[];
+      stepSize?: number;
+      start?: number;
+      maxRecords?: number;
+      precision?: number;
+    }
   ): AsyncGenerator<any, any, any> {
-    try {
-      const url = this.netCdf_endpoint + "/cerv2-data-chunks";
+    const url =
+      this.netCdf_endpoint + "/datasets/" + handle + "/cerv2-data-chunks";
+    // Sequence number of the next record and number of records still requested
+    let start = options?.start ?? 0;
+    let remaining = options?.maxRecords;
+    let attempts = 0;
 
-      // Create form data
-      const formData = new FormData();
-      const blob = new Blob([file.buffer], { type: file.mimetype });
-      formData.append("file", blob, file.originalname);
-      if (options?.filter) {
-        formData.append("filter_variables", options.filter.join(","));
-      }
-      if (options?.stepSize) {
-        formData.append("step_size", JSON.stringify(options.stepSize));
+    for (;;) {
+      try {
+        const records = this.streamCERv2Records(url, {
+          ...options,
+          start,
+          maxRecords: remaining,
+        });
+        for await (const record of records) {
+          start = record.seq + 1;
+          if (remaining !== undefined) {
+            remaining--;
+          }
+          attempts = 0;
+          yield record;
+        }
+        return;
+      } catch (error) {
+        console.log(error);
+        const status = axios.isAxiosError(error)
+          ? error.response?.status
+          : undefined;
+        // A busy service accepts the request later, other rejected requests
+        // would be rejected again
+        const busy = status === 429 || status === 503;
+        const rejected = status !== undefined && status < 500 && !busy;
+        if (rejected || ++attempts > this.MAX_RESUME_ATTEMPTS) {
+          throw new FailedToParseError(
+            "Failed to parse the provided NetCDF file."
+          );
+        }
+        if (busy) {
+          await new Promise((resolve) =>
+            setTimeout(resolve, this.getRetryDelay(error))
+          );
+        }
       }
+    }
+  }
 
-      // Post form data and receive response stream
-      const response = await axios.post(url, formData, {
-        responseType: "stream",
-      });
+  /**
+   * Returns the time to wait before retrying a request the remote service was too busy for.
+   *
+   * @param error - The error of the rejected request.
+   * @returns The delay in milliseconds given by the Retry-After header, one second by default.
+   */
+  private static getRetryDelay(error: any): number {
+    const retryAfter = error.response?.headers?.["retry-after"];
+    if (retryAfter === undefined) {
+      return 1000;
+    }
+    // The header holds either a number of seconds or an HTTP date
+    const seconds = Number(retryAfter);
+    const delay = Number.isNaN(seconds)
+      ? Date.parse(retryAfter) - Date.now()
+      : seconds * 1000;
+    return Number.isNaN(delay) ? 1000 : Math.max(delay, 0);
+  }
 
-      // Handle response stream
-      let jsonData = "";
-      for await (const chunk of response.data) {
-        jsonData += chunk;
-        const lines = jsonData.split("||*split*||");
-        // Process all lines except the last one
-        for (let i = 0; i < lines.length - 1; i++) {
-          yield JSON.parse(lines[i]);
+  /**
+   * Requests a range of CERv2 records and decodes the NDJSON response stream.
+   *
+   * @param url - The URL of the CERv2 data chunks of a cached NetCDF file.
+   * @param options - Options for filtering, chunk size, the range of records and precision.
+   * @returns An AsyncGenerator that yields the decoded records.
+   */
+  private static async *streamCERv2Records(
+    url: string,
+    options: {
+      filter?: string[];
+      stepSize?: number;
+      start: number;
+      maxRecords?: number;
+      precision?: number;
+    }
+  ): AsyncGenerator<any, any, any> {
+    // Create form data
+    const formData = new FormData();
+    if (options.filter) {
+      formData.append("filter_variables", options.filter.join(","));
+    }
+    if (options.stepSize) {
+      formData.append("step_size", JSON.stringify(options.stepSize));
+    }
+    formData.append("start", JSON.stringify(options.start));
+    if (options.maxRecords !== undefined) {
+      formData.append("max_records", JSON.stringify(options.maxRecords));
+    }
+    if (options.precision !== undefined) {
+      formData.append("precision", JSON.stringify(options.precision));
+    }
+    // Receive a header followed by one JSON array per line
+    formData.append("framing", "ndjson");
+    formData.append("schema", "compact");
+
+    // Post form data and receive response stream
+    const response = await axios.post(url, formData, {
+      responseType: "stream",
+    });
+    // Decode multi-byte characters split across chunks correctly
+    response.data.setEncoding("utf8");
+
+    // Handle response stream, only new data is searched for line ends
+    let header: any;
+    let buffer = "";
+    for await (const chunk of response.data) {
+      let start = 0;
+      let end = buffer.length;
+      buffer += chunk;
+      while ((end = buffer.indexOf("\n", end)) !== -1) {
+        const message = JSON.parse(buffer.slice(start, end));
+        if (Array.isArray(message)) {
+          yield this.decodeCompactRecord(header, message);
+        } else {
+          header = message.header;
         }
-        // Keep the last line for the next chunk
-        jsonData = lines[lines.length - 1];
+        start = end + 1;
+        end = start;
       }
+      // Keep the incomplete last line for the next chunk
+      buffer = buffer.slice(start);
+    }
 
-      // Process the remaining JSON line if it exists
-      if (jsonData.trim() !== "") {
-        yield JSON.parse(jsonData);
-      }
-    } catch (error) {
-      console.log(error);
-      throw new FailedToParseError("Failed to parse the provided NetCDF file.");
+    // Process the remaining JSON line if it exists
+    if (buffer.trim() !== "") {
+      yield this.decodeCompactRecord(header, JSON.parse(buffer));
     }
   }
+
+  /**
+   * Decodes a CERv2 record of the compact schema using the header of its stream.
+   *
+   * @param header - The header, with the fields of the records and the grid dimensions.
+   * @param record - The sequence number followed by the values of the fields.
+   * @returns The record with its grid indices, variables and time variables.
+   */
+  private static decodeCompactRecord(header: any, record: any[]) {
+    const columns = header.dimensions.south_north;
+    const seq = record[0];
+    const vars: Record<string, any> = {};
+    const timeVars: Record<string, any[]> = {};
+    header.fields.slice(1).forEach((name: string, i: number) => {
+      if (i < header.vars) {
+        vars[name] = record[i + 1];
+      } else {
+        timeVars[name] = record[i + 1];
+      }
+    });
+    return {
+      seq,
+      x: Math.floor(seq / columns),
+      y: seq % columns,
+      vars,
+      timeVars,
+    };
+  }
 }
@@ -1,48 +1,411 @@
-import subprocess
+"""
+HTTP load generator for the backend services.
+
+The requests are sent from this process over pooled keep-alive connections
+(one per worker thread), so process startup does not distort the timings. The
+request can be given as a curl command (the subset used for the evaluation:
+-X, -H, -F, -d and the URL) or with --url, --method, --header, --form and --data.
+
+Two modes are supported:
+
+- closed: --parallel workers send the next request as soon as the previous one
+  finished, until --requests requests were sent.
+- open: requests are started at a fixed --rate per second, independent of the
+  response times, with at most --parallel requests in flight. Latencies are
+  measured from the scheduled start, so a slow service is not hidden by the load
+  generator waiting for it (coordinated omission).
+
+The report contains the p50/p90/p99/p99.9 latency and time to first byte,
+the throughput and the errors by status code or exception. The latency
+histograms can be exported as JSON and CSV.
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import logging
+import math
+import mimetypes
+import os
+import queue
+import shlex
 import statistics
+import threading
 import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor
-import argparse
-import logging
+from urllib.parse import urlsplit
+
+# Size of the reads of the response bodies
+READ_SIZE = 64 * 1024
+
+# Latency histogram buckets grow by this factor, starting at HISTOGRAM_MIN seconds
+HISTOGRAM_FACTOR = 2 ** (1 / 8)
+HISTOGRAM_MIN = 0.0001
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class RequestSpec:
+    """
+    A request which is sent repeatedly. The body is built once.
+    """
+
+    def __init__(self, url, method="GET", headers=None, body=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL {url}")
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.method = method
+        self.headers = dict(headers or {})
+        self.body = body
+
+    @classmethod
+    def from_options(cls, url, method=None, headers=(), form=(), data=None):
+        """
+        Builds a request from curl-like options.
+
+        Args:
+            url (str): The URL.
+            method (str): The method, POST with a body and GET otherwise by default.
+            headers (list): "Name: value" headers.
+            form (list): "name=value" or "name=@path" multipart fields.
+            data (str): The raw body, "@path" reads it from a file.
+        """
+        header_dict = {}
+        for header in headers:
+            name, _, value = header.partition(":")
+            header_dict[name.strip()] = value.strip()
+        body = None
+        if form:
+            boundary = uuid.uuid4().hex
+            body = encode_multipart(form, boundary)
+            header_dict["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        elif data is not None:
+            body = read_file(data[1:]) if data.startswith("@") else data.encode()
+        return cls(url, method or ("POST" if body is not None else "GET"), header_dict, body)
+
+    @classmethod
+    def from_curl_command(cls, command):
+        """
+        Builds a request from a curl command, see from_options.
+        """
+        arguments = shlex.split(command)
+        if arguments and arguments[0] == "curl":
+            arguments = arguments[1:]
+        url = None
+        options = {"method": None, "headers": [], "form": [], "data": None}
+        iterator = iter(arguments)
+        for argument in iterator:
+            if argument in ("-X", "--request"):
+                options["method"] = next(iterator)
+            elif argument in ("-H", "--header"):
+                options["headers"].append(next(iterator))
+            elif argument in ("-F", "--form"):
+                options["form"].append(next(iterator))
+            elif argument in ("-d", "--data", "--data-raw", "--data-binary"):
+                options["data"] = next(iterator)
+            elif argument.startswith("-"):
+                logging.warning(f"Ignoring the curl option {argument}")
+            else:
+                url = argument
+        if url is None:
+            raise ValueError("The curl command has no URL")
+        return cls.from_options(url, **options)
+
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def encode_multipart(fields, boundary):
+    """
+    Encodes "name=value" and "name=@path" fields as a multipart/form-data body.
+    """
+    parts = []
+    for field in fields:
+        name, _, value = field.partition("=")
+        if value.startswith("@"):
+            path = value[1:]
+            filename = os.path.basename(path)
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            header = (
+                f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f"Content-Type: {content_type}\r\n"
+            )
+            content = read_file(path)
+        else:
+            header = f'Content-Disposition: form-data; name="{name}"\r\n'
+            content = value.encode()
+        parts.append(f"--{boundary}\r\n{header}\r\n".encode() + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts)
+
+
+class ConnectionPool:
+    """
+    A pool of keep-alive connections to the host of a request.
+
+    Connections are reused after successful requests and discarded after errors.
+    """
+
+    def __init__(self, spec, timeout):
+        self.spec = spec
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            connection_class = (
+                http.client.HTTPSConnection
+                if self.spec.scheme == "https"
+                else http.client.HTTPConnection
+            )
+            return connection_class(self.spec.host, self.spec.port, timeout=self.timeout)
+
+    def release(self, connection):
+        self.idle.put(connection)
 
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
 
-class CurlBenchmark:
-    def __init__(self, curl_command: str, num_requests: int, num_parallel: int):
-        self.curl_command = curl_command
-        logging.info(f"Curl command: {curl_command}")
+
+class Sample:
+    """
+    The measurements of a single request, in seconds since its (scheduled) start.
+    """
+
+    __slots__ = ("latency", "ttfb", "status", "size", "error")
+
+    def __init__(self, latency, ttfb=None, status=None, size=0, error=None):
+        self.latency = latency
+        self.ttfb = ttfb
+        self.status = status
+        self.size = size
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def send_request(spec, pool, start=None):
+    """
+    Sends a request and reads the whole response.
+
+    Args:
+        spec (RequestSpec): The request.
+        pool (ConnectionPool): The pool to take the connection from.
+        start (float): The scheduled start as time.perf_counter() value, now by default.
+
+    Returns:
+        Sample: The measurements. Status codes of 400 and above are errors.
+    """
+    start = time.perf_counter() if start is None else start
+    connection = pool.acquire()
+    try:
+        connection.request(spec.method, spec.path, body=spec.body, headers=spec.headers)
+        response = connection.getresponse()
+        ttfb = None
+        size = 0
+        while True:
+            chunk = response.read1(READ_SIZE)
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            if not chunk:
+                break
+            size += len(chunk)
+        latency = time.perf_counter() - start
+    except (OSError, http.client.HTTPException) as e:
+        connection.close()
+        return Sample(time.perf_counter() - start, error=type(e).__name__)
+
+    if response.will_close:
+        connection.close()
+    else:
+        pool.release(connection)
+    error = f"HTTP {response.status}" if response.status >= 400 else None
+    return Sample(latency, ttfb, response.status, size, error)
+
+
+class HttpBenchmark:
+    def __init__(self, spec, num_requests, num_parallel, timeout=600):
+        self.spec = spec
+        logging.info(f"Request: {spec.method} {spec.url}")
         self.num_requests = num_requests
         logging.info(f"Number of requests: {num_requests}")
         self.num_parallel = num_parallel
         logging.info(f"Number of parallel requests: {num_parallel}")
-        self.timings = []
+        self.pool = ConnectionPool(spec, timeout)
+        self.samples = []
+        self.samples_lock = threading.Lock()
+        self.duration = 0
+
+    def record(self, sample):
+        with self.samples_lock:
+            self.samples.append(sample)
+        if sample.ok:
+            logging.debug(f"Request time: {sample.latency:.4f} seconds")
+        else:
+            logging.warning(f"Request failed after {sample.latency:.4f} seconds: {sample.error}")
+
+    def warm_up(self, num_requests):
+        """
+        Sends requests which are not recorded, e.g. to fill the caches of the services.
+        """
+        for _ in range(num_requests):
+            send_request(self.spec, self.pool)
+
+    def run_closed_loop(self):
+        """
+        Sends the requests with num_parallel workers, each waiting for its response
+        before sending the next request.
+        """
+        remaining = iter(range(self.num_requests))
+        remaining_lock = threading.Lock()
 
-    def run_curl(self):
-        start_time = time.time()
-        result = subprocess.run(
-            self.curl_command, capture_output=True, text=True, shell=True
-        )
-        end_time = time.time()
+        def worker():
+            while True:
+                with remaining_lock:
+                    if next(remaining, None) is None:
+                        return
+                self.record(send_request(self.spec, self.pool))
 
-        if result.returncode == 0:
-            time_taken = end_time - start_time
-            self.timings.append(time_taken)
-            logging.info(f"Request time: {time_taken:.4f} seconds")
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(self.num_parallel)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.duration = time.perf_counter() - start
 
-    def benchmark(self):
+    def run_open_loop(self, rate):
+        """
+        Starts the requests at a fixed rate, with at most num_parallel requests in
+        flight. Requests which cannot start on time because all workers are busy
+        wait, and the waiting time is part of their latency.
+        """
+        start = time.perf_counter()
         with ThreadPoolExecutor(max_workers=self.num_parallel) as executor:
-            for _ in range(self.num_requests):
-                executor.submit(self.run_curl)
+            for index in range(self.num_requests):
+                scheduled = start + index / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(
+                    lambda scheduled=scheduled: self.record(
+                        send_request(self.spec, self.pool, scheduled)
+                    )
+                )
+        self.duration = time.perf_counter() - start
 
-        if self.timings:
-            average_time = statistics.mean(self.timings)
-            min_time = min(self.timings)
-            max_time = max(self.timings)
-            std_dev = statistics.stdev(self.timings)
+    def summary(self):
+        """
+        Returns the statistics of the recorded requests.
+        """
+        successful = [sample for sample in self.samples if sample.ok]
+        errors = {}
+        for sample in self.samples:
+            if not sample.ok:
+                errors[sample.error] = errors.get(sample.error, 0) + 1
+        latencies = [sample.latency for sample in successful]
+        ttfbs = [sample.ttfb for sample in successful]
+        size = sum(sample.size for sample in successful)
+        return {
+            "method": self.spec.method,
+            "url": self.spec.url,
+            "requests": len(self.samples),
+            "successful": len(successful),
+            "errors": errors,
+            "parallel": self.num_parallel,
+            "duration": self.duration,
+            "throughput": len(successful) / self.duration if self.duration else 0,
+            "bytes_per_second": size / self.duration if self.duration else 0,
+            "latency": describe(latencies),
+            "ttfb": describe(ttfbs),
+        }
 
-            logging.info(f"Average time taken per request: {average_time:.4f} seconds")
-            logging.info(f"Minimum time taken: {min_time:.4f} seconds")
-            logging.info(f"Maximum time taken: {max_time:.4f} seconds")
-            logging.info(f"Standard deviation: {std_dev:.4f} seconds")
+    def histograms(self):
+        """
+        Returns the latency and time to first byte histograms of the successful requests.
+        """
+        successful = [sample for sample in self.samples if sample.ok]
+        return {
+            "latency": histogram([sample.latency for sample in successful]),
+            "ttfb": histogram([sample.ttfb for sample in successful]),
+        }
+
+
+def percentile(sorted_values, percent):
+    """
+    Returns the nearest-rank percentile of sorted values.
+    """
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def describe(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    description = {
+        "mean": statistics.mean(values),
+        "min": values[0],
+        "max": values[-1],
+        "stdev": statistics.stdev(values) if len(values) > 1 else 0,
+    }
+    for percent in PERCENTILES:
+        description[f"p{percent:g}"] = percentile(values, percent)
+    return description
+
+
+def histogram(values):
+    """
+    Counts values in logarithmic buckets.
+
+    Returns:
+        list: [lower bound, upper bound, count] of the non-empty buckets, in seconds.
+    """
+    counts = {}
+    for value in values:
+        index = max(0, math.floor(math.log(max(value, HISTOGRAM_MIN) / HISTOGRAM_MIN, HISTOGRAM_FACTOR)))
+        counts[index] = counts.get(index, 0) + 1
+    return [
+        [HISTOGRAM_MIN * HISTOGRAM_FACTOR**index, HISTOGRAM_MIN * HISTOGRAM_FACTOR ** (index + 1), count]
+        for index, count in sorted(counts.items())
+    ]
+
+
+def log_summary(summary):
+    logging.info(f"Requests: {summary['requests']} ({summary['successful']} successful) in {summary['duration']:.2f} seconds")
+    logging.info(f"Throughput: {summary['throughput']:.2f} requests per second, {summary['bytes_per_second'] / 1e6:.2f} MB per second")
+    for name, label in (("latency", "Latency"), ("ttfb", "Time to first byte")):
+        description = summary[name]
+        if description:
+            percentiles = ", ".join(f"p{percent:g} {description[f'p{percent:g}']:.4f}" for percent in PERCENTILES)
+            logging.info(f"{label}: mean {description['mean']:.4f}, min {description['min']:.4f}, max {description['max']:.4f}, {percentiles} seconds")
+    for error, count in summary["errors"].items():
+        logging.info(f"Errors: {count} x {error}")
+
+
+def export_csv(histograms, path):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["metric", "lower_seconds", "upper_seconds", "count"])
+        for name, buckets in histograms.items():
+            for lower, upper, count in buckets:
+                writer.writerow([name, f"{lower:.6f}", f"{upper:.6f}", count])
 
 
 def main():
@@ -50,19 +413,53 @@ def main():
         level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
     )
 
-    parser = argparse.ArgumentParser(description="Benchmark curl requests.")
-    parser.add_argument("--curl_command", required=True, help="Full curl command")
+    parser = argparse.ArgumentParser(description="Benchmark HTTP requests.")
+    parser.add_argument("--curl_command", help="Full curl command")
+    parser.add_argument("--url", help="URL of the request, instead of a curl command")
+    parser.add_argument("--method", help="Method of the request")
+    parser.add_argument("--header", action="append", default=[], help="'Name: value' header, can be repeated")
+    parser.add_argument("--form", action="append", default=[], help="'name=value' or 'name=@path' multipart field, can be repeated")
+    parser.add_argument("--data", help="Body of the request, '@path' reads it from a file")
     parser.add_argument(
         "--requests", type=int, default=10, help="Number of requests to perform"
     )
     parser.add_argument(
         "--parallel", type=int, default=1, help="Number of parallel requests"
     )
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed", help="Closed loop or fixed arrival rate")
+    parser.add_argument("--rate", type=float, help="Requests per second in the open loop mode")
+    parser.add_argument("--warmup", type=int, default=0, help="Number of unrecorded requests sent first")
+    parser.add_argument("--timeout", type=float, default=600, help="Socket timeout in seconds")
+    parser.add_argument("--json", help="Path to export the summary and the histograms as JSON")
+    parser.add_argument("--csv", help="Path to export the histograms as CSV")
     args = parser.parse_args()
 
-    benchmark = CurlBenchmark(args.curl_command, args.requests, args.parallel)
+    if args.curl_command:
+        spec = RequestSpec.from_curl_command(args.curl_command)
+    elif args.url:
+        spec = RequestSpec.from_options(args.url, args.method, args.header, args.form, args.data)
+    else:
+        parser.error("Either --curl_command or --url is required")
+    if args.mode == "open" and not args.rate:
+        parser.error("The open loop mode requires --rate")
+
+    benchmark = HttpBenchmark(spec, args.requests, args.parallel, args.timeout)
+    benchmark.warm_up(args.warmup)
     logging.info("Benchmarking...")
-    benchmark.benchmark()
+    if args.mode == "open":
+        benchmark.run_open_loop(args.rate)
+    else:
+        benchmark.run_closed_loop()
+    benchmark.pool.close()
+
+    summary = benchmark.summary()
+    log_summary(summary)
+    histograms = benchmark.histograms()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(dict(summary, mode=args.mode, rate=args.rate, histograms=histograms), file, indent=2)
+    if args.csv:
+        export_csv(histograms, args.csv)
 
 
 if __name__ == "__main__":
@@ -21,9 +21,58 @@ if __name__ == "__main__":
         default=10,
         help="Number of documents to create",
     )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Number of documents inserted at once",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes generating and inserting documents",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed to generate the same documents in every run",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=["random", "cerv2"],
+        default="random",
+        help="Random documents, or CERv2 documents of a dense grid with time variables",
+    )
+    parser.add_argument(
+        "--grid-columns",
+        type=int,
+        default=300,
+        help="Number of points per grid row of the CERv2 documents",
+    )
+    parser.add_argument(
+        "--time-steps",
+        type=int,
+        default=24,
+        help="Number of time steps of the time variables of the CERv2 documents",
+    )
     args = parser.parse_args()
 
     if args.function == "seed":
-        seed_mongo(args.mongo_url, args.num_documents)
+        seed_mongo(
+            args.mongo_url,
+            args.num_documents,
+            args.batch_size,
+            args.workers,
+            args.seed,
+            args.mode,
+            args.grid_columns,
+            args.time_steps,
+        )
     elif args.function == "cleanup":
         cleanup_mongo(args.mongo_url)
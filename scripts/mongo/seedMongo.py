@@ -1,24 +1,41 @@
+import math
 import random
 import json
+import time
+import uuid
+from multiprocessing import Pool
 from faker import Faker
+from pymongo.errors import BulkWriteError
 from utils import generate_coordinates, connect_mongo
 
+# Bounding box of the synthetic CERV2 grid (Berlin area)
+GRID_LONGITUDE_RANGE = (13.0832, 13.7612)
+GRID_LATITUDE_RANGE = (52.3381, 52.6755)
+# Variables of the synthetic CERV2 documents, with and without a time dimension
+CERV2_VARIABLES = ("HGT", "LANDMASK")
+CERV2_TIME_VARIABLES = ("T2", "Q2", "U10", "V10", "RAINNC")
+# Minimum interval (in seconds) between two progress reports
+REPORT_INTERVAL = 1
 
-def generate_fake_data(fake):
+# Connection of the current worker process
+collection = None
+
+
+def generate_fake_data(fake, rng=random):
     """Generate fake data using faker"""
     title = fake.sentence()
     description = fake.paragraph()
-    dataType = random.choice(["REFERENCED", "NOTREFERENCED"])
-    dataSet = random.choice(["NONE","SIMRA","CERV2"])
-    tags = [fake.word() for _ in range(random.randint(1, 5))]
+    dataType = rng.choice(["REFERENCED", "NOTREFERENCED"])
+    dataSet = rng.choice(["NONE","SIMRA","CERV2"])
+    tags = [fake.word() for _ in range(rng.randint(1, 5))]
     tags.append("fake")  # To distinguish from real data
 
     if dataType == "REFERENCED":
         url = fake.url()
-        mediaType = random.choice(["VIDEO", "PICTURE", "SOUND"])
-        content = {"url": url, "mediaType": mediaType, "location": {"type": "Point", "coordinates": generate_coordinates()}}
+        mediaType = rng.choice(["VIDEO", "PICTURE", "SOUND"])
+        content = {"url": url, "mediaType": mediaType, "location": {"type": "Point", "coordinates": generate_coordinates(rng)}}
     else:
-        content = {"location": {"type": "Point", "coordinates": generate_coordinates()}, "data": json.loads(fake.json())}
+        content = {"location": {"type": "Point", "coordinates": generate_coordinates(rng)}, "data": json.loads(fake.json())}
 
     return {
         "title": title,
@@ -30,14 +47,106 @@ def generate_fake_data(fake):
     }
 
 
-def seed_mongo(mongoDB_url: str, num_documents: int):
-    """Generate and insert synthetic data"""
-    print(f"Connecting to {mongoDB_url}")
-    collection = connect_mongo(mongoDB_url)
+def generate_cerv2_data(rng, index, options):
+    """Generate a document of a grid point like the CERV2 ingestion of the public API"""
+    columns, rows = options["grid_columns"], options["grid_rows"]
+    x, y = divmod(index, columns)
+    # The grid spans the bounding box, so every point has distinct coordinates
+    longitude_step = (GRID_LONGITUDE_RANGE[1] - GRID_LONGITUDE_RANGE[0]) / max(rows - 1, 1)
+    latitude_step = (GRID_LATITUDE_RANGE[1] - GRID_LATITUDE_RANGE[0]) / max(columns - 1, 1)
+    longitude = GRID_LONGITUDE_RANGE[0] + x * longitude_step
+    latitude = GRID_LATITUDE_RANGE[0] + y * latitude_step
+    time_steps = options["time_steps"]
+    file_name = f"cerv2_fake_{options['upload_id'][:8]}.nc"
+
+    return {
+        "title": f"{file_name}_{index}",
+        "description": f"A datapoint no.{index} from CERV2 dataset file: {file_name}",
+        "dataType": "NOTREFERENCED",
+        "dataSet": "CERV2",
+        "tags": ["CERv2", "fake", "lon", "lat", *CERV2_VARIABLES, *CERV2_TIME_VARIABLES],
+        "uploadID": options["upload_id"],
+        "content": {
+            "data": {
+                "vars": {name: round(rng.uniform(0, 100), 2) for name in CERV2_VARIABLES},
+                # The values of all time variables per time index
+                "timeVars": {
+                    str(t): {name: round(rng.uniform(-10, 40), 2) for name in CERV2_TIME_VARIABLES}
+                    for t in range(time_steps)
+                },
+            },
+            "location": {"type": "Point", "coordinates": [longitude, latitude]},
+        },
+    }
+
+
+def generate_batch(start: int, size: int, options: dict):
+    """Generate the documents of a batch, reproducibly from the seed and the batch start"""
+    # Every batch gets its own seed, derived from the seed and the batch start without overlaps
+    seed = None if options["seed"] is None else f"{options['seed']}:{start}"
+    rng = random.Random(seed)
+    if options["mode"] == "cerv2":
+        return [generate_cerv2_data(rng, start + i, options) for i in range(size)]
     fake = Faker()
+    fake.seed_instance(seed)
+    return [generate_fake_data(fake, rng) for _ in range(size)]
+
+
+def init_worker(mongoDB_url: str):
+    """Connect the worker process to mongo"""
+    global collection
+    collection = connect_mongo(mongoDB_url)
+
+
+def insert_batch(task):
+    """Generate a batch and insert it unordered, returns the number of inserted documents"""
+    start, size, options = task
+    documents = generate_batch(start, size, options)
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        # The documents without errors are still inserted
+        print(f"Error inserting {len(e.details['writeErrors'])} documents: {e.details['writeErrors'][0]['errmsg']}")
+        return e.details["nInserted"]
+
+
+def seed_mongo(
+    mongoDB_url: str,
+    num_documents: int,
+    batch_size: int = 1000,
+    workers: int = 1,
+    seed: int = None,
+    mode: str = "random",
+    grid_columns: int = 300,
+    time_steps: int = 24,
+):
+    """Generate and insert synthetic data in batches, using several worker processes"""
+    print(f"Connecting to {mongoDB_url}")
+    rng = random.Random(seed)
+    options = {
+        "seed": seed,
+        "mode": mode,
+        "grid_columns": grid_columns,
+        "grid_rows": math.ceil(num_documents / grid_columns),
+        "time_steps": time_steps,
+        "upload_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+    }
+    tasks = [
+        (start, min(batch_size, num_documents - start), options)
+        for start in range(0, num_documents, batch_size)
+    ]
+
+    inserted = 0
+    started = last_report = time.perf_counter()
     try:
-        for _ in range(num_documents):
-            collection.insert_one(generate_fake_data(fake))
-        print(f"Data seeding completed. Added {num_documents} random documents.")
+        with Pool(workers, initializer=init_worker, initargs=(mongoDB_url,)) as pool:
+            for count in pool.imap_unordered(insert_batch, tasks):
+                inserted += count
+                now = time.perf_counter()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    print(f"{inserted}/{num_documents} documents, {inserted / (now - started):.0f} documents/s")
     except Exception as e:
-        print(f"Error inserting document: {e}")
+        print(f"Error inserting documents: {e}")
+    elapsed = time.perf_counter() - started
+    print(f"Data seeding completed. Added {inserted} {mode} documents in {elapsed:.1f}s ({inserted / max(elapsed, 1e-9):.0f} documents/s).")
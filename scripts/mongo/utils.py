@@ -4,10 +4,10 @@ from pymongo import MongoClient
 COLLECTION_NAME = "datafiles"
 
 
-def generate_coordinates():
+def generate_coordinates(rng=random):
     """Function to generate random coordinates within Berlin area"""
-    longitude = random.uniform(13.0832, 13.7612)
-    latitude = random.uniform(52.3381, 52.6755)
+    longitude = rng.uniform(13.0832, 13.7612)
+    latitude = rng.uniform(52.3381, 52.6755)
     return [longitude, latitude]
 
 